@@ -1,36 +1,149 @@
-from models import db, Findings, Category, Status, Severity, Project, Image, Users,Roles,Permissions
+import click
+from models import db, Findings, Category, Status, Severity, Project, Image, Users,Roles,Permissions, Job, lookups
 from flask_migrate import Migrate
-from flask import Flask, request, jsonify, url_for, send_file
+from flask import Flask, Response, request, jsonify, url_for, send_file, abort, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 from datetime import datetime
 import os
 from flask_jwt_extended import (
-    JWTManager, create_access_token, jwt_required, get_jwt_identity
+    JWTManager, create_access_token, jwt_required, get_jwt, get_jwt_identity
 )
 from werkzeug.utils import secure_filename
-from io import BytesIO
+from pagination import InvalidQueryParam, filter_findings, filter_updated_since, keyset_paginate, page_headers
+from streaming import ndjson_response, wants_stream
+from fields import Fields
+from search import SearchUnavailable, clear_index, create_schema, rebuild_index, search_findings
+from stats import clear_stats, project_stats, rebuild_stats
+from authz import authorize, check_access, registered_permissions, token_claims
+from passwords import HASH_PREFIXES, KdfBusy, passwords
+from image_store import UploadTooLarge, image_store
+from uploads import UploadError, upload_sessions
+from bulk import import_findings, read_rows, select_findings, update_findings
+from werkzeug.http import parse_content_range_header
+from derivatives import FORMATS, derivatives
+from json_provider import init_json
+from compression import compression
+from db_engine import configure_pool_telemetry, engine_options, pool_stats
+from metrics import metrics
+from profiler import profiler, query_budget
+from render import FORMATS as REPORT_FORMATS, renderer
+from jobs import jobs
+from export import export_filename, export_project
+from sqlalchemy.orm import defer, undefer
 
 load_dotenv()
 app = Flask(__name__)
 CORS(app)
-app.config["DEBUG"] = True 
+app.config['DEBUG'] = os.getenv('FLASK_DEBUG', 'false').lower() in ('1', 'true', 'yes')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI')
+app.config['SQLALCHEMY_ECHO'] = os.getenv('SQLALCHEMY_ECHO', 'false').lower() in ('1', 'true', 'yes')
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))
+app.config['DB_POOL_SLOW_CHECKOUT'] = float(os.getenv('DB_POOL_SLOW_CHECKOUT', 0.5))
+app.config['DB_POOL_LEAK_TIMEOUT'] = float(os.getenv('DB_POOL_LEAK_TIMEOUT', 60))
+app.config['DB_POOL_TRACK_STACKS'] = os.getenv('DB_POOL_TRACK_STACKS', 'false').lower() in ('1', 'true', 'yes')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config, app.config['SQLALCHEMY_DATABASE_URI'])
 app.config ['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
+app.config['STREAM_BATCH_SIZE'] = int(os.getenv('STREAM_BATCH_SIZE', 500))
+app.config['IMAGE_STORE_PATH'] = os.getenv('IMAGE_STORE_PATH', os.path.join(app.instance_path, 'images'))
+app.config['IMAGE_GC_GRACE'] = int(os.getenv('IMAGE_GC_GRACE', 60 * 60))
+app.config['IMAGE_CACHE_MAX_AGE'] = int(os.getenv('IMAGE_CACHE_MAX_AGE', 365 * 24 * 60 * 60))
+app.config['IMAGE_DERIVATIVE_WIDTHS'] = [int(w) for w in os.getenv('IMAGE_DERIVATIVE_WIDTHS', '160,320,800,1600').split(',')]
+app.config['IMAGE_DERIVATIVE_PRESETS'] = {'thumbnail': (160, 'webp'), 'medium': (800, 'webp')}
+app.config['IMAGE_DERIVATIVE_WORKERS'] = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 2))
+app.config['IMAGE_DERIVATIVE_TIMEOUT'] = float(os.getenv('IMAGE_DERIVATIVE_TIMEOUT', 30))
+app.config['UPLOAD_MAX_BYTES'] = int(os.getenv('UPLOAD_MAX_BYTES', 25 * 1024 * 1024))
+app.config['UPLOAD_ALLOWED_TYPES'] = os.getenv('UPLOAD_ALLOWED_TYPES', 'image/png,image/jpeg,image/gif,image/webp').split(',')
+app.config['UPLOAD_SESSION_TTL'] = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 60 * 60))
+app.config['BULK_BATCH_SIZE'] = int(os.getenv('BULK_BATCH_SIZE', 1000))
+app.config['BULK_MAX_FIELD_BYTES'] = int(os.getenv('BULK_MAX_FIELD_BYTES', 16 * 1024 * 1024))
+app.config['LOOKUP_CACHE_CHECK_INTERVAL'] = float(os.getenv('LOOKUP_CACHE_CHECK_INTERVAL', 1.0))
+app.config['AUTH_REQUIRED'] = os.getenv('AUTH_REQUIRED', 'false').lower() in ('1', 'true', 'yes')
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.getenv('PASSWORD_HASH_QUEUE', 16))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+app.config['JSON_PROVIDER'] = os.getenv('JSON_PROVIDER', 'orjson')
+app.config['JSON_DATETIME_FORMAT'] = os.getenv('JSON_DATETIME_FORMAT', 'http')
+app.config['COMPRESS_ENABLED'] = os.getenv('COMPRESS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_MIMETYPES'] = os.getenv('COMPRESS_MIMETYPES', 'application/json,application/x-ndjson,text/plain,text/csv,text/html,text/markdown').split(',')
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+app.config['ASYNC_DATABASE_URI'] = os.getenv('ASYNC_DATABASE_URI')
+app.config['ASGI_WSGI_WORKERS'] = int(os.getenv('ASGI_WSGI_WORKERS', 10))
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+app.config['SQL_PROFILER'] = os.getenv('SQL_PROFILER', 'off')
+app.config['SQL_PROFILER_REPEAT_THRESHOLD'] = int(os.getenv('SQL_PROFILER_REPEAT_THRESHOLD', 3))
+app.config['SQL_PROFILER_HISTORY'] = int(os.getenv('SQL_PROFILER_HISTORY', 100))
+app.config['SQL_PROFILER_MAX_STATEMENTS'] = int(os.getenv('SQL_PROFILER_MAX_STATEMENTS', 500))
+app.config['REPORT_TEMPLATE_PATH'] = os.getenv('REPORT_TEMPLATE_PATH', os.path.join(app.root_path, 'templates', 'report'))
+app.config['REPORT_CACHE_PATH'] = os.getenv('REPORT_CACHE_PATH', os.path.join(app.instance_path, 'report-cache'))
+app.config['REPORT_BATCH_SIZE'] = int(os.getenv('REPORT_BATCH_SIZE', 500))
+app.config['EXPORT_BATCH_SIZE'] = int(os.getenv('EXPORT_BATCH_SIZE', 200))
+app.config['JOB_RESULT_PATH'] = os.getenv('JOB_RESULT_PATH', os.path.join(app.instance_path, 'job-results'))
+app.config['JOB_RESULT_TTL'] = int(os.getenv('JOB_RESULT_TTL', 7 * 24 * 60 * 60))
+app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))
+app.config['JOB_POLL_INTERVAL'] = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+app.config['JOB_HEARTBEAT_INTERVAL'] = float(os.getenv('JOB_HEARTBEAT_INTERVAL', 10))
+app.config['JOB_STALE_AFTER'] = int(os.getenv('JOB_STALE_AFTER', 120))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+app.config['JOB_SHUTDOWN_TIMEOUT'] = float(os.getenv('JOB_SHUTDOWN_TIMEOUT', 10))
+configure_pool_telemetry(app.config)
 db.init_app(app)
+image_store.init_app(app)
+derivatives.init_app(app)
+upload_sessions.init_app(app)
+lookups.init_app(app)
+passwords.init_app(app)
+renderer.init_app(app)
+jobs.init_app(app)
+init_json(app)
+# after_request hooks run in reverse, registering metrics first lets it see the compressed size
+metrics.init_app(app)
+profiler.init_app(app)
+compression.init_app(app)
 migrate = Migrate(app, db)
 jwt = JWTManager(app)
 
+@app.errorhandler(InvalidQueryParam)
+def invalid_query_param(error):
+    return {'error': str(error)}, 400
+
+@app.errorhandler(KdfBusy)
+def kdf_busy(error):
+    return {'error': str(error)}, 503, {'Retry-After': '1'}
+
+@app.errorhandler(SearchUnavailable)
+def search_unavailable(error):
+    return {'error': str(error)}, 501
+
+@app.errorhandler(UploadError)
+def upload_error(error):
+    return {'error': str(error), **error.extra}, error.status
+
 @app.route('/')
 def index():
     return "Welcome to the API"
 
 @app.route('/projects', methods=['GET', 'POST'])
+@authorize('projects')
+@query_budget(2)
 def projects():
     if request.method == 'GET':
-        projects = Project.query.all()
-        return [project.to_dict() for project in projects]
+        fields = Fields.from_args(request.args)
+        query = filter_updated_since(Project.query, Project, request.args).options(*Project.eager_options(fields))
+        if wants_stream():
+            query = query.order_by(Project.created_at, Project.id)
+            return ndjson_response(query, lambda project: project.to_dict(fields))
+        projects, next_cursor = keyset_paginate(query, Project, request.args)
+        return [project.to_dict(fields) for project in projects], 200, page_headers(next_cursor)
     elif request.method == 'POST':
         data = request.get_json()
         project = Project(name=data['name'], description=data['description'],created_at=data['created_at'])
@@ -39,12 +152,18 @@ def projects():
         return {'message': 'Project created successfully'}, 201
 
 @app.route('/project/<int:project_id>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+@authorize('projects')
+@query_budget(2)
 def project(project_id):
-    project = Project.query.get(project_id)
+    fields = Fields.from_args(request.args)
+    query = Project.query
+    if request.method in ('GET', 'DELETE'):
+        query = query.options(*Project.eager_options(fields))
+    project = query.get(project_id)
     if not project:
         return {'error': 'Project not found'}, 404
     if request.method == 'GET':
-        return project.to_dict()
+        return project.to_dict(fields)
     
     elif request.method == 'PUT':
         data = request.get_json()
@@ -61,72 +180,187 @@ def project(project_id):
         db.session.commit()
         return {'message': 'Project deleted successfully'}, 200
     
+@app.route('/projects/stats', methods=['GET'])
+@authorize('projects')
+@query_budget(1)
+def projects_stats():
+    return list(project_stats().values())
+
+@app.route('/project/<int:project_id>/stats', methods=['GET'])
+@authorize('projects')
+@query_budget(2)
+def project_stats_detail(project_id):
+    if not db.session.query(Project.id).filter_by(id=project_id).first():
+        return {'error': 'Project not found'}, 404
+    stats = project_stats([project_id])
+    return stats.get(project_id, {'project_id': project_id, 'total': 0, 'severity': [], 'category': [], 'status': []})
+
+@app.route('/project/<int:project_id>/report.<fmt>', methods=['GET'])
+@authorize('projects')
+def project_report(project_id, fmt):
+    if fmt not in REPORT_FORMATS:
+        return {'error': f'Unknown report format, expected one of: {", ".join(REPORT_FORMATS)}'}, 404
+    project = Project.query.get(project_id)
+    if not project:
+        return {'error': 'Project not found'}, 404
+    body, stats = renderer.render(project, fmt)
+    headers = {
+        'Content-Type': REPORT_FORMATS[fmt][2],
+        'X-Report-Fragments': f"{stats['cached']} cached, {stats['rendered']} rendered",
+    }
+    if fmt == 'docx':
+        headers['Content-Disposition'] = f'attachment; filename="{report_filename(project)}.docx"'
+    return body, 200, headers
+
+@app.route('/project/<int:project_id>/export.zip', methods=['GET'])
+@authorize('projects')
+def project_export(project_id):
+    project = db.session.get(Project, project_id)
+    if not project:
+        return {'error': 'Project not found'}, 404
+    filename = export_filename(project)
+
+    def generate():
+        for chunk in export_project(project_id, app.config['EXPORT_BATCH_SIZE']):
+            if chunk:
+                yield chunk
+
+    # stream_with_context keeps the app context until the archive is sent, export_project works
+    # through db.session, so that context's teardown releases the connection
+    return Response(stream_with_context(generate()), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+def validate_project_id(params):
+    if not isinstance(params.get('project_id'), int):
+        raise ValueError('project_id must be an integer')
+
+@jobs.handler('project-export', 'projects:read', validate=validate_project_id)
+def project_export_job(ctx, params):
+    project = db.session.get(Project, params['project_id'])
+    if not project:
+        raise ValueError('Project not found')
+    path = ctx.result_path(export_filename(project), 'application/zip')
+    with open(path, 'wb') as f:
+        for chunk in export_project(project.id, app.config['EXPORT_BATCH_SIZE'], ctx.progress):
+            f.write(chunk)
+    return {'size': os.path.getsize(path)}
+
+def report_filename(project):
+    return secure_filename(project.name or '') or f'project-{project.id}'
+
+def validate_report_params(params):
+    if params.get('fmt') not in REPORT_FORMATS:
+        raise ValueError(f'fmt must be one of: {", ".join(REPORT_FORMATS)}')
+    validate_project_id(params)
+
+@jobs.handler('report', 'projects:read', validate=validate_report_params)
+def report_job(ctx, params):
+    project = db.session.get(Project, params['project_id'])
+    if not project:
+        raise ValueError('Project not found')
+    fmt = params['fmt']
+    body, stats = renderer.render(project, fmt, progress=ctx.progress)
+    with open(ctx.result_path(f'{report_filename(project)}.{fmt}', REPORT_FORMATS[fmt][2]), 'wb') as f:
+        f.write(body.encode('utf-8') if isinstance(body, str) else body)
+    return stats
+
 @app.route('/categories', methods=['GET', 'POST'])
+@authorize('categories')
+@query_budget(2)
 def categories():
     if request.method == 'GET':
-        categories = Category.query.all()
-        return [category.to_dict() for category in categories]
+        fields = Fields.from_args(request.args)
+        categories = Category.query.options(*Category.eager_options(fields)).all()
+        return [category.to_dict(fields) for category in categories]
     elif request.method == 'POST':
         data = request.get_json()
         category = Category(name=data['name'])
         db.session.add(category)
+        lookups.invalidate('categories')
         db.session.commit()
         return {'message': 'Category created successfully'}, 201
 @app.route('/category/<int:category_id>', methods=['GET', 'PUT', 'DELETE'])
+@authorize('categories')
+@query_budget(2)
 def category(category_id):
-    category = Category.query.get(category_id)
+    fields = Fields.from_args(request.args)
+    query = Category.query
+    if request.method == 'GET':
+        query = query.options(*Category.eager_options(fields))
+    category = query.get(category_id)
     if not category:
         return {'error': 'Category not found'}, 404
     if request.method == 'GET':
-        return category.to_dict()
+        return category.to_dict(fields)
     elif request.method == 'PUT':
         data = request.get_json()
         category.name = data['name']
         category.updated_at = datetime.now()
+        lookups.invalidate('categories')
         db.session.commit()
         return {'message': 'Category updated successfully'}, 200
     elif request.method == 'DELETE':
         db.session.delete(category)
+        lookups.invalidate('categories')
         db.session.commit()
         return {'message': 'Category deleted successfully'}, 200
 
 
 @app.route('/severities', methods=['GET', 'POST'])
+@authorize('severities')
+@query_budget(2)
 def severities():
     if request.method == 'GET':
-        severities = Severity.query.all()
-        return [severity.to_dict() for severity in severities]
+        fields = Fields.from_args(request.args)
+        severities = Severity.query.options(*Severity.eager_options(fields)).all()
+        return [severity.to_dict(fields) for severity in severities]
     elif request.method == 'POST':
         data = request.get_json()
         severity = Severity(name=data['name'])
         db.session.add(severity)
+        lookups.invalidate('severities')
         db.session.commit()
         return {'message': 'Severity created successfully'}, 201
 
 @app.route('/severity/<int:severity_id>', methods=['GET', 'PUT', 'DELETE'])
+@authorize('severities')
+@query_budget(2)
 def severity(severity_id):
-    severity = Severity.query.get(severity_id)
+    fields = Fields.from_args(request.args)
+    query = Severity.query
+    if request.method == 'GET':
+        query = query.options(*Severity.eager_options(fields))
+    severity = query.get(severity_id)
     if not severity:
         return {'error': 'Severity not found'}, 404
     if request.method == 'GET':
-        return severity.to_dict()
+        return severity.to_dict(fields)
     elif request.method == 'PUT':
         data = request.get_json()
         severity.name = data['name']
         severity.updated_at = datetime.now()
+        lookups.invalidate('severities')
         db.session.commit()
         return {'message': 'Severity updated successfully'}, 200
     elif request.method == 'DELETE':
         db.session.delete(severity)
+        lookups.invalidate('severities')
         db.session.commit()
         return {'message': 'Severity deleted successfully'}, 200
     
     
 @app.route('/findings', methods=['GET', 'POST'])
+@authorize('findings')
+@query_budget(1)
 def findings():
     if request.method == 'GET':
-        findings = Findings.query.all()
-        return [finding.shallow_to_dict() for finding in findings]
+        fields = Fields.from_args(request.args)
+        query = filter_findings(Findings.query, request.args).options(*Findings.eager_options(fields))
+        if wants_stream():
+            query = query.order_by(Findings.created_at, Findings.id)
+            return ndjson_response(query, lambda finding: finding.shallow_to_dict(fields))
+        findings, next_cursor = keyset_paginate(query, Findings, request.args)
+        return [finding.shallow_to_dict(fields) for finding in findings], 200, page_headers(next_cursor)
     elif request.method == 'POST':
         data = request.get_json()
         finding = Findings(title=data['title'], description=data['description'], project_id=data['project_id'], category_id=data['category_id'], severity_id=data['severity_id'])
@@ -134,13 +368,72 @@ def findings():
         db.session.commit()
         return {'message': 'Finding created successfully'}, 201
 
+@app.route('/findings/bulk', methods=['POST'])
+@authorize('findings')
+def bulk_import_findings():
+    # all rows go in one transaction, with ?partial=1 the valid rows are kept when others fail
+    partial = request.args.get('partial') in ('1', 'true')
+    try:
+        inserted, errors = import_findings(read_rows(request), app.config['BULK_BATCH_SIZE'])
+    except ValueError as error:
+        db.session.rollback()
+        return {'error': str(error)}, 400
+    if errors and not partial:
+        db.session.rollback()
+        return {'inserted': 0, 'errors': errors}, 422
+    db.session.commit()
+    return {'inserted': inserted, 'errors': errors}, 201
+
+def validate_import_params(params):
+    if not isinstance(params.get('rows'), list):
+        raise ValueError('rows must be a JSON array')
+
+# /findings/bulk as a job, for imports that would outlast the proxy timeout
+@jobs.handler('findings-import', 'findings:write', validate=validate_import_params)
+def findings_import_job(ctx, params):
+    rows, batch_size = params['rows'], app.config['BULK_BATCH_SIZE']
+
+    def numbered():
+        for number, raw in enumerate(rows, start=1):
+            if number % batch_size == 0:
+                ctx.progress(number, len(rows))
+            yield number, raw, None
+
+    inserted, errors = import_findings(numbered(), batch_size)
+    if errors and not params.get('partial'):
+        db.session.rollback()
+        return {'inserted': 0, 'errors': errors}
+    db.session.commit()
+    ctx.progress(len(rows), len(rows))
+    return {'inserted': inserted, 'errors': errors}
+
+@app.route('/findings/bulk', methods=['PATCH'])
+@authorize('findings')
+def bulk_update_findings():
+    data = request.get_json()
+    if not isinstance(data, dict) or 'patch' not in data:
+        return {'error': 'patch is required'}, 400
+    try:
+        updated = update_findings(select_findings(Findings.query, data), data['patch'])
+    except ValueError as error:
+        db.session.rollback()
+        return {'error': str(error)}, 400
+    db.session.commit()
+    return {'message': 'Findings updated successfully', 'updated': updated}, 200
+
 @app.route('/finding/<int:finding_id>', methods=['GET', 'PUT', 'DELETE'])
+@authorize('findings')
+@query_budget(1)
 def finding(finding_id):    
-    finding = Findings.query.get(finding_id)
+    fields = Fields.from_args(request.args)
+    query = Findings.query
+    if request.method == 'GET':
+        query = query.options(*Findings.eager_options(fields))
+    finding = query.get(finding_id)
     if not finding:
         return {'error': 'Finding not found'}, 404
     if request.method == 'GET':
-        return finding.to_dict()
+        return finding.to_dict(fields)
     elif request.method == 'PUT':
         data = request.get_json()
         finding.title = data['title']
@@ -157,29 +450,27 @@ def finding(finding_id):
         return {'message': 'Finding deleted successfully'}, 200
     
 @app.route('/delete/all/findings', methods=['DELETE'])
+@authorize('findings')
 def delete_all_findings():
     Findings.query.delete()
+    clear_index(db.session.connection())
+    clear_stats(db.session.connection())
     db.session.commit()
     return {'message': 'All findings deleted successfully'}, 200
 
-@app.route('/api/uploadFile', methods=['POST'])
-def upload_file():
-    file = request.files.get('image')
-    if not file:
-        return jsonify({'success': 0, 'message': 'No file uploaded'}), 400
-
-    filename = secure_filename(file.filename)
-    content_type = file.content_type
-    data = file.read()
-
+def create_image(filename, content_type, digest, size):
     image = Image(
         filename=filename,
         content_type=content_type,
-        data=data
+        sha256=digest,
+        size=size
     )
     db.session.add(image)
     db.session.commit()
+    derivatives.warm(digest)
+    return image
 
+def image_response(image):
     image_url = url_for('get_image', image_id=image.id, _external=True)
 
     return jsonify({
@@ -188,32 +479,138 @@ def upload_file():
             'url': image_url
         }
     }), 200
-    
+
+@app.route('/api/uploadFile', methods=['POST'])
+@authorize('images')
+def upload_file():
+    file = request.files.get('image')
+    if not file:
+        return jsonify({'success': 0, 'message': 'No file uploaded'}), 400
+
+    filename = secure_filename(file.filename)
+    content_type = file.content_type
+    # Editor.js shows `message` from a {"success": 0} body, the UploadError handler answers the resumable API's way
+    try:
+        upload_sessions.check(content_type)
+    except UploadError as error:
+        return jsonify({'success': 0, 'message': str(error)}), error.status
+    try:
+        digest, size = image_store.save_stream(file.stream, max_bytes=app.config['UPLOAD_MAX_BYTES'])
+    except UploadTooLarge as error:
+        return jsonify({'success': 0, 'message': str(error)}), 413
+
+    image = create_image(filename, content_type, digest, size)
+    return image_response(image)
+
+@app.route('/api/uploads', methods=['POST'])
+@authorize('images')
+def create_upload():
+    data = request.get_json()
+    if not data or 'filename' not in data or 'content_type' not in data:
+        return {'error': 'filename and content_type are required'}, 400
+    upload_id = upload_sessions.create(secure_filename(data['filename']), data['content_type'], data.get('size'))
+    return {'upload_id': upload_id, 'offset': 0}, 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@authorize('images')
+def upload(upload_id):
+    if request.method == 'GET':
+        return upload_sessions.status(upload_id)
+    elif request.method == 'PUT':
+        offset = request.args.get('offset', type=int)
+        content_range = parse_content_range_header(request.headers.get('Content-Range'))
+        if offset is None and content_range:
+            offset = content_range.start
+        if offset is None:
+            return {'error': 'offset or Content-Range is required'}, 400
+        offset = upload_sessions.append(upload_id, offset, request.stream)
+        return {'upload_id': upload_id, 'offset': offset}, 200
+    elif request.method == 'DELETE':
+        upload_sessions.discard(upload_id)
+        return {'message': 'Upload discarded successfully'}, 200
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@authorize('images')
+def complete_upload(upload_id):
+    meta, digest, size = upload_sessions.finalize(upload_id)
+    image = create_image(meta['filename'], meta['content_type'], digest, size)
+    return image_response(image)
+
+def move_to_store(image):
+    image.sha256, image.size = image_store.save_bytes(image.data)
+    image.data = None
+
+# left open on purpose, images are embedded with <img> tags that can't send a bearer token
 @app.route('/api/image/<int:image_id>')
 def get_image(image_id):
     image = Image.query.get_or_404(image_id)
-    return send_file(BytesIO(image.data), mimetype=image.content_type)
+    if not image.sha256:
+        if image.data is None:
+            abort(404)
+        # rows from before the image store carry their blob inline, move it out on first read
+        move_to_store(image)
+        db.session.commit()
+    return image_file_response(image)
+
+def image_file_response(image):
+    path, etag, mimetype = image_store.path_for(image.sha256), image.sha256, image.content_type
+    try:
+        variant = derivatives.resolve(request.args)
+    except ValueError as error:
+        return {'error': str(error)}, 400
+    if variant and derivatives.available and (image.content_type or '').startswith('image/'):
+        width, fmt = variant
+        # falls back to the original when the image can't be converted
+        derivative_path = derivatives.get(image.sha256, width, fmt)
+        if derivative_path:
+            path, etag, mimetype = derivative_path, f'{image.sha256}-{width}.{fmt}', FORMATS[fmt][1]
+    # send_file answers If-None-Match/If-Modified-Since with a 304 and Range with a 206
+    # from the file on disk, the images.data column is never read here
+    try:
+        response = send_file(
+            path,
+            mimetype=mimetype,
+            etag=etag,
+            last_modified=image.uploaded_at,
+            max_age=app.config['IMAGE_CACHE_MAX_AGE'],
+            conditional=True
+        )
+    except FileNotFoundError:
+        abort(404)
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/api/deleteImage/<int:image_id>', methods=['DELETE'])
+@authorize('images')
 def delete_image(image_id):
     image = Image.query.get_or_404(image_id)
+    digest = image.sha256
     db.session.delete(image)
     db.session.commit()
+    if digest and not Image.query.filter_by(sha256=digest).first() and image_store.delete(digest):
+        derivatives.delete(digest)
     return jsonify({'success': 1}), 200
 
 @app.route('/users', methods=['GET', 'POST'])
+@authorize('users')
+@query_budget(1)
 def users():
     if request.method == 'GET':
-        users = Users.query.all()
+        query = Users.query
+        if wants_stream():
+            return ndjson_response(query.order_by(Users.id), Users.to_dict)
+        users = query.all()
         return [user.to_dict() for user in users]
     elif request.method == 'POST':
         data = request.get_json()
-        user = Users(name=data['name'], email=data['email'], password=data['password'], role_id=data['role_id'])
+        user = Users(name=data['name'], email=data['email'], password=passwords.hash(data['password']), role_id=data['role_id'])
         db.session.add(user)
         db.session.commit()
         return {'message': 'User created successfully'}, 201
 
 @app.route('/user/<int:user_id>', methods=['GET', 'PUT', 'DELETE'])
+@authorize('users')
+@query_budget(1)
 def user(user_id):
     user = Users.query.get(user_id)
     if not user:
@@ -224,7 +621,7 @@ def user(user_id):
         data = request.get_json()
         user.name = data['name']
         user.email = data['email']
-        user.password = data['password']
+        user.password = passwords.hash(data['password'])
         user.role_id = data['role_id']
         user.updated_at = datetime.now()
         db.session.commit()
@@ -235,20 +632,28 @@ def user(user_id):
         return {'message': 'User deleted successfully'}, 200
     
 @app.route('/roles', methods=['GET', 'POST'])
+@authorize('roles')
+@query_budget(2)
 def roles():
     if request.method == 'GET':
-        roles = Roles.query.all()
+        roles = Roles.query.options(*Roles.eager_options()).all()
         return [role.to_dict() for role in roles]
     elif request.method == 'POST':
         data = request.get_json()
         role = Roles(name=data['name'])
         db.session.add(role)
+        lookups.invalidate('roles')
         db.session.commit()
         return {'message': 'Role created successfully'}, 201
     
 @app.route('/role/<int:role_id>', methods=['GET', 'PUT', 'DELETE'])
+@authorize('roles')
+@query_budget(2)
 def role(role_id):
-    role = Roles.query.get(role_id)
+    query = Roles.query
+    if request.method == 'GET':
+        query = query.options(*Roles.eager_options())
+    role = query.get(role_id)
     if not role:
         return {'error': 'Role not found'}, 404
     if request.method == 'GET':
@@ -256,14 +661,18 @@ def role(role_id):
     elif request.method == 'PUT':
         data = request.get_json()
         role.name = data['name']
+        lookups.invalidate('roles')
         db.session.commit()
         return {'message': 'Role updated successfully'}, 200
     elif request.method == 'DELETE':
         db.session.delete(role)
+        lookups.invalidate('roles')
         db.session.commit()
         return {'message': 'Role deleted successfully'}, 200
     
 @app.route('/permissions', methods=['GET', 'POST'])
+@authorize('permissions')
+@query_budget(1)
 def permissions():
     if request.method == 'GET':
         permissions = Permissions.query.all()
@@ -272,10 +681,13 @@ def permissions():
         data = request.get_json()
         permission = Permissions(name=data['name'])
         db.session.add(permission)
+        lookups.invalidate('permissions')
         db.session.commit()
         return {'message': 'Permission created successfully'}, 201
     
 @app.route('/permission/<int:permission_id>', methods=['GET', 'PUT', 'DELETE'])
+@authorize('permissions')
+@query_budget(1)
 def permission(permission_id):
     permission = Permissions.query.get(permission_id)
     if not permission:
@@ -285,16 +697,20 @@ def permission(permission_id):
     elif request.method == 'PUT':
         data = request.get_json()
         permission.name = data['name']
+        lookups.invalidate('permissions', 'roles')
         db.session.commit()
         return {'message': 'Permission updated successfully'}, 200
     elif request.method == 'DELETE':
         db.session.delete(permission)
+        lookups.invalidate('permissions', 'roles')
         db.session.commit()
         return {'message': 'Permission deleted successfully'}, 200
     
 @app.route('/roles/<int:role_id>/permissions', methods=['GET', 'POST'])
+@authorize('roles')
+@query_budget(2)
 def role_permissions(role_id):
-    role = Roles.query.get(role_id)
+    role = Roles.query.options(*Roles.eager_options()).get(role_id)
     if not role:
         return {'error': 'Role not found'}, 404
 
@@ -314,9 +730,141 @@ def role_permissions(role_id):
             return {'message': 'Permission already assigned to role'}, 200
 
         role.permissions.append(permission)
+        lookups.invalidate('roles')
         db.session.commit()
         return {'message': 'Permission added to role successfully'}, 201
     
+@app.route('/search', methods=['GET'])
+@authorize('findings')
+@query_budget(2)
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return {'error': 'q is required'}, 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    hits = search_findings(query, limit, offset, request.args.get('project_id', type=int))
+    fields = Fields.from_args(request.args)
+    ids = [id for id, _, _ in hits]
+    findings = {
+        finding.id: finding
+        for finding in Findings.query.options(*Findings.eager_options(fields)).filter(Findings.id.in_(ids))
+    }
+    results = [
+        {'finding': findings[id].shallow_to_dict(fields), 'score': score, 'snippet': snippet}
+        for id, score, snippet in hits if id in findings
+    ]
+    headers = {'X-Next-Offset': str(offset + limit)} if len(hits) == limit else {}
+    return results, 200, headers
+
+def own_jobs(query):
+    # a job is only visible to whoever submitted it, other users' job ids answer 404
+    if app.config['AUTH_REQUIRED']:
+        query = query.filter(Job.created_by == get_jwt().get('uid'))
+    return query
+
+def own_job(job_id):
+    return own_jobs(Job.query).filter(Job.id == job_id).first()
+
+@app.route('/jobs', methods=['GET', 'POST'])
+@authorize('jobs')
+@query_budget(1)
+def job_list():
+    if request.method == 'GET':
+        # params can be a whole import, the list leaves them out, GET /jobs/<id> has them
+        query = own_jobs(Job.query).options(defer(Job.params))
+        if request.args.get('status'):
+            query = query.filter(Job.status == request.args['status'])
+        if request.args.get('kind'):
+            query = query.filter(Job.kind == request.args['kind'])
+        limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+        return [job.to_dict(params=False) for job in query.order_by(Job.created_at.desc(), Job.id).limit(limit)]
+    elif request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        kind = jobs.handlers.get(data.get('kind'))
+        # the job does the work the matching endpoint would, so it needs the same permissions
+        denied = check_access(None, kind.permissions) if kind and kind.permissions else None
+        if denied:
+            return denied
+        created_by = get_jwt().get('uid') if app.config['AUTH_REQUIRED'] else None
+        try:
+            job = jobs.submit(data.get('kind'), data.get('params', {}), data.get('name'), created_by)
+        except ValueError as error:
+            return {'error': str(error)}, 400
+        return job.to_dict(), 202, {'Location': url_for('job_detail', job_id=job.id)}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@authorize('jobs')
+@query_budget(1)
+def job_detail(job_id):
+    job = own_job(job_id)
+    if not job:
+        return {'error': 'Job not found'}, 404
+    return job.to_dict()
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@authorize('jobs')
+def cancel_job(job_id):
+    job = own_job(job_id)
+    if not job:
+        return {'error': 'Job not found'}, 404
+    outcome = jobs.cancel(job_id)
+    if outcome is None:
+        return {'error': f'Job already {job.status}', **job.to_dict()}, 409
+    # a running job stops at its next progress report
+    return job.to_dict(), 200 if outcome == 'cancelled' else 202
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+@authorize('jobs')
+@query_budget(1)
+def job_result(job_id):
+    job = own_job(job_id)
+    if not job:
+        return {'error': 'Job not found'}, 404
+    if job.status != 'succeeded':
+        return {'error': f'Job is {job.status}', 'status': job.status}, 409
+    if not job.result_file:
+        return {'result': job.result}
+    path = jobs.path_for(job)
+    if not os.path.exists(path):
+        return {'error': 'Job result is no longer available'}, 410
+    return send_file(path, mimetype=job.result_type, as_attachment=True,
+                     download_name=os.path.basename(job.result_file), conditional=True)
+
+@app.route('/cache/stats', methods=['GET'])
+@authorize(None, 'system:read')
+def cache_stats():
+    return lookups.stats()
+
+# scraped by Prometheus without a token, keep it off the public ingress
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not metrics.enabled:
+        return {'error': 'Metrics are disabled or prometheus_client is not installed'}, 404
+    body, content_type = metrics.render()
+    return body, 200, {'Content-Type': content_type}
+
+@app.route('/debug/sql-profiles', methods=['GET'])
+@authorize(None, 'system:read')
+def sql_profiles():
+    return profiler.recent()
+
+@app.route('/debug/sql-profiles/<profile_id>', methods=['GET'])
+@authorize(None, 'system:read')
+def sql_profile(profile_id):
+    profile = profiler.get(profile_id)
+    if not profile:
+        return {'error': 'Profile not found'}, 404
+    return profile
+
+@app.route('/db/pool/stats', methods=['GET'])
+@authorize(None, 'system:read')
+def db_pool_stats():
+    stats = {'sync': pool_stats(db.engine)}
+    if 'async_engine' in app.extensions:
+        stats['async'] = pool_stats(app.extensions['async_engine'])
+    return stats
+
 @app.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -325,19 +873,134 @@ def login():
     user = Users.query.filter_by(email=email).first()
     if not user:
         return {'error': 'User not found'}, 404
-    if user.password != password:
+    matches, needs_rehash = passwords.verify(user.password, password)
+    if not matches:
         return {'error': 'Invalid password'}, 401
-    
-    access_token = create_access_token(identity=str(user.email))
+    if needs_rehash:
+        # plaintext or an outdated PASSWORD_HASH_METHOD, upgrade while we have the password
+        user.password = passwords.hash(password)
+        db.session.commit()
+
+    access_token = create_access_token(identity=str(user.email), additional_claims=token_claims(user))
     return jsonify({'access_token': access_token}), 200
 
 @app.route('/protected',methods=['GET'])
 @jwt_required()
 def protected():
-    current_user = get_jwt_identity()
-    user = Users.query.filter_by(email=current_user).first()
+    claims = get_jwt()
+    if 'uid' in claims:
+        user = Users.query.get(claims['uid'])
+    else:
+        user = Users.query.filter_by(email=get_jwt_identity()).first()
     if not user:
         return {'error': 'User not found'}, 404
     return user.to_dict()
+@app.cli.command('backfill-images')
+@click.option('--batch-size', default=100, show_default=True, help='Images moved per transaction.')
+def backfill_images(batch_size):
+    """Move legacy images.data blobs into the image store."""
+    moved = 0
+    while True:
+        images = (Image.query
+                  .filter(Image.sha256.is_(None), Image.data.isnot(None))
+                  .options(undefer(Image.data))
+                  .order_by(Image.id)
+                  .limit(batch_size)
+                  .all())
+        if not images:
+            break
+        for image in images:
+            move_to_store(image)
+        db.session.commit()
+        db.session.expunge_all()
+        moved += len(images)
+        click.echo(f'moved {moved} images')
+    click.echo(f'done, {moved} images moved to {image_store.root}')
+
+@app.cli.command('images-gc')
+@click.option('--batch-size', default=500, show_default=True, help='Stored files checked per query.')
+def images_gc(batch_size):
+    """Delete stored images no row references, once past IMAGE_GC_GRACE."""
+    removed, kept = 0, 0
+
+    def sweep(batch):
+        nonlocal removed, kept
+        referenced = {digest for (digest,) in db.session.query(Image.sha256).filter(Image.sha256.in_(batch))}
+        for digest in batch:
+            if digest in referenced:
+                continue
+            if image_store.delete(digest):
+                derivatives.delete(digest)
+                removed += 1
+            else:
+                kept += 1
+
+    batch = []
+    for digest in image_store.digests():
+        batch.append(digest)
+        if len(batch) >= batch_size:
+            sweep(batch)
+            batch = []
+    if batch:
+        sweep(batch)
+    click.echo(f'removed {removed} unreferenced images, {kept} kept until they are older than {image_store.grace}s')
+
+@app.cli.command('search-reindex')
+@click.option('--batch-size', default=1000, show_default=True, help='Findings indexed per statement.')
+def search_reindex(batch_size):
+    """Rebuild the findings full-text index."""
+    create_schema(db.session.connection())
+    indexed = rebuild_index(batch_size)
+    db.session.commit()
+    click.echo(f'indexed {indexed} findings')
+
+@app.cli.command('stats-rebuild')
+def stats_rebuild():
+    """Recompute project_stats from the findings table."""
+    rebuild_stats(db.session.connection())
+    db.session.commit()
+    click.echo('project stats rebuilt')
+
+@app.cli.command('permissions-sync')
+def permissions_sync():
+    """Create a permissions row for every name used by @authorize."""
+    existing = {name for (name,) in db.session.query(Permissions.name)}
+    missing = sorted(registered_permissions - existing)
+    db.session.add_all([Permissions(name=name) for name in missing])
+    lookups.invalidate('permissions')
+    db.session.commit()
+    click.echo(f'created {len(missing)} permissions: {", ".join(missing)}' if missing else 'permissions are up to date')
+
+@app.cli.command('report-cache-clear')
+def report_cache_clear():
+    """Delete every cached report fragment."""
+    renderer.cache.clear()
+    click.echo(f'cleared {renderer.cache.root}')
+
+@app.cli.command('jobs-worker')
+@click.option('--processes', type=int, help='Worker processes, defaults to JOB_WORKERS.')
+def jobs_worker(processes):
+    """Run queued jobs in a pool of local worker processes."""
+    processes = processes or app.config['JOB_WORKERS']
+    click.echo(f'running jobs with {processes} worker processes, handlers: {", ".join(sorted(jobs.handlers))}')
+    jobs.serve(processes, app.import_name)
+
+@app.cli.command('jobs-purge')
+def jobs_purge():
+    """Requeue jobs of dead workers and delete results past JOB_RESULT_TTL."""
+    outcome = jobs.maintain()
+    click.echo(f"requeued {outcome['requeued']} stale jobs, purged {outcome['purged']} expired jobs")
+
+@app.cli.command('hash-plaintext-passwords')
+def hash_plaintext_passwords():
+    """Hash passwords still stored in plaintext."""
+    hashed = 0
+    for user in Users.query.filter(Users.password.isnot(None)):
+        if not user.password.startswith(HASH_PREFIXES):
+            user.password = passwords.hash(user.password)
+            hashed += 1
+    db.session.commit()
+    click.echo(f'hashed {hashed} passwords')
+
 if __name__ == '__main__':
-    app.run(debug=True,port=6060)
\ No newline at end of file
+    app.run(port=6060)
\ No newline at end of file
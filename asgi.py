@@ -0,0 +1,265 @@
+import asyncio
+import contextvars
+import functools
+import io
+import sys
+from a2wsgi import WSGIMiddleware
+from flask import abort, request
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from app import app, image_file_response
+from authz import check_access
+from db_engine import engine_options
+from fields import Fields
+from models import Category, Findings, Image, Project, Roles, Severity, lookups
+from pagination import filter_findings, filter_updated_since, keyset_page, keyset_query, page_headers
+from streaming import wants_stream
+
+# Async serving mode: uvicorn asgi:application --workers 4
+#
+# GET requests for the endpoints in `views` run here on an async engine (asyncpg, aiosqlite),
+# using the same models, eager_options, serializers, pagination, auth rules and JSON provider
+# as the Flask views. Everything else, including writes and NDJSON streams, is handed to the
+# Flask app on a thread pool, so both modes answer every route identically.
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+views = {}
+
+
+def async_view(endpoint):
+    def decorator(view):
+        views[endpoint] = view
+        return view
+    return decorator
+
+
+def async_database_uri(uri):
+    url = make_url(uri)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]).render_as_string(hide_password=False)
+
+
+async def run_sync(fn, *args, **kwargs):
+    # the copied context carries the Flask request context into the worker thread
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+def build_environ(scope):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+
+class AsyncApp:
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WSGIMiddleware(app, workers=app.config['ASGI_WSGI_WORKERS'])
+        self.engine = None
+        self.sessions = None
+
+    def session(self):
+        # created on first use so the engine's connections belong to the server's event loop
+        if self.sessions is None:
+            uri = self.app.config['ASYNC_DATABASE_URI'] or async_database_uri(self.app.config['SQLALCHEMY_DATABASE_URI'])
+            self.engine = create_async_engine(uri, **engine_options(self.app.config, uri, is_async=True))
+            self.app.extensions['async_engine'] = self.engine
+            self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        return self.sessions()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+            return await self.wsgi(scope, receive, send)
+        context = self.app.request_context(build_environ(scope))
+        context.push()
+        try:
+            view = views.get(request.endpoint)
+            if view is not None and request.routing_exception is None and not wants_stream():
+                response = await self.dispatch(view)
+                return await self.send_response(response, send)
+        finally:
+            context.pop()
+        return await self.wsgi(scope, receive, send)
+
+    async def dispatch(self, view):
+        # the same steps as Flask.full_dispatch_request, with an awaited view
+        try:
+            try:
+                rv = self.app.preprocess_request()
+                if rv is None:
+                    rv = await self.call_view(view)
+            except Exception as error:
+                rv = self.app.handle_user_exception(error)
+            return self.app.finalize_request(rv)
+        except Exception as error:
+            return self.app.handle_exception(error)
+
+    async def call_view(self, view):
+        authorization = getattr(self.app.view_functions[request.endpoint], 'authorization', None)
+        denied = await run_sync(self.prepare, authorization)
+        if denied:
+            return denied
+        async with self.session() as session:
+            return await view(session, **request.view_args)
+
+    def prepare(self, authorization):
+        # anything that can reach the sync engine (token checks, lookup reloads) runs off the event loop
+        lookups.warm()
+        if authorization is not None:
+            return check_access(*authorization)
+        return None
+
+    async def send_response(self, response, send):
+        environ = request.environ
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                   for name, value in response.get_wsgi_headers(environ).items()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        body = response.get_app_iter(environ)
+        try:
+            if response.is_streamed or response.direct_passthrough:
+                # files and generators may block, pull them chunk by chunk on the thread pool
+                chunks = iter(body)
+                while True:
+                    chunk = await run_sync(next, chunks, None)
+                    if chunk is None:
+                        break
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            else:
+                for chunk in body:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            response.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+@async_view('projects')
+async def projects(session):
+    fields = Fields.from_args(request.args)
+    query = filter_updated_since(select(Project), Project, request.args).options(*Project.eager_options(fields))
+    query, limit = keyset_query(query, Project, request.args)
+    projects, next_cursor = keyset_page((await session.scalars(query)).all(), limit)
+    return [project.to_dict(fields) for project in projects], 200, page_headers(next_cursor)
+
+
+@async_view('project')
+async def project(session, project_id):
+    fields = Fields.from_args(request.args)
+    project = await session.get(Project, project_id, options=Project.eager_options(fields))
+    if not project:
+        return {'error': 'Project not found'}, 404
+    return project.to_dict(fields)
+
+
+@async_view('findings')
+async def findings(session):
+    fields = Fields.from_args(request.args)
+    query = filter_findings(select(Findings), request.args).options(*Findings.eager_options(fields))
+    query, limit = keyset_query(query, Findings, request.args)
+    findings, next_cursor = keyset_page((await session.scalars(query)).all(), limit)
+    return [finding.shallow_to_dict(fields) for finding in findings], 200, page_headers(next_cursor)
+
+
+@async_view('finding')
+async def finding(session, finding_id):
+    fields = Fields.from_args(request.args)
+    finding = await session.get(Findings, finding_id, options=Findings.eager_options(fields))
+    if not finding:
+        return {'error': 'Finding not found'}, 404
+    return finding.to_dict(fields)
+
+
+@async_view('categories')
+async def categories(session):
+    fields = Fields.from_args(request.args)
+    categories = await session.scalars(select(Category).options(*Category.eager_options(fields)))
+    return [category.to_dict(fields) for category in categories]
+
+
+@async_view('category')
+async def category(session, category_id):
+    fields = Fields.from_args(request.args)
+    category = await session.get(Category, category_id, options=Category.eager_options(fields))
+    if not category:
+        return {'error': 'Category not found'}, 404
+    return category.to_dict(fields)
+
+
+@async_view('severities')
+async def severities(session):
+    fields = Fields.from_args(request.args)
+    severities = await session.scalars(select(Severity).options(*Severity.eager_options(fields)))
+    return [severity.to_dict(fields) for severity in severities]
+
+
+@async_view('severity')
+async def severity(session, severity_id):
+    fields = Fields.from_args(request.args)
+    severity = await session.get(Severity, severity_id, options=Severity.eager_options(fields))
+    if not severity:
+        return {'error': 'Severity not found'}, 404
+    return severity.to_dict(fields)
+
+
+@async_view('roles')
+async def roles(session):
+    roles = await session.scalars(select(Roles).options(*Roles.eager_options()))
+    return [role.to_dict() for role in roles]
+
+
+@async_view('role')
+async def role(session, role_id):
+    role = await session.get(Roles, role_id, options=Roles.eager_options())
+    if not role:
+        return {'error': 'Role not found'}, 404
+    return role.to_dict()
+
+
+@async_view('get_image')
+async def get_image(session, image_id):
+    image = await session.get(Image, image_id)
+    if image is None:
+        abort(404)
+    if not image.sha256:
+        # legacy inline blob, the sync view moves it into the image store
+        return await run_sync(app.view_functions['get_image'], image_id)
+    # derivative rendering and send_file's stat/open happen on the thread pool
+    return await run_sync(image_file_response, image)
+
+
+application = AsyncApp(app)
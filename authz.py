@@ -0,0 +1,75 @@
+from functools import wraps
+from flask import current_app, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from models import lookups
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+registered_permissions = set()
+
+
+# a role's permissions packed into an int, bit n set means the role holds permission id n.
+# Rebuilt only when the lookup cache hands back a new roles table.
+class PermissionBits:
+    def __init__(self):
+        self._roles = None
+        self._bits = {}
+
+    def for_role(self, role_id):
+        roles = lookups.all('roles')
+        if roles is not self._roles:
+            self._bits = {
+                id: sum(1 << permission['id'] for permission in role['permissions'])
+                for id, role in roles.items()
+            }
+            self._roles = roles
+        return self._bits.get(role_id, 0)
+
+    def mask(self, names):
+        ids = {permission['name']: id for id, permission in lookups.all('permissions').items()}
+        if any(name not in ids for name in names):
+            return None
+        return sum(1 << ids[name] for name in names)
+
+
+permission_bits = PermissionBits()
+
+
+def token_claims(user):
+    return {'uid': user.id, 'rid': user.role_id, 'pv': lookups.version('roles')}
+
+
+def has_permissions(claims, names):
+    lookups.version('roles', at_least=claims.get('pv', 0))
+    needed = permission_bits.mask(names)
+    if needed is None:
+        return False
+    return permission_bits.for_role(claims.get('rid')) & needed == needed
+
+
+def authorize(resource=None, *permissions):
+    # @authorize('projects') asks for projects:read on GET and projects:write otherwise,
+    # @authorize(None, 'reports:export') asks for exactly the listed permissions
+    for name in permissions or (f'{resource}:read', f'{resource}:write'):
+        registered_permissions.add(name)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            denied = check_access(resource, permissions)
+            if denied:
+                return denied
+            return view(*args, **kwargs)
+        # read by the async views in asgi.py, which apply the same rule to the same endpoint
+        wrapper.authorization = (resource, permissions)
+        return wrapper
+    return decorator
+
+
+def check_access(resource, permissions=()):
+    if not current_app.config['AUTH_REQUIRED']:
+        return None
+    verify_jwt_in_request()
+    needed = permissions or (f'{resource}:read' if request.method in READ_METHODS else f'{resource}:write',)
+    if not has_permissions(get_jwt(), needed):
+        return {'error': 'Forbidden'}, 403
+    return None
@@ -0,0 +1,133 @@
+"""Throughput and p99 latency of the sync (threaded WSGI) and async (ASGI) serving modes.
+
+    python -m benchmarks.async_vs_sync --concurrency 64 --seconds 10
+
+Each simulated client loads a report page the way the frontend does: the project, its
+findings, the lookups and a handful of images, all in parallel. Runs against a throwaway
+SQLite database unless DATABASE_URI is set (ASYNC_DATABASE_URI is derived from it).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+SERVERS = {
+    'sync': [sys.executable, '-c', 'from werkzeug.serving import run_simple; from app import app; '
+                                   'run_simple("127.0.0.1", {port}, app, threaded=True)'],
+    'async': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--port', '{port}',
+              '--log-level', 'warning'],
+}
+
+
+def seed(findings, images):
+    from app import app
+    from models import db, Category, Findings, Image, Project, Severity, Status
+    from image_store import image_store
+
+    with app.app_context():
+        db.create_all()
+        lookups = [Category(name='Injection'), Status(name='Open'), Severity(name='High')]
+        project = Project(name='benchmark', description={'blocks': []})
+        db.session.add_all(lookups + [project])
+        db.session.flush()
+        db.session.execute(Findings.__table__.insert(), [{
+            'project_id': project.id,
+            'title': f'Finding {n}',
+            'description': {'blocks': [{'type': 'paragraph', 'data': {'text': 'Details ' * 20}}]},
+            'category_id': lookups[0].id,
+            'status_id': lookups[1].id,
+            'severity_id': lookups[2].id,
+        } for n in range(findings)])
+        for n in range(images):
+            digest, size = image_store.save_bytes(os.urandom(32 * 1024))
+            db.session.add(Image(filename=f'{n}.png', content_type='image/png', sha256=digest, size=size))
+        db.session.commit()
+        return project.id, [image.id for image in Image.query.all()]
+
+
+def page_urls(project_id, image_ids):
+    return [
+        f'/project/{project_id}',
+        f'/findings?project_id={project_id}&limit=100',
+        '/categories',
+        '/severities',
+        '/roles',
+    ] + [f'/api/image/{id}' for id in image_ids]
+
+
+async def load(base_url, urls, concurrency, seconds):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+
+    async def fetch(client, url):
+        nonlocal errors
+        started = time.perf_counter()
+        response = await client.get(url)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors += 1
+
+    async def analyst(client):
+        while time.perf_counter() < deadline:
+            await asyncio.gather(*[fetch(client, url) for url in urls])
+
+    limits = httpx.Limits(max_connections=concurrency * len(urls))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[analyst(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def wait_for(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(base_url + '/', timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server at {base_url} did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=32, help='simulated report pages loading at once')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--findings', type=int, default=500)
+    parser.add_argument('--images', type=int, default=8)
+    parser.add_argument('--modes', nargs='*', default=list(SERVERS))
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    os.environ.setdefault('IMAGE_STORE_PATH', tempfile.mkdtemp())
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+    project_id, image_ids = seed(args.findings, args.images)
+    urls = page_urls(project_id, image_ids)
+
+    print(f'{"mode":<8} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for mode in args.modes:
+        command = [part.format(port=args.port) for part in SERVERS[mode]]
+        server = subprocess.Popen(command, env=os.environ.copy(), cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base_url = f'http://127.0.0.1:{args.port}'
+            wait_for(base_url)
+            latencies, errors, elapsed = asyncio.run(load(base_url, urls, args.concurrency, args.seconds))
+        finally:
+            server.terminate()
+            server.wait()
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f'{mode:<8} {len(latencies) / elapsed:>8.1f} {quantiles[49] * 1000:>8.1f} '
+              f'{quantiles[98] * 1000:>8.1f} {errors:>7}')
+
+
+if __name__ == '__main__':
+    main()
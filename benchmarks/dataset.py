@@ -0,0 +1,176 @@
+"""Seeded synthetic dataset for benchmarks.
+
+    python -m benchmarks.dataset --scale 100k --database-uri postgresql://localhost/findings_bench
+
+The same --seed always produces the same rows. Without --database-uri (or DATABASE_URI)
+the data goes to a throwaway SQLite file whose path is printed at the end.
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+FINDINGS_PER_PROJECT = 250
+BENCHMARK_PASSWORD = 'benchmark-password'
+# user N gets ROLES[N % 3]
+ROLES = ('admin', 'analyst', 'viewer')
+
+CATEGORIES = ['Injection', 'Broken Access Control', 'Cryptographic Failures', 'Insecure Design',
+              'Security Misconfiguration', 'Vulnerable Components', 'Authentication Failures',
+              'Integrity Failures', 'Logging Failures', 'Server-Side Request Forgery']
+STATUSES = ['Open', 'In Progress', 'Fixed', 'Accepted Risk', 'False Positive']
+SEVERITIES = ['Critical', 'High', 'Medium', 'Low', 'Informational']
+SUBJECTS = ['SQL injection', 'Stored XSS', 'Reflected XSS', 'IDOR', 'Path traversal', 'Open redirect',
+            'Missing rate limiting', 'Weak TLS configuration', 'Session fixation', 'CSRF', 'XXE',
+            'Insecure deserialization', 'Verbose error messages', 'Default credentials', 'SSRF']
+PLACES = ['the search endpoint', 'the login form', 'the file upload handler', 'the admin panel',
+          'the password reset flow', 'the export API', 'the profile page', 'the webhook receiver',
+          'the invoice PDF renderer', 'the GraphQL gateway', 'the mobile API', 'the SSO callback']
+WORDS = ('the application does not validate user supplied input before it is used in a query an attacker '
+         'can read modify or delete data belonging to other tenants the issue was confirmed manually and '
+         'reproduced with a proof of concept request the affected parameter is reflected without encoding '
+         'remediation requires parameterised queries output encoding and strict server side authorization '
+         'checks on every object reference').split()
+
+
+def set_environment(database_uri=None):
+    # has to run before the app is imported, app.py reads its config at import time
+    if database_uri:
+        os.environ['DATABASE_URI'] = database_uri
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    os.environ.setdefault('IMAGE_STORE_PATH', tempfile.mkdtemp())
+    os.environ.setdefault('REPORT_CACHE_PATH', tempfile.mkdtemp())
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+    return os.environ['DATABASE_URI']
+
+
+def sentence(rng, words=18):
+    text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(words // 2, words)))
+    return text[0].upper() + text[1:] + '.'
+
+
+def description(rng, image_urls):
+    # Editor.js document shaped like the ones the frontend saves
+    blocks = [
+        {'type': 'header', 'data': {'text': 'Description', 'level': 2}},
+        {'type': 'paragraph', 'data': {'text': ' '.join(sentence(rng) for _ in range(rng.randint(2, 5)))}},
+        {'type': 'header', 'data': {'text': 'Steps to reproduce', 'level': 3}},
+        {'type': 'list', 'data': {'style': 'ordered', 'items': [sentence(rng, 8) for _ in range(rng.randint(2, 6))]}},
+        {'type': 'code', 'data': {'code': f"GET /api/items?id={rng.randint(1, 9999)}' OR '1'='1 HTTP/1.1\nHost: target.example"}},
+    ]
+    if image_urls and rng.random() < 0.4:
+        blocks.append({'type': 'image', 'data': {'file': {'url': rng.choice(image_urls)},
+                                                 'caption': sentence(rng, 6), 'withBorder': False}})
+    blocks.append({'type': 'paragraph', 'data': {'text': '<b>Remediation:</b> ' + sentence(rng, 24)}})
+    return {'time': 1700000000000 + rng.randint(0, 10 ** 9), 'blocks': blocks, 'version': '2.28.2'}
+
+
+def image_bytes(rng, n):
+    try:
+        from PIL import Image as PILImage
+    except ImportError:
+        return rng.randbytes(24 * 1024) if hasattr(rng, 'randbytes') else os.urandom(24 * 1024)
+    img = PILImage.new('RGB', (1280, 720), (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    img.paste((255, 255, 255), (40 + n % 400, 40, 600, 300))
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def generate(findings=1000, images=20, users=25, seed=1, batch_size=5000, log=print):
+    from app import app
+    from authz import registered_permissions
+    from bulk import import_findings
+    from image_store import image_store
+    from models import db, Category, Image, Permissions, Project, Roles, Severity, Status, Users, lookups
+    from passwords import passwords
+    from search import create_schema
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        create_schema(db.session.connection())
+        categories = [Category(name=name) for name in CATEGORIES]
+        statuses = [Status(name=name) for name in STATUSES]
+        severities = [Severity(name=name) for name in SEVERITIES]
+        permissions = [Permissions(name=name) for name in sorted(registered_permissions)]
+        reads = [p for p in permissions if p.name.endswith(':read')]
+        grants = {
+            'admin': permissions,
+            'analyst': reads + [p for p in permissions if p.name in ('findings:write', 'images:write')],
+            'viewer': reads,
+        }
+        roles = [Roles(name=name, permissions=grants[name]) for name in ROLES]
+        db.session.add_all(categories + statuses + severities + permissions + roles)
+        db.session.flush()
+
+        # one hash for everybody, hashing every user at the production work factor would dominate the run
+        password = passwords.hash(BENCHMARK_PASSWORD)
+        db.session.add_all([
+            Users(name=f'User {n}', email=f'user{n}@bench.example', password=password, role_id=roles[n % len(roles)].id)
+            for n in range(users)
+        ])
+
+        image_rows = []
+        for n in range(images):
+            digest, size = image_store.save_bytes(image_bytes(rng, n))
+            image_rows.append(Image(filename=f'screenshot-{n}.png', content_type='image/png', sha256=digest, size=size))
+        db.session.add_all(image_rows)
+        db.session.flush()
+        image_urls = [f'/api/image/{image.id}' for image in image_rows]
+
+        projects = [
+            Project(name=f'{rng.choice(PLACES).split()[-2].title()} assessment {n + 1}',
+                    description={'blocks': [{'type': 'paragraph', 'data': {'text': sentence(rng, 30)}}]})
+            for n in range(max(1, findings // FINDINGS_PER_PROJECT))
+        ]
+        db.session.add_all(projects)
+        lookups.invalidate('categories', 'statuses', 'severities', 'roles', 'permissions')
+        db.session.commit()
+        log(f'lookups, {users} users, {images} images and {len(projects)} projects created')
+
+        project_ids = [project.id for project in projects]
+        ids = {'category': [c.id for c in categories], 'status': [s.id for s in statuses], 'severity': [s.id for s in severities]}
+        weights = [2, 6, 12, 8, 4]  # most findings are medium or low
+        created = 0
+        while created < findings:
+            count = min(batch_size, findings - created)
+            rows = [(number, {
+                'title': f'{rng.choice(SUBJECTS)} in {rng.choice(PLACES)}',
+                'description': description(rng, image_urls),
+                'project_id': project_ids[(created + number) % len(project_ids)],
+                'category_id': rng.choice(ids['category']),
+                'status_id': rng.choice(ids['status']),
+                'severity_id': rng.choices(ids['severity'], weights)[0],
+            }, None) for number in range(count)]
+            inserted, errors = import_findings(rows, batch_size)
+            if errors:
+                raise RuntimeError(f'generated rows were rejected: {errors[:3]}')
+            db.session.commit()
+            created += inserted
+            log(f'{created}/{findings} findings ({time.perf_counter() - started:.0f}s)')
+    return {'findings': findings, 'projects': len(project_ids), 'images': images, 'users': users, 'seed': seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='1k')
+    parser.add_argument('--findings', type=int, help='overrides --scale')
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--users', type=int, default=25)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--database-uri')
+    args = parser.parse_args()
+
+    uri = set_environment(args.database_uri)
+    generate(args.findings or SCALES[args.scale], args.images, args.users, args.seed, args.batch_size)
+    print(f'dataset written to {uri}')
+
+
+if __name__ == '__main__':
+    main()
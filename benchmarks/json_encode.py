@@ -0,0 +1,87 @@
+"""Encode time and bytes on the wire for /projects with a 10k-finding project.
+
+    python -m benchmarks.json_encode --findings 10000 --repeat 20
+
+Runs against a throwaway SQLite database unless DATABASE_URI is set.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--findings', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+    from app import app
+    from models import db, Category, Findings, Project, Severity, Status
+    from flask.json.provider import DefaultJSONProvider
+    from json_provider import OrjsonProvider, orjson
+    from compression import compression
+
+    app.debug = False
+    with app.app_context():
+        db.create_all()
+        lookups = [Category(name='Injection'), Status(name='Open'), Severity(name='High')]
+        project = Project(name='benchmark', description={'blocks': [{'type': 'paragraph', 'data': {'text': 'Scope'}}]})
+        db.session.add_all(lookups + [project])
+        db.session.flush()
+        db.session.execute(Findings.__table__.insert(), [{
+            'project_id': project.id,
+            'title': f'SQL injection in search parameter #{n}',
+            'description': {'blocks': [
+                {'type': 'paragraph', 'data': {'text': 'The <code>q</code> parameter is concatenated into a query.'}},
+                {'type': 'list', 'data': {'style': 'ordered', 'items': ['Open /search', "Send q=' OR 1=1 --"]}},
+            ]},
+            'category_id': lookups[0].id,
+            'status_id': lookups[1].id,
+            'severity_id': lookups[2].id,
+        } for n in range(args.findings)])
+        db.session.commit()
+
+        payload = [p.to_dict() for p in Project.query.options(*Project.eager_options()).all()]
+        providers = [('stdlib', DefaultJSONProvider(app))]
+        if orjson is not None:
+            providers.append(('orjson', OrjsonProvider(app)))
+            iso = OrjsonProvider(app)
+            iso.datetime_format = 'iso'
+            providers.append(('orjson iso dates', iso))
+
+        print(f'{"encoder":<20} {"encode ms":>10} {"bytes":>10}')
+        for name, provider in providers:
+            ms, body = timed(lambda: provider.response(payload).get_data(), args.repeat)
+            print(f'{name:<20} {ms:>10.1f} {len(body):>10}')
+
+        print()
+        print(f'{"Accept-Encoding":<20} {"compress ms":>12} {"bytes on wire":>14}')
+        body = app.json.response(payload).get_data()
+        print(f'{"identity":<20} {0:>12.1f} {len(body):>14}')
+        for name, encoder in compression.encoders.items():
+            ms, compressed = timed(lambda: encoder.compress(body), args.repeat)
+            print(f'{name:<20} {ms:>12.1f} {len(compressed):>14}')
+
+    client = app.test_client()
+    print()
+    print(f'{"GET /projects":<20} {"request ms":>12} {"bytes on wire":>14}')
+    for encoding in ['identity'] + list(compression.encoders):
+        ms, response = timed(lambda: client.get('/projects', headers={'Accept-Encoding': encoding}), max(args.repeat // 4, 1))
+        print(f'{encoding:<20} {ms:>12.1f} {len(response.data):>14}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""Concurrent report-authoring sessions against a local server.
+
+    python -m benchmarks.loadtest --analysts 16 --seconds 60 --server gunicorn --workers 4 --threads 2
+    python -m benchmarks.loadtest --url http://127.0.0.1:6060 --analysts 8
+
+Every simulated analyst loops through a session: log in, open a project, edit findings,
+upload a screenshot into one of them and load the report. Prints throughput, p50/p95/p99
+latency and error rate per route, and how close the database pools came to running dry.
+Without --url a server is started on a generated dataset (see benchmarks.dataset);
+with --url the server must already hold one, seeded with the same --seed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+from benchmarks.async_vs_sync import SERVERS, wait_for
+from benchmarks.dataset import BENCHMARK_PASSWORD, ROLES, generate, image_bytes, set_environment
+
+try:
+    from prometheus_client.parser import text_string_to_metric_families
+except ImportError:
+    text_string_to_metric_families = None
+
+SERVERS = dict(SERVERS, gunicorn=[sys.executable, '-m', 'gunicorn', 'app:app', '-c', 'gunicorn.conf.py',
+                                  '--bind', '127.0.0.1:{port}', '--workers', '{workers}', '--threads', '{threads}'])
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.sessions = 0
+        self.aborted = 0
+
+    def record(self, route, elapsed, error=None):
+        self.latencies[route].append(elapsed)
+        if error:
+            self.errors[route][error] += 1
+
+    def report(self, elapsed):
+        rows = []
+        for route in sorted(self.latencies, key=lambda route: -len(self.latencies[route])):
+            latencies = self.latencies[route]
+            quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+            errors = sum(self.errors[route].values())
+            rows.append({
+                'route': route,
+                'requests': len(latencies),
+                'rps': round(len(latencies) / elapsed, 2),
+                'p50_ms': round(quantiles[49] * 1000, 1),
+                'p95_ms': round(quantiles[94] * 1000, 1),
+                'p99_ms': round(quantiles[98] * 1000, 1),
+                'errors': errors,
+                'error_rate': round(errors / len(latencies), 4),
+                'error_kinds': dict(self.errors[route].most_common(3)),
+            })
+        return rows
+
+
+# samples the sync engine's pool figures from /metrics, summed over every worker when the
+# server runs with PROMETHEUS_MULTIPROC_DIR. Falls back to /db/pool/stats, which only shows
+# the worker that answered. Under --server async the reads go through the async engine instead.
+class PoolSampler:
+    def __init__(self, client, headers, capacity):
+        self.client = client
+        self.headers = headers
+        self.capacity = capacity
+        self.samples = []
+        self.first = self.last = None
+
+    async def run(self, stop):
+        while not stop.is_set():
+            try:
+                sample = await self.sample()
+            except (httpx.HTTPError, ValueError, KeyError):
+                sample = None
+            if sample:
+                self.samples.append(sample['checked_out'])
+                self.first = self.first or sample
+                self.last = sample
+            try:
+                await asyncio.wait_for(stop.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def sample(self):
+        if text_string_to_metric_families is not None:
+            response = await self.client.get('/metrics')
+            if response.status_code == 200:
+                values = defaultdict(float)
+                for family in text_string_to_metric_families(response.text):
+                    for sample in family.samples:
+                        if sample.labels.get('engine') == 'sync':
+                            values[sample.name] += sample.value
+                if 'db_pool_checked_out' in values:
+                    return {'checked_out': values['db_pool_checked_out'],
+                            'checkouts': values['db_pool_checkouts_total'],
+                            'wait_seconds': values['db_pool_wait_seconds_total'],
+                            'slow_checkouts': values['db_pool_slow_checkouts_total']}
+        response = await self.client.get('/db/pool/stats', headers=self.headers)
+        stats = response.json()['sync']
+        return {'checked_out': stats['checked_out'], 'checkouts': stats['checkouts'],
+                'wait_seconds': stats['wait_avg_ms'] * stats['checkouts'] / 1000,
+                'slow_checkouts': stats['slow_checkouts']}
+
+    def report(self):
+        if not self.samples:
+            return None
+        checkouts = self.last['checkouts'] - self.first['checkouts']
+        wait = self.last['wait_seconds'] - self.first['wait_seconds']
+        return {
+            'capacity': self.capacity,
+            'checked_out_peak': max(self.samples),
+            'checked_out_mean': round(statistics.fmean(self.samples), 1),
+            'saturation_peak': round(max(self.samples) / self.capacity, 2) if self.capacity else None,
+            'checkouts': checkouts,
+            'wait_avg_ms': round(wait / checkouts * 1000, 2) if checkouts else 0.0,
+            'slow_checkouts': self.last['slow_checkouts'] - self.first['slow_checkouts'],
+        }
+
+
+class Analyst:
+    def __init__(self, client, stats, number, users, think, rng):
+        self.client = client
+        self.stats = stats
+        # viewers can't edit, every analyst logs in as an admin or analyst account
+        authors = [n for n in range(users) if ROLES[n % len(ROLES)] != 'viewer']
+        self.email = f'user{authors[number % len(authors)]}@bench.example'
+        self.think = think
+        self.rng = rng
+        self.headers = {'Accept-Encoding': 'gzip'}
+        self.screenshots = [image_bytes(rng, n) for n in range(3)]
+
+    async def request(self, route, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            try:
+                response = await self.client.request(method, url, headers=self.headers, **kwargs)
+            except httpx.RemoteProtocolError:
+                # the server closed an idle keep-alive connection as it was reused, browsers retry too
+                response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        except httpx.HTTPError as error:
+            self.stats.record(route, time.perf_counter() - started, type(error).__name__)
+            raise
+        error = None
+        if response.status_code >= 400:
+            try:
+                error = f"{response.status_code} {response.json().get('error', '')}".strip()
+            except ValueError:
+                error = str(response.status_code)
+        self.stats.record(route, time.perf_counter() - started, error)
+        if error:
+            raise httpx.HTTPStatusError(error, request=response.request, response=response)
+        return response
+
+    async def pause(self):
+        if self.think:
+            await asyncio.sleep(self.rng.expovariate(1 / self.think))
+
+    async def session(self, lookups):
+        self.headers.pop('Authorization', None)
+        response = await self.request('POST /login', 'POST', '/login',
+                                      json={'email': self.email, 'password': BENCHMARK_PASSWORD})
+        self.headers['Authorization'] = 'Bearer ' + response.json()['access_token']
+
+        projects = (await self.request('GET /projects', 'GET', '/projects?fields=id,name&limit=1000')).json()
+        project_id = self.rng.choice(projects)['id']
+        opened = await asyncio.gather(
+            self.request('GET /project/<id>', 'GET', f'/project/{project_id}?fields=id,name,findings.id,findings.title'),
+            self.request('GET /categories', 'GET', '/categories?fields=id,name'),
+            self.request('GET /severities', 'GET', '/severities?fields=id,name'),
+            self.request('GET /project/<id>/stats', 'GET', f'/project/{project_id}/stats'),
+        )
+        finding_ids = [finding['id'] for finding in opened[0].json()['findings']]
+        if not finding_ids:
+            return
+        await self.pause()
+
+        for _ in range(self.rng.randint(2, 5)):
+            finding = await self.open_finding(self.rng.choice(finding_ids))
+            await self.pause()
+            await self.save_finding(finding, project_id, lookups)
+            await self.pause()
+
+        # a screenshot goes into the description of the finding being written up
+        finding = await self.open_finding(self.rng.choice(finding_ids))
+        response = await self.request('POST /api/uploadFile', 'POST', '/api/uploadFile', files={
+            'image': ('screenshot.png', self.rng.choice(self.screenshots), 'image/png')})
+        finding['description'].setdefault('blocks', []).append(
+            {'type': 'image', 'data': {'file': {'url': response.json()['file']['url']}, 'caption': 'Screenshot'}})
+        await self.save_finding(finding, project_id, lookups)
+        await self.pause()
+
+        # the report view: every finding of the project and the images they embed
+        response = await self.request('GET /findings', 'GET', f'/findings?project_id={project_id}&limit=1000')
+        images = {block['data']['file']['url'] for finding in response.json()
+                  for block in (finding.get('description') or {}).get('blocks', []) if block.get('type') == 'image'}
+        await asyncio.gather(*[self.request('GET /api/image/<id>', 'GET', url + '?size=medium')
+                               for url in sorted(images)[:12]])
+
+    async def open_finding(self, finding_id):
+        return (await self.request('GET /finding/<id>', 'GET', f'/finding/{finding_id}')).json()
+
+    async def save_finding(self, finding, project_id, lookups):
+        blocks = (finding.get('description') or {}).get('blocks', [])
+        blocks.append({'type': 'paragraph', 'data': {'text': f'Retested at {time.strftime("%H:%M:%S")}.'}})
+        await self.request('PUT /finding/<id>', 'PUT', f"/finding/{finding['id']}", json={
+            'title': finding['title'],
+            'description': {'blocks': blocks[-12:]},
+            'project_id': project_id,
+            'category_id': self.rng.choice(lookups['categories']),
+            'severity_id': self.rng.choice(lookups['severities']),
+        })
+
+    async def run(self, deadline, lookups):
+        while time.perf_counter() < deadline:
+            try:
+                await self.session(lookups)
+                self.stats.sessions += 1
+            except httpx.HTTPError:
+                # the failed request is already counted, start over like a user hitting reload
+                self.stats.aborted += 1
+                await asyncio.sleep(0.5)
+
+
+async def load(base_url, analysts, users, seconds, think, seed, capacity):
+    stats = Stats()
+    limits = httpx.Limits(max_connections=analysts * 8)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        token = (await client.post('/login', json={'email': 'user0@bench.example', 'password': BENCHMARK_PASSWORD})).json()
+        headers = {'Authorization': 'Bearer ' + token['access_token']}
+        lookups = {
+            table: [row['id'] for row in (await client.get(f'/{table}?fields=id', headers=headers)).json()]
+            for table in ('categories', 'severities')
+        }
+        sampler = PoolSampler(client, headers, capacity)
+        stop = asyncio.Event()
+        sampling = asyncio.ensure_future(sampler.run(stop))
+        started = time.perf_counter()
+        deadline = started + seconds
+        await asyncio.gather(*[
+            Analyst(client, stats, number, users, think, random.Random(seed + number)).run(deadline, lookups)
+            for number in range(analysts)
+        ])
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampling
+    return stats, sampler, elapsed
+
+
+def start_server(args):
+    command = [part.format(port=args.port, workers=args.workers, threads=args.threads) for part in SERVERS[args.server]]
+    env = os.environ.copy()
+    if args.server == 'gunicorn':
+        env.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp())
+    server = subprocess.Popen(command, env=env, cwd=ROOT, stdout=subprocess.DEVNULL,
+                              stderr=None if args.server_logs else subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{args.port}'
+    try:
+        wait_for(base_url)
+    except RuntimeError:
+        server.terminate()
+        raise
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--analysts', type=int, default=16, help='concurrent sessions')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--think', type=float, default=0.0, help='mean pause between steps, in seconds')
+    parser.add_argument('--url', help='an already running server, nothing is started or seeded')
+    parser.add_argument('--server', choices=list(SERVERS), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='also used for the pool capacity of a --url server')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--findings', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=25)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server-logs', action='store_true', help="show the server's stderr")
+    parser.add_argument('--output', help='also write the results to a JSON file')
+    args = parser.parse_args()
+
+    server, base_url = None, args.url
+    if base_url is None:
+        set_environment()
+        os.environ.setdefault('AUTH_REQUIRED', 'true')
+        generate(args.findings, users=args.users, seed=args.seed, log=lambda message: None)
+        server, base_url = start_server(args)
+    workers = args.workers if args.server == 'gunicorn' or args.url else 1
+    capacity = (int(os.getenv('DB_POOL_SIZE', 5)) + int(os.getenv('DB_MAX_OVERFLOW', 10))) * workers
+    try:
+        stats, sampler, elapsed = asyncio.run(
+            load(base_url, args.analysts, args.users, args.seconds, args.think, args.seed, capacity))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    routes = stats.report(elapsed)
+    pool = sampler.report()
+    total = sum(route['requests'] for route in routes)
+    errors = sum(route['errors'] for route in routes)
+    print(f'{args.analysts} analysts, {elapsed:.0f}s: {stats.sessions} sessions ({stats.aborted} aborted), '
+          f'{total / elapsed:.1f} req/s, {errors / total if total else 0:.2%} errors\n')
+    print(f"{'route':<26} {'requests':>8} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for route in routes:
+        print(f"{route['route']:<26} {route['requests']:>8} {route['rps']:>7.1f} {route['p50_ms']:>8.1f} "
+              f"{route['p95_ms']:>8.1f} {route['p99_ms']:>8.1f} {route['error_rate']:>7.2%}")
+        for kind, count in route['error_kinds'].items():
+            print(f'    {count:>6}x {kind[:100]}')
+    if pool:
+        print(f"\ndb pool: peak {pool['checked_out_peak']:.0f}/{pool['capacity']} checked out "
+              f"(mean {pool['checked_out_mean']}), {pool['checkouts']:.0f} checkouts, "
+              f"{pool['wait_avg_ms']} ms average wait, {pool['slow_checkouts']:.0f} slow checkouts")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'analysts': args.analysts, 'seconds': round(elapsed, 1), 'sessions': stats.sessions,
+                       'aborted': stats.aborted, 'routes': routes, 'pool': pool}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Login throughput at each password hashing work factor.
+
+    python -m benchmarks.login_throughput --threads 16 --seconds 5
+
+Runs against a throwaway SQLite database unless DATABASE_URI is set.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+METHODS = [
+    'pbkdf2:sha256:100000',
+    'pbkdf2:sha256:300000',
+    'pbkdf2:sha256:600000',
+    'scrypt:16384:8:1',
+    'scrypt:32768:8:1',
+]
+
+
+def run(app, seconds, threads):
+    latencies, statuses = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def analyst():
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = client.post('/login', json={'email': 'bench@example.com', 'password': 'correct horse'})
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                statuses.append(response.status_code)
+
+    workers = [threading.Thread(target=analyst) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--methods', nargs='*', default=METHODS)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+    os.environ.setdefault('JWT_SECRET_KEY', 'benchmark-secret-key-benchmark-secret-key')
+    from app import app
+    from models import db, Users
+    from passwords import passwords
+
+    with app.app_context():
+        db.create_all()
+        user = Users.query.filter_by(email='bench@example.com').first() or Users(name='bench', email='bench@example.com')
+        db.session.add(user)
+        db.session.commit()
+
+    print(f'{"method":<24} {"logins/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"503s":>6}')
+    for method in args.methods:
+        app.config['PASSWORD_HASH_METHOD'] = method
+        passwords.method = method
+        with app.app_context():
+            user = Users.query.filter_by(email='bench@example.com').first()
+            user.password = passwords.hash('correct horse')
+            db.session.commit()
+        latencies, statuses = run(app, args.seconds, args.threads)
+        ok = [latency for latency, status in zip(latencies, statuses) if status == 200]
+        quantiles = statistics.quantiles(ok, n=100) if len(ok) > 1 else [0] * 99
+        print(f'{method:<24} {len(ok) / args.seconds:>9.1f} {quantiles[49] * 1000:>8.1f} '
+              f'{quantiles[98] * 1000:>8.1f} {statuses.count(503):>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,594 @@
+"""Latency, SQL statement count and peak memory for every route, checked against a baseline.
+
+    python -m benchmarks.suite --scale 100k
+    python -m benchmarks.suite --scale 1m --database-uri postgresql://localhost/findings_bench --threshold 0.15
+
+Every rule and method in app.url_map needs a case below, a route added without one fails the
+run. The first run for a dialect and scale writes benchmarks/baselines/<dialect>-<scale>.json
+(so does --update-baseline). Later runs exit 1 when an endpoint's p50 latency or peak memory
+grows by more than --threshold, or when it runs more SQL statements than the baseline did.
+
+Without --database-uri a throwaway SQLite file is generated. A --database-uri is seeded when it
+has no findings and reused otherwise; the last case deletes every finding unless --keep-data.
+"""
+import argparse
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+from benchmarks.dataset import BENCHMARK_PASSWORD, SCALES, generate, image_bytes, set_environment
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+# below these a change is noise, not a regression
+LATENCY_FLOOR_MS = 1.0
+MEMORY_FLOOR_KIB = 64
+# routes with no case, and why
+SKIPPED = {
+    ('/project/<int:project_id>', 'POST'): 'the view has no POST branch',
+}
+CASES = []
+
+
+def case(rule, method='GET', name=None, iterations=None, once=False):
+    # prepare(ctx) runs before every request and is not timed, it returns (path, client.open kwargs)
+    def decorator(prepare):
+        CASES.append({'name': name or f'{method} {rule}', 'rule': rule, 'method': method,
+                      'prepare': prepare, 'iterations': iterations, 'once': once})
+        return prepare
+    return decorator
+
+
+def fixed(rule, path, method='GET', name=None, iterations=None, **request):
+    case(rule, method, name or f'{method} {path}', iterations)(lambda ctx: (path.format(**ctx.ids), dict(request)))
+
+
+class Context:
+    def __init__(self, app, client):
+        self.app = app
+        self.client = client
+        self.headers = {'Accept-Encoding': 'gzip'}
+        self.ids = {}
+        self.serial = itertools.count()
+        self.uploads = []
+        self.png = image_bytes(random.Random(0), 0)
+
+    def name(self):
+        return f'bench-{next(self.serial)}'
+
+    def create(self, model, **values):
+        return self.add(model(**values))
+
+    def add(self, row):
+        from models import db
+        with self.app.app_context():
+            db.session.add(row)
+            db.session.commit()
+            return row.id
+
+    def upload(self, body=None):
+        response = self.client.post('/api/uploads', headers=self.headers,
+                                    json={'filename': self.name() + '.png', 'content_type': 'image/png', 'size': len(self.png)})
+        upload_id = response.get_json()['upload_id']
+        self.uploads.append(upload_id)
+        if body:
+            self.client.put(f'/api/uploads/{upload_id}?offset=0', headers=self.headers, data=body)
+        return upload_id
+
+
+def finding_body(ctx, title=None):
+    return {'title': title or ctx.name(), 'description': {'blocks': [{'type': 'paragraph', 'data': {'text': 'Benchmark'}}]},
+            'project_id': ctx.ids['spare_project'], 'category_id': ctx.ids['category'], 'severity_id': ctx.ids['severity']}
+
+
+def prepare_context(ctx):
+    from models import db, Category, Findings, Image, Job, Permissions, Project, Roles, Severity, Status, Users
+    from passwords import passwords
+
+    with ctx.app.app_context():
+        total = db.session.query(Findings.id).count()
+        middle = Findings.query.order_by(Findings.id).offset(total // 2).first()
+        admin = Roles.query.filter_by(name='admin').one()
+        ctx.ids.update(
+            project=middle.project_id,
+            finding=middle.id,
+            category=Category.query.order_by(Category.id).first().id,
+            severity=Severity.query.order_by(Severity.id).first().id,
+            status=Status.query.order_by(Status.id).first().id,
+            role=admin.id,
+            permission=admin.permissions[0].id,
+            user=Users.query.filter_by(role_id=admin.id).order_by(Users.id).first().id,
+            image=Image.query.filter(Image.sha256.isnot(None)).order_by(Image.id).first().id,
+            patch_ids=[id for id, in db.session.query(Findings.id).filter_by(project_id=middle.project_id).limit(100)],
+        )
+        password = passwords.hash(BENCHMARK_PASSWORD)
+        email = db.session.get(Users, ctx.ids['user']).email
+    # left behind by a run that did not finish
+    cleanup(ctx)
+    # rows the PUT cases rewrite, so the generated dataset stays as seeded
+    ctx.ids['spare_project'] = ctx.create(Project, name=ctx.name(), description={'blocks': []})
+    ctx.ids['spare_finding'] = ctx.create(Findings, **finding_body(ctx))
+    ctx.ids['spare_category'] = ctx.create(Category, name=ctx.name())
+    ctx.ids['spare_severity'] = ctx.create(Severity, name=ctx.name())
+    ctx.ids['spare_role'] = ctx.create(Roles, name=ctx.name())
+    ctx.ids['spare_permission'] = ctx.create(Permissions, name=ctx.name())
+    # nothing runs jobs during the suite, this one looks like a report a worker already finished
+    ctx.ids['job'] = ctx.create(Job, id=uuid.uuid4().hex, kind='report', name=ctx.name(), status='succeeded',
+                                params={'project_id': ctx.ids['spare_project'], 'fmt': 'md'},
+                                result={'fragments': 0, 'cached': 0, 'rendered': 0}, finished_at=datetime.now(),
+                                created_by=ctx.ids['user'])
+    name = ctx.name()
+    ctx.ids['spare_user'] = ctx.create(Users, name=name, email=name + '@bench.example', password=password,
+                                       role_id=ctx.ids['role'])
+    response = ctx.client.post('/login', json={'email': email, 'password': BENCHMARK_PASSWORD})
+    ctx.headers['Authorization'] = 'Bearer ' + response.get_json()['access_token']
+    return total
+
+
+def cleanup(ctx):
+    # removes everything the cases created, named bench-N
+    from models import db, Category, Findings, Image, Job, Permissions, Project, Roles, Severity, Users, lookups
+    from uploads import upload_sessions
+    for upload_id in ctx.uploads:
+        upload_sessions.discard(upload_id)
+    with ctx.app.app_context():
+        for model, column in ((Project, Project.name), (Findings, Findings.title), (Category, Category.name),
+                              (Severity, Severity.name), (Roles, Roles.name), (Permissions, Permissions.name),
+                              (Users, Users.name), (Image, Image.filename), (Job, Job.name)):
+            # through the ORM so the search index and stats follow
+            for row in model.query.filter(column.like('bench-%')):
+                db.session.delete(row)
+        lookups.invalidate('categories', 'severities', 'roles', 'permissions')
+        db.session.commit()
+
+
+fixed('/', '/')
+fixed('/projects', '/projects')
+fixed('/projects', '/projects?fields=id,name&limit=1000')
+fixed('/projects', '/projects?stream=1&fields=id,name')
+fixed('/project/<int:project_id>', '/project/{project}')
+fixed('/project/<int:project_id>', '/project/{project}?fields=id,name,findings.id,findings.title')
+fixed('/projects/stats', '/projects/stats')
+fixed('/project/<int:project_id>/stats', '/project/{project}/stats')
+# warmup fills the fragment cache, so these time a report whose fragments are all cached
+fixed('/project/<int:project_id>/report.<fmt>', '/project/{project}/report.html')
+fixed('/project/<int:project_id>/report.<fmt>', '/project/{project}/report.md')
+fixed('/project/<int:project_id>/report.<fmt>', '/project/{project}/report.docx')
+fixed('/project/<int:project_id>/export.zip', '/project/{project}/export.zip')
+fixed('/categories', '/categories')
+fixed('/category/<int:category_id>', '/category/{category}')
+fixed('/severities', '/severities')
+fixed('/severity/<int:severity_id>', '/severity/{severity}')
+fixed('/findings', '/findings')
+fixed('/findings', '/findings?project_id={project}')
+fixed('/findings', '/findings?severity_id={severity}&limit=1000')
+fixed('/findings', '/findings?stream=1&project_id={project}')
+fixed('/finding/<int:finding_id>', '/finding/{finding}')
+fixed('/users', '/users')
+fixed('/users', '/users?stream=1')
+fixed('/user/<int:user_id>', '/user/{user}')
+fixed('/roles', '/roles')
+fixed('/role/<int:role_id>', '/role/{role}')
+fixed('/permissions', '/permissions')
+fixed('/permission/<int:permission_id>', '/permission/{permission}')
+fixed('/roles/<int:role_id>/permissions', '/roles/{role}/permissions')
+fixed('/search', '/search?q=injection')
+fixed('/search', '/search?q=authorization+checks&project_id={project}')
+fixed('/api/image/<int:image_id>', '/api/image/{image}')
+fixed('/api/image/<int:image_id>', '/api/image/{image}?w=320&fmt=webp')
+fixed('/jobs', '/jobs')
+fixed('/jobs/<job_id>', '/jobs/{job}')
+fixed('/jobs/<job_id>/result', '/jobs/{job}/result')
+fixed('/cache/stats', '/cache/stats')
+fixed('/metrics', '/metrics')
+fixed('/debug/sql-profiles', '/debug/sql-profiles')
+fixed('/db/pool/stats', '/db/pool/stats')
+fixed('/protected', '/protected')
+# pbkdf2 at the production work factor, a few samples are enough
+fixed('/login', '/login', 'POST', iterations=3, json={'email': 'user0@bench.example', 'password': BENCHMARK_PASSWORD})
+
+
+@case('/debug/sql-profiles/<profile_id>')
+def sql_profile(ctx):
+    from profiler import profiler
+    return '/debug/sql-profiles/' + next(reversed(profiler.profiles), 'none'), {}
+
+
+@case('/projects', 'POST')
+def create_project(ctx):
+    # created_at is passed straight to the column, SQLite only takes a datetime so send none
+    return '/projects', {'json': {'name': ctx.name(), 'description': {'blocks': []}, 'created_at': None}}
+
+
+@case('/project/<int:project_id>', 'PUT')
+def update_project(ctx):
+    return f"/project/{ctx.ids['spare_project']}", {'json': {'name': ctx.name()}}
+
+
+@case('/project/<int:project_id>', 'DELETE')
+def delete_project(ctx):
+    from models import Findings, Project
+    project = Project(name=ctx.name(), description={'blocks': []},
+                      findings=[Findings(**dict(finding_body(ctx), project_id=None)) for _ in range(25)])
+    return f'/project/{ctx.add(project)}', {}
+
+
+@case('/categories', 'POST')
+def create_category(ctx):
+    return '/categories', {'json': {'name': ctx.name()}}
+
+
+@case('/category/<int:category_id>', 'PUT')
+def update_category(ctx):
+    return f"/category/{ctx.ids['spare_category']}", {'json': {'name': ctx.name()}}
+
+
+@case('/category/<int:category_id>', 'DELETE')
+def delete_category(ctx):
+    from models import Category
+    return f'/category/{ctx.create(Category, name=ctx.name())}', {}
+
+
+@case('/severities', 'POST')
+def create_severity(ctx):
+    return '/severities', {'json': {'name': ctx.name()}}
+
+
+@case('/severity/<int:severity_id>', 'PUT')
+def update_severity(ctx):
+    return f"/severity/{ctx.ids['spare_severity']}", {'json': {'name': ctx.name()}}
+
+
+@case('/severity/<int:severity_id>', 'DELETE')
+def delete_severity(ctx):
+    from models import Severity
+    return f'/severity/{ctx.create(Severity, name=ctx.name())}', {}
+
+
+@case('/findings', 'POST')
+def create_finding(ctx):
+    return '/findings', {'json': finding_body(ctx)}
+
+
+@case('/findings/bulk', 'POST')
+def bulk_import(ctx):
+    return '/findings/bulk', {'json': [dict(finding_body(ctx), status_id=ctx.ids['status']) for _ in range(100)]}
+
+
+@case('/findings/bulk', 'PATCH')
+def bulk_update(ctx):
+    return '/findings/bulk', {'json': {'ids': ctx.ids['patch_ids'], 'patch': {'status_id': ctx.ids['status']}}}
+
+
+@case('/finding/<int:finding_id>', 'PUT')
+def update_finding(ctx):
+    return f"/finding/{ctx.ids['spare_finding']}", {'json': finding_body(ctx)}
+
+
+@case('/finding/<int:finding_id>', 'DELETE')
+def delete_finding(ctx):
+    from models import Findings
+    return f'/finding/{ctx.create(Findings, **finding_body(ctx))}', {}
+
+
+@case('/jobs', 'POST')
+def submit_job(ctx):
+    return '/jobs', {'json': {'kind': 'report', 'name': ctx.name(),
+                              'params': {'project_id': ctx.ids['spare_project'], 'fmt': 'html'}}}
+
+
+@case('/jobs/<job_id>/cancel', 'POST')
+def cancel_job(ctx):
+    from jobs import jobs
+    with ctx.app.app_context():
+        job = jobs.submit('report', {'project_id': ctx.ids['spare_project'], 'fmt': 'html'}, ctx.name(), ctx.ids['user'])
+        return f'/jobs/{job.id}/cancel', {}
+
+
+@case('/api/uploadFile', 'POST')
+def upload_file(ctx):
+    return '/api/uploadFile', {'data': {'image': (io.BytesIO(ctx.png), ctx.name() + '.png', 'image/png')}}
+
+
+@case('/api/uploads', 'POST')
+def create_upload(ctx):
+    return '/api/uploads', {'json': {'filename': ctx.name() + '.png', 'content_type': 'image/png', 'size': len(ctx.png)}}
+
+
+@case('/api/uploads/<upload_id>')
+def upload_status(ctx):
+    return f'/api/uploads/{ctx.upload()}', {}
+
+
+@case('/api/uploads/<upload_id>', 'PUT')
+def upload_chunk(ctx):
+    return f'/api/uploads/{ctx.upload()}?offset=0', {'data': ctx.png}
+
+
+@case('/api/uploads/<upload_id>', 'DELETE')
+def discard_upload(ctx):
+    return f'/api/uploads/{ctx.upload()}', {}
+
+
+@case('/api/uploads/<upload_id>/complete', 'POST')
+def complete_upload(ctx):
+    return f'/api/uploads/{ctx.upload(ctx.png)}/complete', {}
+
+
+@case('/api/deleteImage/<int:image_id>', 'DELETE')
+def delete_image(ctx):
+    from image_store import image_store
+    from models import Image
+    digest, size = image_store.save_bytes(ctx.png + ctx.name().encode())
+    return f"/api/deleteImage/{ctx.create(Image, filename=ctx.name(), content_type='image/png', sha256=digest, size=size)}", {}
+
+
+@case('/users', 'POST', iterations=3)
+def create_user(ctx):
+    name = ctx.name()
+    return '/users', {'json': {'name': name, 'email': name + '@bench.example', 'password': BENCHMARK_PASSWORD,
+                               'role_id': ctx.ids['role']}}
+
+
+@case('/user/<int:user_id>', 'PUT', iterations=3)
+def update_user(ctx):
+    name = ctx.name()
+    return f"/user/{ctx.ids['spare_user']}", {'json': {'name': name, 'email': name + '@bench.example',
+                                                       'password': BENCHMARK_PASSWORD, 'role_id': ctx.ids['role']}}
+
+
+@case('/user/<int:user_id>', 'DELETE')
+def delete_user(ctx):
+    from models import Users
+    name = ctx.name()
+    return f"/user/{ctx.create(Users, name=name, email=name + '@bench.example', role_id=ctx.ids['role'])}", {}
+
+
+@case('/roles', 'POST')
+def create_role(ctx):
+    return '/roles', {'json': {'name': ctx.name()}}
+
+
+@case('/role/<int:role_id>', 'PUT')
+def update_role(ctx):
+    return f"/role/{ctx.ids['spare_role']}", {'json': {'name': ctx.name()}}
+
+
+@case('/role/<int:role_id>', 'DELETE')
+def delete_role(ctx):
+    from models import Roles
+    return f'/role/{ctx.create(Roles, name=ctx.name())}', {}
+
+
+@case('/permissions', 'POST')
+def create_permission(ctx):
+    return '/permissions', {'json': {'name': ctx.name()}}
+
+
+@case('/permission/<int:permission_id>', 'PUT')
+def update_permission(ctx):
+    return f"/permission/{ctx.ids['spare_permission']}", {'json': {'name': ctx.name()}}
+
+
+@case('/permission/<int:permission_id>', 'DELETE')
+def delete_permission(ctx):
+    from models import Permissions
+    return f'/permission/{ctx.create(Permissions, name=ctx.name())}', {}
+
+
+@case('/roles/<int:role_id>/permissions', 'POST')
+def grant_permission(ctx):
+    from models import Permissions
+    return f"/roles/{ctx.ids['spare_role']}/permissions", {'json': {'permission_id': ctx.create(Permissions, name=ctx.name())}}
+
+
+# wipes the dataset, has to stay last
+@case('/delete/all/findings', 'DELETE', once=True)
+def delete_all_findings(ctx):
+    return '/delete/all/findings', {}
+
+
+def uncovered(app):
+    routes = {(rule.rule, method) for rule in app.url_map.iter_rules() if rule.endpoint != 'static'
+              for method in rule.methods - {'HEAD', 'OPTIONS'}}
+    covered = {(c['rule'], c['method']) for c in CASES}
+    return sorted(routes - covered - set(SKIPPED)), sorted(covered - routes)
+
+
+def send(ctx, case):
+    path, request = case['prepare'](ctx)
+    headers = dict(ctx.headers, **request.pop('headers', {}))
+
+    def call():
+        response = ctx.client.open(path, method=case['method'], headers=headers, **request)
+        # streamed bodies are produced while they are read, that is part of the request
+        response.get_data()
+        response.close()
+        return response.status_code
+    return call
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def measure(ctx, case, iterations, warmup):
+    from profiler import profiler
+
+    if case['once']:
+        iterations, warmup = 1, 0
+    for _ in range(warmup):
+        send(ctx, case)()
+
+    # one request with statement counting and tracemalloc on, both slow it down so it is not timed
+    # (except for once=True cases, compare those only with themselves). Statements an NDJSON
+    # stream runs after the view returns are not in the profile.
+    profiles = []
+    call = send(ctx, case)
+    profiler.listeners.append(profiles.append)
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        status = call()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        profiler.listeners.remove(profiles.append)
+    queries = profiles[-1]['queries'] - profiles[-1]['cache_queries'] if profiles else None
+
+    timings = [elapsed] if case['once'] else []
+    for _ in range(iterations if not case['once'] else 0):
+        call = send(ctx, case)
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    return {
+        'name': case['name'],
+        'rule': case['rule'],
+        'method': case['method'],
+        'status': status,
+        'iterations': len(timings),
+        'p50_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'mean_ms': round(statistics.fmean(timings) * 1000, 3),
+        'queries': queries,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    before = {result['name']: result for result in baseline['results']}
+    for result in results:
+        previous = before.get(result['name'])
+        if previous is None:
+            continue
+        name = result['name']
+        if (result['p50_ms'] > previous['p50_ms'] * (1 + threshold)
+                and result['p50_ms'] - previous['p50_ms'] > LATENCY_FLOOR_MS):
+            regressions.append(f"{name}: p50 {previous['p50_ms']:.2f} -> {result['p50_ms']:.2f} ms")
+        if result['queries'] is not None and previous['queries'] is not None and result['queries'] > previous['queries']:
+            regressions.append(f"{name}: {previous['queries']} -> {result['queries']} SQL statements")
+        if (result['peak_kib'] > previous['peak_kib'] * (1 + threshold)
+                and result['peak_kib'] - previous['peak_kib'] > MEMORY_FLOOR_KIB):
+            regressions.append(f"{name}: peak memory {previous['peak_kib']:.0f} -> {result['peak_kib']:.0f} KiB")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='1k')
+    parser.add_argument('--findings', type=int, help='overrides --scale')
+    parser.add_argument('--database-uri')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed p50 latency and memory growth')
+    parser.add_argument('--only', help='run the cases whose name contains this')
+    parser.add_argument('--baseline', help='default: benchmarks/baselines/<dialect>-<scale>.json')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--output', help='also write this run to a JSON file')
+    parser.add_argument('--keep-data', action='store_true', help='skip DELETE /delete/all/findings')
+    args = parser.parse_args()
+
+    set_environment(args.database_uri)
+    os.environ.setdefault('AUTH_REQUIRED', 'true')
+    from app import app
+    from models import db, Findings
+
+    missing, stale = uncovered(app)
+    if missing or stale:
+        for rule, method in missing:
+            print(f'no benchmark case for {method} {rule}', file=sys.stderr)
+        for rule, method in stale:
+            print(f'benchmark case for {method} {rule}, which is not a route any more', file=sys.stderr)
+        sys.exit(2)
+
+    findings = args.findings or SCALES[args.scale]
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        db.create_all()
+        existing = db.session.query(Findings.id).count()
+    if existing:
+        print(f'reusing {existing} findings already in the database')
+    else:
+        generate(findings, seed=args.seed)
+    ctx = Context(app, app.test_client())
+    total = prepare_context(ctx)
+    scale = next((name for name, count in SCALES.items() if count == total), str(total))
+
+    cases = [c for c in CASES if not (args.keep_data and c['once'])]
+    if args.only:
+        cases = [c for c in cases if args.only in c['name']]
+    results = []
+    print(f"{'case':<72} {'status':>6} {'p50 ms':>9} {'p95 ms':>9} {'queries':>7} {'peak KiB':>9}")
+    for c in cases:
+        result = measure(ctx, c, c['iterations'] or args.iterations, args.warmup)
+        results.append(result)
+        print(f"{result['name'][:72]:<72} {result['status']:>6} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+              f"{'-' if result['queries'] is None else result['queries']:>7} {result['peak_kib']:>9.1f}")
+    if args.keep_data:
+        cleanup(ctx)
+
+    run = {
+        'meta': {
+            'dialect': dialect, 'scale': scale, 'findings': total, 'seed': args.seed,
+            'iterations': args.iterations, 'commit': git_commit(), 'python': platform.python_version(),
+            'machine': platform.platform(), 'cpus': os.cpu_count(), 'at': datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+
+    failed = [r for r in results if r['status'] >= 400]
+    for result in failed:
+        print(f"{result['name']} answered {result['status']}", file=sys.stderr)
+
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f'{dialect}-{scale}.json')
+    if args.update_baseline or not os.path.exists(baseline_path):
+        if args.only:
+            print('not writing a baseline from a partial run (--only)')
+        else:
+            os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+            with open(baseline_path, 'w') as f:
+                json.dump(run, f, indent=2)
+            print(f'baseline written to {baseline_path}')
+        sys.exit(1 if failed else 0)
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against {baseline_path} ({baseline['meta'].get('commit')}):",
+              file=sys.stderr)
+        for line in regressions:
+            print('  ' + line, file=sys.stderr)
+    else:
+        print(f'no regressions against {baseline_path}')
+    sys.exit(1 if regressions or failed else 0)
+
+
+if __name__ == '__main__':
+    main()
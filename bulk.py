@@ -0,0 +1,239 @@
+import csv
+import io
+import json
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func, insert, select, text
+from werkzeug.datastructures import MultiDict
+from models import db, Findings, Project, Category, Severity, Status
+from pagination import FINDING_FILTERS, filter_findings
+from search import index_rows
+from stats import track_bulk_update, track_inserted
+
+REFERENCES = {
+    'project_id': Project,
+    'category_id': Category,
+    'severity_id': Severity,
+    'status_id': Status,
+}
+COPY_COLUMNS = ('id', 'project_id', 'title', 'description', 'created_at', 'updated_at', 'category_id', 'status_id', 'severity_id')
+
+
+def read_rows(request):
+    # yields (row number, row or None, error) so a bad line is reported instead of aborting the import
+    if request.mimetype == 'application/x-ndjson':
+        for number, line in enumerate(request.stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line), None
+            except ValueError:
+                yield number, None, 'invalid JSON'
+    elif request.mimetype == 'text/csv':
+        # the csv module refuses fields over 128 KiB by default, a description may be as big as
+        # the request is allowed to be
+        csv.field_size_limit(max(request.max_content_length or 0, current_app.config['BULK_MAX_FIELD_BYTES']))
+        reader = csv.DictReader(io.TextIOWrapper(request.stream, encoding='utf-8'))
+        number = 0
+        try:
+            for number, raw in enumerate(reader, start=1):
+                yield number, parse_csv_row(raw), None
+        except csv.Error as error:
+            # unlike a bad NDJSON line the rows after it can't be told apart any more
+            raise ValueError(f'Invalid CSV at row {number + 1}: {error}')
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            raise ValueError('Expected a JSON array, NDJSON or CSV body')
+        for number, raw in enumerate(data, start=1):
+            yield number, raw, None
+
+
+def parse_csv_row(raw):
+    row = {key: value for key, value in raw.items() if value != ''}
+    if 'description' in row:
+        try:
+            row['description'] = json.loads(row['description'])
+        except ValueError:
+            pass
+    return row
+
+
+def normalize(raw):
+    if not isinstance(raw, dict):
+        return None, ['row must be an object']
+    errors = []
+    title = raw.get('title')
+    if not isinstance(title, str) or not title.strip():
+        errors.append('title is required')
+    elif len(title) > 255:
+        errors.append('title is longer than 255 characters')
+    row = {'title': title, 'description': raw.get('description')}
+    for field in REFERENCES:
+        value = raw.get(field)
+        if value is None:
+            row[field] = None
+            continue
+        try:
+            row[field] = int(value)
+        except (TypeError, ValueError):
+            errors.append(f'{field} must be an integer')
+    if raw.get('project_id') is None:
+        errors.append('project_id is required')
+    return row, errors
+
+
+def missing_references(rows):
+    # one IN query per referenced table for the whole batch
+    missing = {}
+    for field, model in REFERENCES.items():
+        ids = {row[field] for row in rows if row[field] is not None}
+        if ids:
+            found = {id for (id,) in db.session.query(model.id).filter(model.id.in_(ids))}
+            missing[field] = ids - found
+    return missing
+
+
+def insert_rows(rows):
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2':
+        return copy_rows(connection, rows)
+    if connection.dialect.name == 'sqlite':
+        # ordered RETURNING degrades to one statement per row on SQLite, a plain executemany
+        # doesn't, and the transaction holds the write lock so the new rowids are consecutive
+        db.session.execute(insert(Findings), rows)
+        last_id = db.session.execute(select(func.max(Findings.id))).scalar()
+        return list(range(last_id - len(rows) + 1, last_id + 1))
+    result = db.session.execute(insert(Findings).returning(Findings.id, sort_by_parameter_order=True), rows)
+    return result.scalars().all()
+
+
+def copy_rows(connection, rows):
+    # ids are reserved from the sequence up front so COPY can write them and the caller still gets them back
+    ids = connection.execute(
+        text("SELECT nextval(pg_get_serial_sequence('findings', 'id')) FROM generate_series(1, :n)"),
+        {'n': len(rows)}
+    ).scalars().all()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for id, row in zip(ids, rows):
+        # csv writes None as an unquoted empty field, which COPY reads as NULL
+        values = dict(row, id=id)
+        if values['description'] is not None:
+            values['description'] = json.dumps(values['description'])
+        writer.writerow([values[column] for column in COPY_COLUMNS])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY findings ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+    return ids
+
+
+def import_findings(rows, batch_size):
+    # returns (number of rows inserted, errors), only the current batch of rows is kept
+    inserted, errors = 0, []
+    batch = []
+
+    def flush():
+        nonlocal inserted
+        missing = missing_references([row for _, row in batch])
+        valid = []
+        for number, row in batch:
+            row_errors = [
+                f'{field} {row[field]} does not exist'
+                for field, ids in missing.items() if row[field] in ids
+            ]
+            if row_errors:
+                errors.append({'row': number, 'errors': row_errors})
+            else:
+                valid.append(row)
+        if valid:
+            now = datetime.now()
+            for row in valid:
+                row['created_at'] = row['updated_at'] = now
+            for id, row in zip(insert_rows(valid), valid):
+                row['id'] = id
+            inserted += len(valid)
+            index_rows(db.session.connection(), valid)
+            track_inserted(db.session.connection(), valid)
+        batch.clear()
+
+    for number, raw, parse_error in rows:
+        if parse_error:
+            errors.append({'row': number, 'errors': [parse_error]})
+            continue
+        row, row_errors = normalize(raw)
+        if row_errors:
+            errors.append({'row': number, 'errors': row_errors})
+            continue
+        batch.append((number, row))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return inserted, errors
+
+
+PATCHABLE = ('project_id', 'category_id', 'severity_id', 'status_id')
+
+
+def normalize_patch(patch):
+    if not isinstance(patch, dict) or not patch:
+        raise ValueError('patch must be a non-empty object')
+    unknown = set(patch) - set(PATCHABLE)
+    if unknown:
+        raise ValueError(f'Cannot bulk update: {", ".join(sorted(unknown))}')
+    values = {}
+    for field, value in patch.items():
+        if value is None and field != 'project_id':
+            values[field] = None
+            continue
+        try:
+            values[field] = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{field} must be an integer')
+    missing = missing_references([{field: values.get(field) for field in REFERENCES}])
+    for field, ids in missing.items():
+        if ids:
+            raise ValueError(f'{field} {values[field]} does not exist')
+    return values
+
+
+def select_findings(query, data):
+    # stricter than the GET filters, which skip what they don't understand: here a typo would
+    # widen the UPDATE to every finding. Updating everything has to be asked for with "all": true
+    unknown = set(data) - {'patch', 'ids', 'filter', 'all'}
+    if unknown:
+        raise ValueError(f'Unknown keys: {", ".join(sorted(unknown))}')
+    ids, filters = data.get('ids'), data.get('filter')
+    if ids is None and filters is None:
+        if data.get('all') is not True:
+            raise ValueError('ids or filter is required, pass "all": true to update every finding')
+        return query
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or any(type(id) is not int for id in ids):
+            raise ValueError('ids must be a non-empty list of integers')
+        query = query.filter(Findings.id.in_(ids))
+    if filters is not None:
+        if not isinstance(filters, dict) or not filters:
+            raise ValueError('filter must be a non-empty object')
+        unknown = set(filters) - set(FINDING_FILTERS) - {'updated_since'}
+        if unknown:
+            raise ValueError(f'Unknown filter: {", ".join(sorted(unknown))}, '
+                             f'expected one of: {", ".join(FINDING_FILTERS + ("updated_since",))}')
+        for name in FINDING_FILTERS:
+            if name in filters and type(filters[name]) is not int:
+                raise ValueError(f'filter {name} must be an integer')
+        if 'updated_since' in filters and not isinstance(filters['updated_since'], str):
+            raise ValueError('filter updated_since must be an ISO 8601 timestamp')
+        query = filter_findings(query, MultiDict(filters))
+    return query
+
+
+def update_findings(query, patch):
+    # a single UPDATE ... WHERE, the rows are never loaded into the session
+    values = normalize_patch(patch)
+    track_bulk_update(db.session.connection(), query, values)
+    return query.update(dict(values, updated_at=datetime.now()), synchronize_session=False)
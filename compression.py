@@ -0,0 +1,105 @@
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level, wbits=31)
+
+    def stream(self, chunks):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            # sync flush so each NDJSON batch reaches the client as soon as it's produced
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, quality):
+        self.quality = quality
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.quality)
+
+    def stream(self, chunks):
+        compressor = brotli.Compressor(quality=self.quality)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+
+
+# negotiates Content-Encoding for API responses in an after_request hook. Buffered bodies under
+# COMPRESS_MIN_SIZE are sent as is, streamed bodies are always compressed chunk by chunk.
+# Responses that already have an encoding, ranges and files sent with send_file are left alone.
+class Compression:
+    def __init__(self, app=None):
+        self.encoders = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+        self.encoders = {'gzip': GzipEncoder(app.config['COMPRESS_GZIP_LEVEL'])}
+        if brotli is not None:
+            self.encoders['br'] = BrotliEncoder(app.config['COMPRESS_BROTLI_QUALITY'])
+        if app.config['COMPRESS_ENABLED']:
+            app.after_request(self.compress)
+        app.extensions['compression'] = self
+
+    def negotiate(self):
+        accepted = request.accept_encodings
+        # brotli first when the client rates it at least as high as gzip
+        candidates = sorted(self.encoders, key=lambda name: (accepted[name], name == 'br'), reverse=True)
+        for name in candidates:
+            if accepted[name] > 0:
+                return self.encoders[name]
+        return None
+
+    def compress(self, response):
+        if (response.mimetype not in self.mimetypes or response.direct_passthrough
+                or request.method == 'HEAD' or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoder = self.negotiate()
+        if encoder is None:
+            return response
+        if response.is_streamed:
+            response.response = self._stream(encoder, response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(encoder.compress(data))
+        response.headers['Content-Encoding'] = encoder.name
+        if response.headers.get('ETag'):
+            # the encoded body is a different representation of the same resource
+            etag, weak = response.get_etag()
+            response.set_etag(f'{etag}-{encoder.name}', weak)
+        return response
+
+    def _stream(self, encoder, body):
+        chunks = (chunk.encode() if isinstance(chunk, str) else chunk for chunk in body)
+        try:
+            yield from encoder.stream(chunk for chunk in chunks if chunk)
+        finally:
+            close = getattr(body, 'close', None)
+            if close is not None:
+                close()
+
+
+compression = Compression()
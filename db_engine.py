@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+import traceback
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+# how each driver takes a server-side statement timeout in milliseconds
+STATEMENT_TIMEOUT_ARGS = {
+    'psycopg2': lambda ms: {'options': f'-c statement_timeout={ms}'},
+    'psycopg': lambda ms: {'options': f'-c statement_timeout={ms}'},
+    'asyncpg': lambda ms: {'server_settings': {'statement_timeout': str(ms)}},
+}
+
+
+def caller_stack():
+    # only the application's own frames, the pool and ORM internals are the same for every checkout
+    frames = [frame for frame in traceback.extract_stack()[:-2] if 'site-packages' not in frame.filename]
+    return traceback.format_list(frames[-8:])
+
+
+# records how long callers wait for a connection and how long they hold it. Waits over
+# slow_checkout are logged as they happen, connections held past leak_timeout are logged
+# once each, checked while other callers are checking out (when a leak actually hurts).
+class TimedPool:
+    slow_checkout = 0.5
+    leak_timeout = 60.0
+    track_stacks = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._held = {}
+        self._leaks_checked_at = 0.0
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.slow_checkouts = 0
+        self.long_held = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            logger.warning('gave up on a database connection after %.3fs (%s)', time.perf_counter() - started, self.status())
+            raise
+        now = time.perf_counter()
+        waited = now - started
+        stack = caller_stack() if self.track_stacks else None
+        with self._stats_lock:
+            self._held[id(record)] = [now, stack, False]
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            if waited >= self.slow_checkout:
+                self.slow_checkouts += 1
+        if waited >= self.slow_checkout:
+            logger.warning('waited %.3fs for a database connection (%s)', waited, self.status())
+        if now - self._leaks_checked_at >= 1.0:
+            self._leaks_checked_at = now
+            self._report_leaks(now)
+        return record
+
+    def _do_return_conn(self, record):
+        with self._stats_lock:
+            held = self._held.pop(id(record), None)
+        if held and held[2]:
+            logger.warning('database connection returned after %.1fs', time.perf_counter() - held[0])
+        super()._do_return_conn(record)
+
+    def _report_leaks(self, now):
+        with self._stats_lock:
+            leaked = [held for held in self._held.values() if not held[2] and now - held[0] >= self.leak_timeout]
+            for held in leaked:
+                held[2] = True
+            self.long_held += len(leaked)
+        for checked_out_at, stack, _ in leaked:
+            where = ''.join(stack) if stack else 'set DB_POOL_TRACK_STACKS to record where\n'
+            logger.warning('database connection checked out for %.1fs, possible leak, checked out at:\n%s',
+                           now - checked_out_at, where)
+
+    def stats(self):
+        now = time.perf_counter()
+        with self._stats_lock:
+            held = [now - held[0] for held in self._held.values()]
+            return {
+                'size': self.size(),
+                'checked_out': self.checkedout(),
+                'checked_in': self.checkedin(),
+                'overflow': max(self.overflow(), 0),
+                'max_overflow': self._max_overflow,
+                'checkouts': self.checkouts,
+                'wait_avg_ms': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+                'slow_checkouts': self.slow_checkouts,
+                'long_held': self.long_held,
+                'oldest_checkout_s': round(max(held), 3) if held else 0.0,
+            }
+
+
+class TimedQueuePool(TimedPool, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def configure_pool_telemetry(config):
+    TimedPool.slow_checkout = config['DB_POOL_SLOW_CHECKOUT']
+    TimedPool.leak_timeout = config['DB_POOL_LEAK_TIMEOUT']
+    TimedPool.track_stacks = config['DB_POOL_TRACK_STACKS']
+
+
+def engine_options(config, uri, is_async=False):
+    # SQLALCHEMY_ENGINE_OPTIONS for the Flask-SQLAlchemy engine, create_async_engine kwargs for asgi.py
+    options = {'echo': config['SQLALCHEMY_ECHO']}
+    if not uri:
+        return options
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # in-memory SQLite lives in a single connection, there is nothing to pool
+        return options
+    options.update({
+        'poolclass': TimedAsyncQueuePool if is_async else TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    })
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    driver = url.get_driver_name()
+    if timeout and driver in STATEMENT_TIMEOUT_ARGS:
+        options['connect_args'] = STATEMENT_TIMEOUT_ARGS[driver](timeout)
+    return options
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    if isinstance(pool, TimedPool):
+        return pool.stats()
+    return {'status': pool.status()}
@@ -0,0 +1,144 @@
+import glob
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+}
+
+
+def render_derivative(source_path, target_path, width, fmt):
+    # runs in a pool process, the request thread only waits on the future
+    with PILImage.open(source_path) as img:
+        img.thumbnail((width, width * 10))
+        if fmt == 'jpeg' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        tmp_path = f'{target_path}.{os.getpid()}.tmp'
+        img.save(tmp_path, FORMATS[fmt][0], quality=80)
+    os.replace(tmp_path, target_path)
+    return target_path
+
+
+class DerivativeStore:
+    def __init__(self, app=None):
+        self.image_store = None
+        self._executor = None
+        self._executor_pid = None
+        self._inflight = {}
+        self._lock = threading.RLock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.image_store = app.extensions['image_store']
+        self.widths = sorted(app.config['IMAGE_DERIVATIVE_WIDTHS'])
+        self.presets = app.config['IMAGE_DERIVATIVE_PRESETS']
+        self.max_workers = app.config['IMAGE_DERIVATIVE_WORKERS']
+        self.timeout = app.config['IMAGE_DERIVATIVE_TIMEOUT']
+        app.extensions['image_derivatives'] = self
+
+    @property
+    def available(self):
+        return PILImage is not None
+
+    def resolve(self, args):
+        # None means the original was asked for
+        size, width, fmt = args.get('size'), args.get('w'), args.get('fmt')
+        if size is None and width is None and fmt is None:
+            return None
+        # fmt ends up in a file name, nothing outside FORMATS gets that far
+        if fmt is not None and fmt not in FORMATS:
+            raise ValueError(f'Unknown fmt, expected one of: {", ".join(FORMATS)}')
+        if size is not None:
+            if size not in self.presets:
+                raise ValueError(f'Unknown size, expected one of: {", ".join(self.presets)}')
+            preset_width, preset_fmt = self.presets[size]
+            return preset_width, fmt or preset_fmt
+        fmt = fmt or 'webp'
+        if width is None:
+            return self.widths[-1], fmt
+        try:
+            width = int(width)
+        except ValueError:
+            raise ValueError('w must be an integer')
+        if width <= 0:
+            raise ValueError('w must be positive')
+        # snap to a configured width so the number of cached variants per image stays bounded
+        return next((w for w in self.widths if w >= width), self.widths[-1]), fmt
+
+    def path_for(self, digest, width, fmt):
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown fmt {fmt!r}')
+        return os.path.join(self.image_store.root, 'derivatives', digest[:2], digest[2:4], f'{digest}-{width}.{fmt}')
+
+    def get(self, digest, width, fmt):
+        path = self.path_for(digest, width, fmt)
+        if os.path.exists(path):
+            return path
+        try:
+            return self._submit(digest, width, fmt).result(timeout=self.timeout)
+        except FutureTimeoutError:
+            logger.warning('derivative %s-%s.%s timed out', digest, width, fmt)
+        except Exception:
+            logger.exception('derivative %s-%s.%s failed', digest, width, fmt)
+        return None
+
+    def warm(self, digest):
+        if not self.available:
+            return
+        for width, fmt in self.presets.values():
+            if not os.path.exists(self.path_for(digest, width, fmt)):
+                self._submit(digest, width, fmt)
+
+    def delete(self, digest):
+        pattern = os.path.join(self.image_store.root, 'derivatives', digest[:2], digest[2:4], f'{digest}-*')
+        for path in glob.glob(pattern):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _submit(self, digest, width, fmt):
+        # concurrent requests for the same variant share one future instead of rendering it twice
+        key = (digest, width, fmt)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._get_executor().submit(
+                    render_derivative, self.image_store.path_for(digest), self.path_for(digest, width, fmt), width, fmt
+                )
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._forget(key))
+            return future
+
+    def _forget(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def _get_executor(self):
+        # the pool is created lazily per process so forking servers don't inherit the parent's
+        if self._executor is None or self._executor_pid != os.getpid():
+            # forking a threaded worker (gunicorn gthread) can copy a lock some other thread holds,
+            # the child then waits on it forever; forkserver children fork from a clean process
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context(method))
+            self._executor_pid = os.getpid()
+            self._inflight = {}
+        return self._executor
+
+
+derivatives = DerivativeStore()
@@ -0,0 +1,163 @@
+import re
+import zipfile
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func
+from werkzeug.utils import secure_filename
+from fields import Fields
+from image_store import CHUNK_SIZE
+from models import db, Findings, Image, Project
+from render import image_id, renderer
+
+# entries whose size could pass 4 GiB get zip64 headers up front, the size can't be patched in afterwards
+ZIP64_THRESHOLD = 2 ** 31
+IMAGE_LINK_RE = re.compile(r'\(<[^>]*?/api/image/(\d+)[^>]*>\)')
+# project.json carries the project's own columns, the findings go in batches after it
+PROJECT_FIELDS = Fields(['id', 'name', 'description', 'created_at', 'updated_at'])
+
+
+# write-only file for ZipFile. Without tell/seek ZipFile streams: every entry is followed by a data
+# descriptor instead of going back to patch its header, so whatever was written can be sent at once
+class StreamSink:
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_time(value):
+    value = value or datetime.now()
+    return max(value, datetime(1980, 1, 1)).timetuple()[:6]
+
+
+def referenced_images(finding):
+    ids = set()
+    blocks = finding.description.get('blocks') if isinstance(finding.description, dict) else None
+    for block in blocks or []:
+        if isinstance(block, dict) and block.get('type') == 'image' and isinstance(block.get('data'), dict):
+            data = block['data']
+            id = image_id((data.get('file') or {}).get('url') or data.get('url'))
+            if id is not None:
+                ids.add(id)
+    return ids
+
+
+def image_path(image):
+    return f'images/{image.id}-{secure_filename(image.filename or "") or "image"}'
+
+
+def export_project(project_id, batch_size, progress=None):
+    # yields the archive piece by piece: project.json, then per batch of findings their documents
+    # followed by the images they bring in, and manifest.json last. Only one batch of rows and one
+    # image chunk are held at a time, the ZipInfo kept per entry for the central directory is the
+    # only thing that grows with the export
+    sink = StreamSink()
+    dumps = current_app.json.dumps
+    project = db.session.get(Project, project_id, options=Project.eager_options(PROJECT_FIELDS))
+    total = db.session.query(func.count(Findings.id)).filter(Findings.project_id == project_id).scalar()
+    version = renderer.fragment_version()
+    exported, missing, seen = [], [], set()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(zipfile.ZipInfo('project.json', zip_time(project.updated_at)),
+                         dumps(project.to_dict(PROJECT_FIELDS)), zipfile.ZIP_DEFLATED)
+        yield sink.drain()
+
+        done, last_id = 0, 0
+        while True:
+            # keyset on id, the next batch is an index range scan however far in the export is
+            batch = (Findings.query
+                     .filter(Findings.project_id == project_id, Findings.id > last_id)
+                     .order_by(Findings.id)
+                     .limit(batch_size)
+                     .all())
+            if not batch:
+                break
+            last_id = batch[-1].id
+            references = {finding.id: referenced_images(finding) for finding in batch}
+            attached = db.session.query(Image.id, Image.finding_id).filter(Image.finding_id.in_(references))
+            for id, finding_id in attached:
+                references[finding_id].add(id)
+            wanted = set().union(*references.values())
+            images = {image.id: image for image in Image.query.filter(Image.id.in_(wanted))} if wanted else {}
+            paths = {id: image_path(image) for id, image in images.items()}
+
+            for finding in batch:
+                name = f'findings/{finding.id}-{secure_filename(finding.title or "")[:60] or "finding"}'
+                document = dict(finding.to_dict(), images=[
+                    {'id': id, 'path': paths.get(id)} for id in sorted(references[finding.id])
+                ])
+                when = zip_time(finding.updated_at)
+                archive.writestr(zipfile.ZipInfo(name + '.json', when), dumps(document), zipfile.ZIP_DEFLATED)
+                # the Markdown points at the copies in the archive instead of this server
+                markdown = IMAGE_LINK_RE.sub(
+                    lambda match: f'(<../{paths[int(match.group(1))]}>)' if int(match.group(1)) in paths else match.group(0),
+                    renderer.fragment(finding, 'md', version),
+                )
+                archive.writestr(zipfile.ZipInfo(name + '.md', when), markdown, zipfile.ZIP_DEFLATED)
+                yield sink.drain()
+
+            for id in sorted(wanted - seen):
+                seen.add(id)
+                image = images.get(id)
+                if image is None:
+                    missing.append(id)
+                    continue
+                written = yield from write_image(archive, sink, image, paths[id])
+                if written:
+                    exported.append({'id': id, 'path': paths[id], 'filename': image.filename,
+                                     'content_type': image.content_type, 'size': image.size, 'sha256': image.sha256})
+                else:
+                    missing.append(id)
+            done += len(batch)
+            # the identity map would otherwise keep every finding of the export
+            db.session.expunge_all()
+            if progress:
+                progress(done, total)
+
+        manifest = {'project_id': project_id, 'exported_at': datetime.now(), 'findings': done,
+                    'images': exported, 'missing_images': missing}
+        archive.writestr(zipfile.ZipInfo('manifest.json', zip_time(None)), dumps(manifest), zipfile.ZIP_DEFLATED)
+        yield sink.drain()
+    # closing the archive wrote the central directory
+    yield sink.drain()
+
+
+def write_image(archive, sink, image, path):
+    image_store = current_app.extensions['image_store']
+    info = zipfile.ZipInfo(path, zip_time(image.uploaded_at))
+    # screenshots are already compressed, deflating them again only costs CPU
+    info.compress_type = zipfile.ZIP_STORED
+    if image.sha256:
+        try:
+            source = open(image_store.path_for(image.sha256), 'rb')
+        except FileNotFoundError:
+            return False
+        with source, archive.open(info, 'w', force_zip64=(image.size or 0) >= ZIP64_THRESHOLD) as entry:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                entry.write(chunk)
+                yield sink.drain()
+        return True
+    # a legacy row that still carries its blob inline, those predate the store and are small
+    data = db.session.query(Image.data).filter(Image.id == image.id).scalar()
+    if data is None:
+        return False
+    archive.writestr(info, data)
+    yield sink.drain()
+    return True
+
+
+def export_filename(project):
+    return f'{secure_filename(project.name or "") or "project"}-{project.id}.zip'
@@ -0,0 +1,52 @@
+from sqlalchemy import inspect
+from sqlalchemy.orm import load_only
+
+
+def split(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+# ?fields=id,title,findings.title picks keys, ?include=findings adds keys a serializer leaves out
+# by default. Nested objects get the dotted names with their prefix stripped.
+class Fields:
+    def __init__(self, fields=None, include=()):
+        self.fields = set(fields) if fields is not None else None
+        self.include = set(include)
+
+    @classmethod
+    def from_args(cls, args):
+        fields, include = args.get('fields'), args.get('include')
+        return cls(split(fields) if fields else None, split(include) if include else ())
+
+    def requested(self, name):
+        names = self.include | (self.fields or set())
+        return name in names or any(n.startswith(name + '.') for n in names)
+
+    def wants(self, name):
+        return self.fields is None or self.requested(name)
+
+    def nested(self, name):
+        prefix = name + '.'
+        fields = None
+        if self.fields is not None:
+            fields = {n[len(prefix):] for n in self.fields if n.startswith(prefix)} or None
+        return Fields(fields, {n[len(prefix):] for n in self.include if n.startswith(prefix)})
+
+    def pick(self, getters, optional=None):
+        data = {name: get() for name, get in getters.items() if self.wants(name)}
+        for name, get in (optional or {}).items():
+            if self.requested(name):
+                data[name] = get()
+        return data
+
+    def load_only(self, model, aliases=None, always=()):
+        # columns behind unrequested fields are never selected, not just dropped after loading
+        if self.fields is None:
+            return ()
+        aliases = aliases or {}
+        columns = inspect(model).column_attrs.keys()
+        names = {aliases.get(n, n) for n in self.fields} | set(always) | {'id', 'created_at'}
+        return (load_only(*[getattr(model, n) for n in sorted(names) if n in columns]),)
+
+
+ALL_FIELDS = Fields()
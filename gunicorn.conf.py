@@ -0,0 +1,22 @@
+# gunicorn app:app -c gunicorn.conf.py
+import glob
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:6060')
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+
+
+def on_starting(server):
+    # /metrics sums every file in PROMETHEUS_MULTIPROC_DIR, files left by a previous run would skew it
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, '*.db')):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,116 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from io import BytesIO
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def copy_stream(stream, out, hasher, max_bytes=None, size=0):
+    # copies chunk by chunk, the upload is never held in memory as a whole
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if max_bytes is not None and size > max_bytes:
+            raise UploadTooLarge(f'File exceeds the {max_bytes} byte limit')
+        hasher.update(chunk)
+        out.write(chunk)
+    return size
+
+
+# content-addressed blob store, files live at <root>/<ab>/<cd>/<sha256>
+class ImageStore:
+    def __init__(self, app=None):
+        self.root = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.root = app.config['IMAGE_STORE_PATH']
+        self.grace = app.config['IMAGE_GC_GRACE']
+        os.makedirs(os.path.join(self.root, 'tmp'), exist_ok=True)
+        os.makedirs(os.path.join(self.root, 'locks'), exist_ok=True)
+        app.extensions['image_store'] = self
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path_for(digest))
+
+    def save_stream(self, stream, max_bytes=None):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        hasher = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                size = copy_stream(stream, out, hasher, max_bytes)
+            digest = hasher.hexdigest()
+            self.adopt(tmp_path, digest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, size
+
+    def save_bytes(self, data):
+        return self.save_stream(BytesIO(data))
+
+    @contextmanager
+    def lock(self, digest):
+        # one lock file per two-hex-digit prefix, held across processes while a blob is
+        # adopted or removed so the two never interleave
+        with open(os.path.join(self.root, 'locks', digest[:2]), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def adopt(self, tmp_path, digest):
+        # moves a fully written file into place, tmp_path must be on the same filesystem
+        path = self.path_for(digest)
+        with self.lock(digest):
+            if os.path.exists(path):
+                # identical content is already stored, keep the existing file. Touching it tells
+                # delete() an upload is about to reference it even though no row says so yet
+                os.utime(path)
+                os.remove(tmp_path)
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+
+    def delete(self, digest):
+        # called once no row references the digest. A blob adopted within the grace period may
+        # belong to an upload that hasn't committed its row yet, it stays for `flask images-gc`
+        # to look at again later. Returns whether the file was removed
+        path = self.path_for(digest)
+        with self.lock(digest):
+            try:
+                if os.path.getmtime(path) > time.time() - self.grace:
+                    return False
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return True
+
+    def digests(self):
+        # every blob in the store, derivatives, locks and partial writes live elsewhere
+        for prefix in sorted(os.listdir(self.root)):
+            if len(prefix) != 2:
+                continue
+            for middle in sorted(os.listdir(os.path.join(self.root, prefix))):
+                directory = os.path.join(self.root, prefix, middle)
+                if len(middle) == 2 and os.path.isdir(directory):
+                    yield from sorted(os.listdir(directory))
+
+
+image_store = ImageStore()
@@ -0,0 +1,346 @@
+import importlib
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import OperationalError
+from authz import registered_permissions
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+# a handler reporting progress in a tight loop writes at most this often
+PROGRESS_INTERVAL = 1.0
+MAINTENANCE_INTERVAL = 60.0
+CLAIM_CANDIDATES = 5
+
+JobKind = namedtuple('JobKind', 'run permissions validate')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# raised in the worker's main thread by SIGTERM/SIGINT so a running job is handed back to the queue
+class WorkerShutdown(BaseException):
+    pass
+
+
+# what a handler gets besides its params: progress reporting, the cancel flag and a place for a result file
+class JobContext:
+    def __init__(self, queue, job):
+        self.id = job.id
+        self.attempt = job.attempts
+        self.cancel_requested = job.cancel_requested
+        self.result_file = None
+        self.result_type = None
+        self._queue = queue
+        self._reported_at = 0.0
+
+    def progress(self, done, total=None, message=None):
+        # also the point where a cancel request takes effect, long handlers should call it regularly
+        now = time.monotonic()
+        if now - self._reported_at >= PROGRESS_INTERVAL or (total is not None and done >= total):
+            self._reported_at = now
+            if self._queue.report(self.id, done, total, message):
+                self.cancel_requested = True
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self.cancel_requested:
+            raise JobCancelled()
+
+    def result_path(self, filename, mimetype='application/octet-stream'):
+        directory = os.path.join(self._queue.result_root, self.id)
+        os.makedirs(directory, exist_ok=True)
+        self.result_file = f'{self.id}/{filename}'
+        self.result_type = mimetype
+        return os.path.join(directory, filename)
+
+
+# DB-backed queue. The web process only inserts rows, `flask jobs-worker` runs a pool of local
+# processes that claim them with a conditional UPDATE, so no broker is needed and any number of
+# worker hosts can share the table
+class JobQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self.handlers = {}
+        self._current = None
+        self._stopping = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.result_root = app.config['JOB_RESULT_PATH']
+        self.result_ttl = timedelta(seconds=app.config['JOB_RESULT_TTL'])
+        self.workers = app.config['JOB_WORKERS']
+        self.poll_interval = app.config['JOB_POLL_INTERVAL']
+        self.heartbeat_interval = app.config['JOB_HEARTBEAT_INTERVAL']
+        self.stale_after = timedelta(seconds=app.config['JOB_STALE_AFTER'])
+        self.max_attempts = app.config['JOB_MAX_ATTEMPTS']
+        self.shutdown_timeout = app.config['JOB_SHUTDOWN_TIMEOUT']
+        os.makedirs(self.result_root, exist_ok=True)
+        app.extensions['jobs'] = self
+
+    def handler(self, kind, *permissions, validate=None):
+        # @jobs.handler('report', 'projects:read'): submitting the job also needs the listed permissions,
+        # validate(params) raises ValueError to reject a submission before it is queued
+        registered_permissions.update(permissions)
+
+        def decorator(run):
+            self.handlers[kind] = JobKind(run, permissions, validate)
+            return run
+        return decorator
+
+    def submit(self, kind, params, name=None, created_by=None):
+        if kind not in self.handlers:
+            raise ValueError(f'Unknown job kind, expected one of: {", ".join(sorted(self.handlers))}')
+        if not isinstance(params, dict):
+            raise ValueError('params must be an object')
+        if self.handlers[kind].validate:
+            self.handlers[kind].validate(params)
+        job = Job(id=uuid.uuid4().hex, kind=kind, name=name, params=params, status=QUEUED, progress_done=0,
+                  attempts=0, cancel_requested=False, created_by=created_by)
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    def cancel(self, job_id):
+        # 'cancelled' when the job never started, 'requested' when its handler has to notice, None when it already finished
+        now = datetime.now()
+        cancelled = db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == QUEUED)
+            .values(status=CANCELLED, cancel_requested=True, finished_at=now, expires_at=now + self.result_ttl)
+        ).rowcount
+        requested = cancelled or db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == RUNNING).values(cancel_requested=True)
+        ).rowcount
+        db.session.commit()
+        if cancelled:
+            return CANCELLED
+        return 'requested' if requested else None
+
+    def path_for(self, job):
+        return os.path.join(self.result_root, job.result_file)
+
+    # worker side, these use their own short transactions so a handler's session is never committed by accident
+
+    def claim(self, worker):
+        with db.engine.begin() as connection:
+            candidates = connection.execute(
+                select(Job.id).where(Job.status == QUEUED).order_by(Job.created_at, Job.id).limit(CLAIM_CANDIDATES)
+            ).scalars().all()
+        for job_id in candidates:
+            now = datetime.now()
+            with db.engine.begin() as connection:
+                claimed = connection.execute(
+                    update(Job).where(Job.id == job_id, Job.status == QUEUED)
+                    .values(status=RUNNING, worker=worker, started_at=now, heartbeat_at=now, message=None, attempts=Job.attempts + 1)
+                ).rowcount
+            # another worker got there first, try the next one
+            if claimed:
+                return job_id
+        return None
+
+    def report(self, job_id, done, total=None, message=None):
+        values = {'progress_done': done, 'heartbeat_at': datetime.now()}
+        if total is not None:
+            values['progress_total'] = total
+        if message is not None:
+            values['message'] = str(message)[:255]
+        if self._holds_sqlite_write_lock():
+            return False
+        with db.engine.begin() as connection:
+            connection.execute(update(Job).where(Job.id == job_id).values(**values))
+            return bool(connection.execute(select(Job.cancel_requested).where(Job.id == job_id)).scalar())
+
+    def _holds_sqlite_write_lock(self):
+        # SQLite has a single writer: once the handler's own transaction has written, a second
+        # connection would wait out the busy timeout and fail, so progress waits for its commit
+        if db.engine.dialect.name != 'sqlite' or not db.session().in_transaction():
+            return False
+        return db.session.connection().connection.dbapi_connection.in_transaction
+
+    def run(self, job_id, worker):
+        job = db.session.get(Job, job_id)
+        name, kind = job.kind, self.handlers.get(job.kind)
+        context = JobContext(self, job)
+        params = job.params or {}
+        db.session.rollback()
+        stop = threading.Event()
+        # the thread has no app context, hand it the engine
+        heartbeat = threading.Thread(target=self._heartbeat, args=(db.engine, context, worker, stop), daemon=True)
+        heartbeat.start()
+        self._current = job_id
+        try:
+            if kind is None:
+                raise ValueError(f'No handler for job kind {name!r} in this worker')
+            result = kind.run(context, params)
+            db.session.commit()
+            self._finish(job_id, worker, SUCCEEDED, result=result, result_file=context.result_file,
+                         result_type=context.result_type)
+        except JobCancelled:
+            db.session.rollback()
+            self._discard_result(job_id)
+            self._finish(job_id, worker, CANCELLED)
+        except WorkerShutdown:
+            db.session.rollback()
+            self._discard_result(job_id)
+            self._release(job_id, worker)
+            raise
+        except Exception as error:
+            db.session.rollback()
+            logger.exception('job %s (%s) failed', job_id, name)
+            self._discard_result(job_id)
+            self._finish(job_id, worker, FAILED, error=f'{type(error).__name__}: {error}')
+        finally:
+            self._current = None
+            stop.set()
+            heartbeat.join()
+            db.session.remove()
+
+    def work(self, worker):
+        # one worker process: claim, run, repeat until SIGTERM/SIGINT
+        def shutdown(signum, frame):
+            self._stopping = True
+            if self._current is not None:
+                raise WorkerShutdown()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        with self.app.app_context():
+            while not self._stopping:
+                try:
+                    job_id = self.claim(worker)
+                    if job_id is None:
+                        time.sleep(self.poll_interval)
+                        continue
+                    self.run(job_id, worker)
+                except WorkerShutdown:
+                    break
+                except Exception:
+                    # the database went away or similar, back off instead of spinning
+                    logger.exception('job worker %s could not poll the queue', worker)
+                    db.session.remove()
+                    time.sleep(self.poll_interval * 5)
+
+    def serve(self, processes, import_name):
+        # the pool: keeps `processes` workers alive and does the queue maintenance itself.
+        # spawn gives every worker a fresh interpreter and its own connection pool
+        context = multiprocessing.get_context('spawn')
+        children = {}
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+        next_maintenance = 0.0
+        while not stopping:
+            for index in range(processes):
+                process = children.get(index)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    logger.warning('job worker %s exited with %s, restarting', process.pid, process.exitcode)
+                process = context.Process(target=worker_main, args=(import_name,), name=f'job-worker-{index}')
+                process.start()
+                children[index] = process
+            if time.monotonic() >= next_maintenance:
+                try:
+                    self.maintain()
+                except Exception:
+                    logger.exception('job queue maintenance failed')
+                next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+            time.sleep(1)
+        # workers put their running job back in the queue on SIGTERM
+        for process in children.values():
+            process.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in children.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+
+    def maintain(self):
+        return {'requeued': self.requeue_stale(), 'purged': self.purge_expired()}
+
+    def requeue_stale(self):
+        # a worker that was killed outright stops heartbeating, its job goes back to the queue
+        # until it has used up JOB_MAX_ATTEMPTS
+        now = datetime.now()
+        stale = (Job.status == RUNNING, Job.heartbeat_at < now - self.stale_after)
+        finished = {'finished_at': now, 'expires_at': now + self.result_ttl, 'worker': None}
+        with db.engine.begin() as connection:
+            connection.execute(update(Job).where(*stale, Job.cancel_requested.is_(True))
+                               .values(status=CANCELLED, **finished))
+            connection.execute(update(Job).where(*stale, Job.attempts >= self.max_attempts)
+                               .values(status=FAILED, error='The worker running this job stopped responding', **finished))
+            requeued = connection.execute(update(Job).where(*stale).values(
+                status=QUEUED, worker=None, message='Requeued after its worker stopped responding'
+            )).rowcount
+        return requeued
+
+    def purge_expired(self, batch_size=500):
+        purged = 0
+        while True:
+            with db.engine.begin() as connection:
+                ids = connection.execute(
+                    select(Job.id).where(Job.status.in_(FINISHED), Job.expires_at < datetime.now()).limit(batch_size)
+                ).scalars().all()
+                if not ids:
+                    return purged
+                for job_id in ids:
+                    self._discard_result(job_id)
+                connection.execute(delete(Job).where(Job.id.in_(ids)))
+            purged += len(ids)
+
+    def _heartbeat(self, engine, context, worker, stop):
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                with engine.begin() as connection:
+                    connection.execute(update(Job).where(Job.id == context.id, Job.worker == worker)
+                                       .values(heartbeat_at=datetime.now()))
+                    if connection.execute(select(Job.cancel_requested).where(Job.id == context.id)).scalar():
+                        context.cancel_requested = True
+            except OperationalError as error:
+                # on SQLite while the handler holds the write lock, the next beat gets through
+                logger.debug('heartbeat for job %s skipped: %s', context.id, error)
+            except Exception:
+                logger.exception('heartbeat for job %s failed', context.id)
+
+    def _finish(self, job_id, worker, status, **values):
+        now = datetime.now()
+        with db.engine.begin() as connection:
+            # the worker check keeps a job that was requeued as stale from being overwritten
+            connection.execute(
+                update(Job).where(Job.id == job_id, Job.status == RUNNING, Job.worker == worker)
+                .values(status=status, finished_at=now, heartbeat_at=now, expires_at=now + self.result_ttl, **values)
+            )
+
+    def _release(self, job_id, worker):
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(Job).where(Job.id == job_id, Job.status == RUNNING, Job.worker == worker)
+                .values(status=QUEUED, worker=None, attempts=Job.attempts - 1, message='Requeued by worker shutdown')
+            )
+
+    def _discard_result(self, job_id):
+        shutil.rmtree(os.path.join(self.result_root, job_id), ignore_errors=True)
+
+
+def worker_main(import_name):
+    # entry point of a spawned worker, the app module is imported again in the new interpreter
+    app = importlib.import_module(import_name).app
+    app.extensions['jobs'].work(f'{socket.gethostname()}:{os.getpid()}'[:64])
+
+
+jobs = JobQueue()
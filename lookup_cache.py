@@ -0,0 +1,112 @@
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# set while the cache reloads or checks versions, so the SQL profiler can tell those
+# statements apart from the ones a view issues itself
+refreshing = ContextVar('lookup_cache_refreshing', default=False)
+
+
+# in-process copy of the small reference tables, keyed by id. Every write bumps the table's
+# row in cache_versions inside the same transaction, each worker compares its copy against
+# those versions at most once per LOOKUP_CACHE_CHECK_INTERVAL seconds
+class LookupCache:
+    def __init__(self, db, version_model):
+        self.db = db
+        self.version_model = version_model
+        self.check_interval = 1.0
+        self._loaders = {}
+        self._tables = {}
+        self._versions = {}
+        self._checked_at = 0.0
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def init_app(self, app):
+        self.check_interval = app.config['LOOKUP_CACHE_CHECK_INTERVAL']
+        app.extensions['lookup_cache'] = self
+
+    def register(self, table, loader):
+        self._loaders[table] = loader
+
+    def get(self, table, id):
+        if id is None:
+            return None
+        return self.all(table).get(id)
+
+    def all(self, table):
+        self._check_versions()
+        version = self._versions.get(table, 0)
+        cached = self._tables.get(table)
+        if cached is not None and cached[0] == version:
+            self.hits[table] += 1
+            return cached[1]
+        self.misses[table] += 1
+        token = refreshing.set(True)
+        try:
+            entries = self._loaders[table]()
+        finally:
+            refreshing.reset(token)
+        self._tables[table] = (version, entries)
+        return entries
+
+    def warm(self):
+        # loads every stale table now, so the lookups made while serializing stay in memory
+        for table in self._loaders:
+            self.all(table)
+
+    def version(self, table, at_least=0):
+        # a caller holding a newer version (e.g. from a token issued by another worker) forces a re-check
+        if self._versions.get(table, 0) < at_least:
+            self._checked_at = 0.0
+        self._check_versions()
+        return self._versions.get(table, 0)
+
+    def invalidate(self, *tables):
+        session = self.db.session
+        model = self.version_model
+        for table in tables:
+            bumped = (session.query(model)
+                      .filter_by(name=table)
+                      .update({model.version: model.version + 1}, synchronize_session=False))
+            if not bumped:
+                session.add(model(name=table, version=1))
+        session.info.setdefault('lookup_invalidations', set()).update(tables)
+
+    def stats(self):
+        return {
+            table: {
+                'hits': self.hits[table],
+                'misses': self.misses[table],
+                'version': self._versions.get(table, 0),
+                'size': len(self._tables[table][1]) if table in self._tables else 0,
+            }
+            for table in self._loaders
+        }
+
+    def _check_versions(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        model = self.version_model
+        token = refreshing.set(True)
+        try:
+            self._versions = dict(self.db.session.query(model.name, model.version).all())
+        finally:
+            refreshing.reset(token)
+        self._checked_at = now
+
+    def _after_commit(self, session):
+        tables = session.info.pop('lookup_invalidations', None)
+        if tables:
+            # this worker sees its own writes right away, the others on their next version check
+            for table in tables:
+                self._tables.pop(table, None)
+            self._checked_at = 0.0
+
+    def _after_rollback(self, session):
+        session.info.pop('lookup_invalidations', None)
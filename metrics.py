@@ -0,0 +1,152 @@
+import os
+import time
+from contextvars import ContextVar
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from db_engine import TimedPool
+from models import db, lookups
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+except ImportError:
+    prometheus_client = None
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100, 250)
+SYNC_INTERVAL = 1.0
+
+# [query count, seconds spent in queries] for the request being handled. A ContextVar rather
+# than flask.g so queries made by the async views (greenlets, worker threads) are counted too.
+request_queries = ContextVar('request_queries', default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    totals = request_queries.get()
+    if totals is not None:
+        totals[0] += 1
+        totals[1] += elapsed
+
+
+# Prometheus metrics for every request. With PROMETHEUS_MULTIPROC_DIR set (required under
+# gunicorn, see gunicorn.conf.py) each worker writes to its own mmap'd files and /metrics
+# aggregates all of them. Pool and lookup cache figures are copied from the in-process
+# counters at most once per second per worker, so a request pays for a few observe() calls.
+class Metrics:
+    def __init__(self, app=None):
+        self.available = prometheus_client is not None
+        self.enabled = False
+        self._synced_at = 0.0
+        self._seen = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = self.available and app.config['METRICS_ENABLED']
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        self.app = app
+        # the *_created samples double the scrape size and nothing here reads them
+        prometheus_client.disable_created_metrics()
+        self._define()
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _define(self):
+        labels = ('method', 'endpoint')
+        self.requests = Counter('http_requests_total', 'HTTP requests', labels + ('status',))
+        self.latency = Histogram('http_request_duration_seconds', 'Time to build the response', labels,
+                                 buckets=LATENCY_BUCKETS)
+        self.response_size = Histogram('http_response_size_bytes', 'Response body size', labels, buckets=SIZE_BUCKETS)
+        self.db_queries = Histogram('http_request_db_queries', 'SQL statements per request', labels,
+                                    buckets=QUERY_COUNT_BUCKETS)
+        self.db_time = Histogram('http_request_db_seconds', 'Time spent in SQL per request', labels,
+                                 buckets=LATENCY_BUCKETS)
+        self.pool_gauges = {
+            name: Gauge(f'db_pool_{name}', f'Pool connections ({name})', ['engine'], multiprocess_mode='livesum')
+            for name in ('size', 'checked_out', 'checked_in', 'overflow')
+        }
+        self.pool_counters = {
+            'checkouts': Counter('db_pool_checkouts_total', 'Pool checkouts', ['engine']),
+            'wait_seconds': Counter('db_pool_wait_seconds_total', 'Time spent waiting for a connection', ['engine']),
+            'slow_checkouts': Counter('db_pool_slow_checkouts_total', 'Checkouts over DB_POOL_SLOW_CHECKOUT', ['engine']),
+            'long_held': Counter('db_pool_long_held_total', 'Checkouts held past DB_POOL_LEAK_TIMEOUT', ['engine']),
+        }
+        self.cache_counters = {
+            'hits': Counter('lookup_cache_hits_total', 'Lookup cache hits', ['table']),
+            'misses': Counter('lookup_cache_misses_total', 'Lookup cache reloads', ['table']),
+        }
+
+    def _start(self):
+        request.environ['metrics.started'] = time.perf_counter()
+        request.environ['metrics.queries'] = totals = [0, 0.0]
+        request_queries.set(totals)
+
+    def _finish(self, response):
+        started = request.environ.get('metrics.started')
+        if started is None:
+            return response
+        labels = (request.method, request.url_rule.rule if request.url_rule else 'unmatched')
+        self.requests.labels(*labels, response.status_code).inc()
+        self.latency.labels(*labels).observe(time.perf_counter() - started)
+        if response.content_length is not None:
+            self.response_size.labels(*labels).observe(response.content_length)
+        queries, seconds = request.environ['metrics.queries']
+        self.db_queries.labels(*labels).observe(queries)
+        self.db_time.labels(*labels).observe(seconds)
+        now = time.monotonic()
+        if now - self._synced_at >= SYNC_INTERVAL:
+            self._synced_at = now
+            self._sync()
+        return response
+
+    def _sync(self):
+        engines = {'sync': db.engine}
+        if 'async_engine' in self.app.extensions:
+            engines['async'] = self.app.extensions['async_engine'].sync_engine
+        for name, engine in engines.items():
+            pool = engine.pool
+            if not isinstance(pool, TimedPool):
+                continue
+            stats = pool.stats()
+            for key, gauge in self.pool_gauges.items():
+                gauge.labels(name).set(stats[key])
+            self._advance(self.pool_counters['checkouts'], name, pool.checkouts)
+            self._advance(self.pool_counters['wait_seconds'], name, pool.wait_total)
+            self._advance(self.pool_counters['slow_checkouts'], name, pool.slow_checkouts)
+            self._advance(self.pool_counters['long_held'], name, pool.long_held)
+        for table, stats in lookups.stats().items():
+            self._advance(self.cache_counters['hits'], table, stats['hits'])
+            self._advance(self.cache_counters['misses'], table, stats['misses'])
+
+    def _advance(self, counter, label, total):
+        # turns an in-process running total into Counter increments
+        key = (counter, label)
+        delta = total - self._seen.get(key, 0)
+        if delta < 0:
+            # the pool was recreated (engine.dispose) and its totals started over
+            delta = total
+        if delta:
+            counter.labels(label).inc(delta)
+        self._seen[key] = total
+
+    def render(self):
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+metrics = Metrics()
@@ -0,0 +1,41 @@
+"""adds full-text search index over findings
+
+Revision ID: 8324580a21ee
+Revises: c2fbcba0876a
+Create Date: 2026-10-18 13:21:05.871442
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8324580a21ee'
+down_revision = 'c2fbcba0876a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the body column holds text extracted from the JSON description blocks in Python,
+    # run `flask search-reindex` after upgrading to fill it for existing findings
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("""
+            CREATE TABLE finding_search (
+                finding_id INTEGER PRIMARY KEY REFERENCES findings (id) ON DELETE CASCADE,
+                title TEXT NOT NULL DEFAULT '',
+                body TEXT NOT NULL DEFAULT '',
+                tsv TSVECTOR GENERATED ALWAYS AS (
+                    setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', body), 'B')
+                ) STORED
+            )
+        """)
+        op.execute("CREATE INDEX ix_finding_search_tsv ON finding_search USING GIN (tsv)")
+    else:
+        op.execute("CREATE VIRTUAL TABLE finding_search_fts USING fts5(title, body, tokenize='porter unicode61')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP TABLE finding_search")
+    else:
+        op.execute("DROP TABLE finding_search_fts")
@@ -0,0 +1,31 @@
+"""backfills created_at on findings and projects and makes it NOT NULL
+
+Revision ID: e41c7a9d2b63
+Revises: b7e3c91d4a28
+Create Date: 2026-10-18 21:40:37.518902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41c7a9d2b63'
+down_revision = 'b7e3c91d4a28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keyset pagination orders on (created_at, id), a NULL created_at can't go into a cursor
+    # and never compares greater than one. Rows without it take their updated_at, or now
+    for table in ('findings', 'projects'):
+        op.execute(f"UPDATE {table} SET created_at = COALESCE(updated_at, CURRENT_TIMESTAMP) WHERE created_at IS NULL")
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    for table in ('projects', 'findings'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=True)
@@ -1,5 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy_serializer import SerializerMixin
+from sqlalchemy.orm import selectinload
+from lookup_cache import LookupCache
+from fields import ALL_FIELDS
 from datetime import datetime
 db = SQLAlchemy()
 import base64
@@ -9,54 +12,79 @@ from io import BytesIO
 
 class Project(db.Model, SerializerMixin):
     __tablename__ = 'projects'
+    __table_args__ = (
+        db.Index('ix_projects_created_at_id', 'created_at', 'id'),
+        db.Index('ix_projects_updated_at', 'updated_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255))
     description = db.Column(db.JSON)
-    created_at = db.Column(db.DateTime, default=datetime.now)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     findings = db.relationship('Findings', backref='project', cascade='all, delete-orphan')
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at,
-            'findings': [finding.to_dict() for finding in self.findings]
-        }
+
+    @classmethod
+    def eager_options(cls, fields=ALL_FIELDS):
+        options = fields.load_only(cls)
+        if fields.wants('findings'):
+            nested = fields.nested('findings')
+            options += (selectinload(cls.findings).options(*Findings.eager_options(nested, always=('project_id',))),)
+        return options
+
+    def to_dict(self, fields=ALL_FIELDS):
+        return fields.pick({
+            'id': lambda: self.id,
+            'name': lambda: self.name,
+            'description': lambda: self.description,
+            'created_at': lambda: self.created_at,
+            'updated_at': lambda: self.updated_at,
+            'findings': lambda: [finding.to_dict(fields.nested('findings')) for finding in self.findings]
+        })
 class Findings(db.Model, SerializerMixin):
     __tablename__ = 'findings'
+    __table_args__ = (
+        db.Index('ix_findings_created_at_id', 'created_at', 'id'),
+        db.Index('ix_findings_project_id_created_at_id', 'project_id', 'created_at', 'id'),
+        db.Index('ix_findings_severity_id_created_at_id', 'severity_id', 'created_at', 'id'),
+        db.Index('ix_findings_category_id_created_at_id', 'category_id', 'created_at', 'id'),
+        db.Index('ix_findings_status_id_created_at_id', 'status_id', 'created_at', 'id'),
+        db.Index('ix_findings_updated_at', 'updated_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'))
     title = db.Column(db.String(255))
     description = db.Column(db.JSON)
-    created_at = db.Column(db.DateTime, default=datetime.now)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
     status_id = db.Column(db.Integer, db.ForeignKey('status.id'))
     severity_id = db.Column(db.Integer, db.ForeignKey('severity.id'))
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'project_id': self.project_id,
-            'title': self.title,
-            'description': self.description,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at,
-            'category': {'id': self.category.id, 'name': self.category.name} if self.category else None,
-            'status': {'id': self.status.id, 'name': self.status.name} if self.status else None,
-            'severity': {'id': self.severity.id, 'name': self.severity.name} if self.severity else None
-        }
-    def shallow_to_dict(self):
+
+    @classmethod
+    def eager_options(cls, fields=ALL_FIELDS, always=()):
+        aliases = {'category': 'category_id', 'status': 'status_id', 'severity': 'severity_id'}
+        return fields.load_only(cls, aliases, always)
+
+    def to_dict(self, fields=ALL_FIELDS):
+        return fields.pick({
+            'id': lambda: self.id,
+            'project_id': lambda: self.project_id,
+            **self._common_fields()
+        })
+    def shallow_to_dict(self, fields=ALL_FIELDS):
+        return fields.pick({
+            'id': lambda: self.id,
+            **self._common_fields()
+        })
+    def _common_fields(self):
         return {
-            'id': self.id,
-            'title': self.title,
-            'description': self.description,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at,
-            'category': {'id': self.category.id, 'name': self.category.name} if self.category else None,
-            'status': {'id': self.status.id, 'name': self.status.name} if self.status else None,
-            'severity': {'id': self.severity.id, 'name': self.severity.name} if self.severity else None
+            'title': lambda: self.title,
+            'description': lambda: self.description,
+            'created_at': lambda: self.created_at,
+            'updated_at': lambda: self.updated_at,
+            'category': lambda: lookups.get('categories', self.category_id),
+            'status': lambda: lookups.get('statuses', self.status_id),
+            'severity': lambda: lookups.get('severities', self.severity_id)
         }
 class Category(db.Model, SerializerMixin):
     __tablename__ = 'categories'
@@ -65,14 +93,25 @@ class Category(db.Model, SerializerMixin):
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     findings = db.relationship('Findings', backref='category')
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at,
-            'findings': [finding.shallow_to_dict() for finding in self.findings]
-        }
+
+    @classmethod
+    def eager_options(cls, fields=ALL_FIELDS):
+        options = fields.load_only(cls)
+        if fields.requested('findings'):
+            nested = fields.nested('findings')
+            options += (selectinload(cls.findings).options(*Findings.eager_options(nested, always=('category_id',))),)
+        return options
+
+    def to_dict(self, fields=ALL_FIELDS):
+        # findings are only serialized when asked for with ?include=findings
+        return fields.pick({
+            'id': lambda: self.id,
+            'name': lambda: self.name,
+            'created_at': lambda: self.created_at,
+            'updated_at': lambda: self.updated_at
+        }, optional={
+            'findings': lambda: [finding.shallow_to_dict(fields.nested('findings')) for finding in self.findings]
+        })
     
 class Status(db.Model, SerializerMixin):
     __tablename__ = 'status'
@@ -81,14 +120,25 @@ class Status(db.Model, SerializerMixin):
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     findings = db.relationship('Findings', backref='status')
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at,
-            'findings': [finding.shallow_to_dict() for finding in self.findings]
-        }
+
+    @classmethod
+    def eager_options(cls, fields=ALL_FIELDS):
+        options = fields.load_only(cls)
+        if fields.requested('findings'):
+            nested = fields.nested('findings')
+            options += (selectinload(cls.findings).options(*Findings.eager_options(nested, always=('status_id',))),)
+        return options
+
+    def to_dict(self, fields=ALL_FIELDS):
+        # findings are only serialized when asked for with ?include=findings
+        return fields.pick({
+            'id': lambda: self.id,
+            'name': lambda: self.name,
+            'created_at': lambda: self.created_at,
+            'updated_at': lambda: self.updated_at
+        }, optional={
+            'findings': lambda: [finding.shallow_to_dict(fields.nested('findings')) for finding in self.findings]
+        })
         
 class Severity(db.Model, SerializerMixin):
     __tablename__ = 'severity'
@@ -97,20 +147,34 @@ class Severity(db.Model, SerializerMixin):
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     findings = db.relationship('Findings', backref='severity')
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at,
-            'findings': [finding.shallow_to_dict() for finding in self.findings]
-        }
+
+    @classmethod
+    def eager_options(cls, fields=ALL_FIELDS):
+        options = fields.load_only(cls)
+        if fields.requested('findings'):
+            nested = fields.nested('findings')
+            options += (selectinload(cls.findings).options(*Findings.eager_options(nested, always=('severity_id',))),)
+        return options
+
+    def to_dict(self, fields=ALL_FIELDS):
+        # findings are only serialized when asked for with ?include=findings
+        return fields.pick({
+            'id': lambda: self.id,
+            'name': lambda: self.name,
+            'created_at': lambda: self.created_at,
+            'updated_at': lambda: self.updated_at
+        }, optional={
+            'findings': lambda: [finding.shallow_to_dict(fields.nested('findings')) for finding in self.findings]
+        })
 class Image (db.Model, SerializerMixin):
     __tablename__ = 'images'
     id = db.Column(db.Integer, primary_key=True)
     filename=db.Column(db.String(255))
     content_type=db.Column(db.String(255))
-    data=db.Column(db.LargeBinary)
+    # legacy inline blob, emptied by `flask backfill-images` once the file is in the image store
+    data=db.deferred(db.Column(db.LargeBinary))
+    sha256 = db.Column(db.String(64), index=True)
+    size = db.Column(db.BigInteger)
     finding_id = db.Column(db.Integer, db.ForeignKey('findings.id'),nullable=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.now)
    
@@ -118,16 +182,16 @@ class Users(db.Model, SerializerMixin):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255))
-    email = db.Column(db.String(255))
+    email = db.Column(db.String(255), unique=True, index=True)
     password = db.Column(db.String(255))
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
-    
+
     def to_dict(self):
         return {
             'id': self.id,
             'name': self.name,
             'email': self.email,
-            'role': self.role.to_dict() if self.role else None
+            'role': lookups.get('roles', self.role_id)
         }
 
     role = db.relationship('Roles', back_populates='users')
@@ -149,6 +213,11 @@ class Roles(db.Model, SerializerMixin):
         back_populates='roles'
     )       
     users = db.relationship('Users', back_populates='role')
+
+    @classmethod
+    def eager_options(cls):
+        return (selectinload(cls.permissions),)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -169,4 +238,84 @@ class Permissions(db.Model, SerializerMixin):
         return {
             'id': self.id,
             'name': self.name
-        }
\ No newline at end of file
+        }
+
+
+class ProjectStat(db.Model):
+    __tablename__ = 'project_stats'
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete='CASCADE'), primary_key=True)
+    dimension = db.Column(db.String(16), primary_key=True)
+    # 0 stands for findings without a value for the dimension
+    value_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# background work, see jobs.py. The id is random so result URLs can't be enumerated
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_created_at', 'status', 'created_at'),
+        db.Index('ix_jobs_expires_at', 'expires_at'),
+    )
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    name = db.Column(db.String(255))
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    params = db.Column(db.JSON)
+    result = db.Column(db.JSON)
+    result_file = db.Column(db.String(255))
+    result_type = db.Column(db.String(255))
+    error = db.Column(db.Text)
+    progress_done = db.Column(db.Integer, nullable=False, default=0)
+    progress_total = db.Column(db.Integer)
+    message = db.Column(db.String(255))
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    worker = db.Column(db.String(64))
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime)
+
+    def to_dict(self, params=True):
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'name': self.name,
+            'status': self.status,
+            'progress': {'done': self.progress_done, 'total': self.progress_total, 'message': self.message},
+            'result': self.result,
+            'has_result_file': self.result_file is not None,
+            'error': self.error,
+            'attempts': self.attempts,
+            'cancel_requested': self.cancel_requested,
+            'created_by': self.created_by,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'expires_at': self.expires_at,
+        }
+        if params:
+            data['params'] = self.params
+        return data
+
+
+def load_names(model):
+    return lambda: {id: {'id': id, 'name': name} for id, name in db.session.query(model.id, model.name)}
+
+
+lookups = LookupCache(db, CacheVersion)
+lookups.register('categories', load_names(Category))
+lookups.register('severities', load_names(Severity))
+lookups.register('statuses', load_names(Status))
+lookups.register('permissions', load_names(Permissions))
+lookups.register('roles', lambda: {role.id: role.to_dict() for role in Roles.query.options(*Roles.eager_options())})
+
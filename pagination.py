@@ -0,0 +1,82 @@
+import base64
+import json
+from datetime import datetime
+from flask import request, url_for
+from sqlalchemy import tuple_
+from models import Findings
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+FINDING_FILTERS = ('project_id', 'severity_id', 'category_id', 'status_id')
+
+
+class InvalidQueryParam(ValueError):
+    pass
+
+
+def encode_cursor(item):
+    raw = json.dumps([item.created_at.isoformat(), item.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (ValueError, TypeError):
+        raise InvalidQueryParam('Invalid cursor')
+
+
+def parse_datetime(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidQueryParam(f'Invalid {name}, expected an ISO 8601 timestamp')
+
+
+def filter_updated_since(query, model, args):
+    updated_since = args.get('updated_since')
+    if updated_since:
+        query = query.filter(model.updated_at >= parse_datetime(updated_since, 'updated_since'))
+    return query
+
+
+def filter_findings(query, args):
+    for name in FINDING_FILTERS:
+        value = args.get(name, type=int)
+        if value is not None:
+            query = query.filter(getattr(Findings, name) == value)
+    return filter_updated_since(query, Findings, args)
+
+
+def keyset_query(query, model, args):
+    # works on both Query and select(), the async views run the statement themselves
+    limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    cursor = args.get('cursor')
+    if cursor:
+        query = query.filter(tuple_(model.created_at, model.id) > decode_cursor(cursor))
+    return query.order_by(model.created_at, model.id).limit(limit + 1), limit
+
+
+def keyset_page(items, limit):
+    next_cursor = encode_cursor(items[limit - 1]) if len(items) > limit else None
+    return items[:limit], next_cursor
+
+
+def keyset_paginate(query, model, args):
+    query, limit = keyset_query(query, model, args)
+    return keyset_page(query.all(), limit)
+
+
+def page_headers(next_cursor):
+    if not next_cursor:
+        return {}
+    args = request.args.to_dict()
+    args['cursor'] = next_cursor
+    next_url = url_for(request.endpoint, _external=True, **args)
+    return {
+        'X-Next-Cursor': next_cursor,
+        'Link': f'<{next_url}>; rel="next"',
+    }
@@ -0,0 +1,64 @@
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+
+
+class KdfBusy(Exception):
+    pass
+
+
+# hashlib releases the GIL while it runs pbkdf2/scrypt, so a small thread pool gives real
+# parallelism while capping how many cores a login burst can take from the API. Callers
+# beyond the pool size plus PASSWORD_HASH_QUEUE are turned away instead of piling up.
+class PasswordHasher:
+    def __init__(self, app=None):
+        self._executor = None
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kdf')
+        self._slots = threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_QUEUE'])
+        app.extensions['password_hasher'] = self
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, stored, password):
+        # returns (matches, needs_rehash)
+        if not stored:
+            return False, False
+        if not stored.startswith(HASH_PREFIXES):
+            # plaintext from before hashing was introduced
+            return hmac.compare_digest(stored.encode(), password.encode()), True
+        matches = self._run(check_password_hash, stored, password)
+        return matches, matches and self.needs_rehash(stored)
+
+    def needs_rehash(self, stored):
+        return stored.split('$', 1)[0] != self.method
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise KdfBusy('Too many concurrent logins, retry shortly')
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # the hash keeps its slot until it finishes, callers after us see the pool as full
+            raise KdfBusy('Password hashing timed out, retry shortly')
+
+
+passwords = PasswordHasher()
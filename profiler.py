@@ -0,0 +1,161 @@
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from lookup_cache import refreshing
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-SQL-Profile'
+IN_LIST_RE = re.compile(r'\(\s*(?:\?|%\(\w+\)s|%s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|\$\d+|:\w+))+\s*\)')
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SPACE_RE = re.compile(r'\s+')
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+def statement_shape(statement):
+    # statements that differ only in literals or in the length of an IN list share a shape
+    shape = SPACE_RE.sub(' ', statement).strip()
+    shape = IN_LIST_RE.sub('(…)', shape)
+    return LITERAL_RE.sub('?', shape)
+
+
+def query_budget(reads, writes=None):
+    # @query_budget(2) on a view: the most statements a GET may run, not counting lookup cache
+    # refreshes. Checked by pytest_sql_budget and reported in the profile, writes=None leaves
+    # other methods unchecked.
+    def decorator(view):
+        view.query_budget = (reads, writes)
+        return view
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    if profile is None or not conn.info.get('profile_started'):
+        return
+    elapsed = time.perf_counter() - conn.info['profile_started'].pop()
+    profile.append((statement, elapsed, executemany, refreshing.get()))
+
+
+# records every statement of a profiled request. SQL_PROFILER=on profiles everything, =header
+# only requests sending X-SQL-Profile: 1. The summary goes out in response headers, the full
+# report is kept for the last SQL_PROFILER_HISTORY requests (see /debug/sql-profiles).
+class SqlProfiler:
+    def __init__(self, app=None):
+        self.mode = 'off'
+        self.listeners = []
+        self.profiles = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.mode = app.config['SQL_PROFILER']
+        self.repeat_threshold = app.config['SQL_PROFILER_REPEAT_THRESHOLD']
+        self.history = app.config['SQL_PROFILER_HISTORY']
+        self.max_statements = app.config['SQL_PROFILER_MAX_STATEMENTS']
+        self.profiles = OrderedDict()
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.extensions['sql_profiler'] = self
+
+    def wanted(self):
+        # listeners (the pytest plugin) switch profiling on regardless of the mode
+        if self.mode == 'on' or self.listeners:
+            return True
+        return self.mode == 'header' and request.headers.get(PROFILE_HEADER) in ('1', 'true')
+
+    def _start(self):
+        if self.wanted():
+            request.environ['sql_profile.started'] = time.perf_counter()
+            request.environ['sql_profile.statements'] = statements = []
+            current_profile.set(statements)
+
+    def _finish(self, response):
+        started = request.environ.get('sql_profile.started')
+        if started is None:
+            return response
+        current_profile.set(None)
+        profile = self.build(request.environ['sql_profile.statements'], time.perf_counter() - started, response.status_code)
+        self._store(profile)
+        for listener in self.listeners:
+            listener(profile)
+        if profile['n_plus_one']:
+            logger.warning('possible N+1 in %s %s: %s', profile['method'], profile['path'],
+                           '; '.join(f"{group['count']}x {group['sql'][:120]}" for group in profile['n_plus_one']))
+        response.headers['X-SQL-Profile-Id'] = profile['id']
+        response.headers['X-SQL-Queries'] = str(profile['queries'])
+        response.headers['X-SQL-Time'] = f"{profile['sql_ms']:.2f}"
+        response.headers['X-SQL-N-Plus-One'] = str(len(profile['n_plus_one']))
+        response.headers.add('Server-Timing', f'sql;dur={profile["sql_ms"]:.2f};desc="{profile["queries"]} queries"')
+        return response
+
+    def build(self, statements, duration, status):
+        groups = {}
+        for statement, elapsed, executemany, cache in statements:
+            group = groups.setdefault(statement_shape(statement), {'count': 0, 'ms': 0.0})
+            group['count'] += 1
+            group['ms'] += elapsed * 1000
+        repeated = sorted(
+            ({'sql': shape, 'count': group['count'], 'ms': round(group['ms'], 3)}
+             for shape, group in groups.items() if group['count'] > 1),
+            key=lambda group: group['count'], reverse=True)
+        cache_queries = sum(1 for statement in statements if statement[3])
+        view = current_app.view_functions.get(request.endpoint)
+        reads, writes = getattr(view, 'query_budget', (None, None))
+        budget = reads if request.method in ('GET', 'HEAD') else writes
+        return {
+            'id': uuid.uuid4().hex[:16],
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': status,
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'duration_ms': round(duration * 1000, 3),
+            'queries': len(statements),
+            'cache_queries': cache_queries,
+            'sql_ms': round(sum(statement[1] for statement in statements) * 1000, 3),
+            'budget': budget,
+            'over_budget': budget is not None and len(statements) - cache_queries > budget,
+            # an IN (...) shape repeating is selectinload working through batches, not N+1
+            'n_plus_one': [group for group in repeated
+                           if group['count'] >= self.repeat_threshold and '(…)' not in group['sql']],
+            'repeated': repeated,
+            'statements': [{'sql': statement, 'ms': round(elapsed * 1000, 3), 'executemany': executemany, 'cache': cache}
+                           for statement, elapsed, executemany, cache in statements[:self.max_statements]],
+        }
+
+    def _store(self, profile):
+        with self._lock:
+            self.profiles[profile['id']] = profile
+            while len(self.profiles) > self.history:
+                self.profiles.popitem(last=False)
+
+    def recent(self):
+        keys = ('id', 'method', 'path', 'status', 'at', 'duration_ms', 'queries', 'sql_ms', 'budget', 'over_budget')
+        with self._lock:
+            profiles = list(self.profiles.values())
+        return [dict({key: profile[key] for key in keys}, n_plus_one=len(profile['n_plus_one']))
+                for profile in reversed(profiles)]
+
+    def get(self, profile_id):
+        return self.profiles.get(profile_id)
+
+
+profiler = SqlProfiler()
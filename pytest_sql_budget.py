@@ -0,0 +1,59 @@
+# pytest plugin, enable with `pytest -p pytest_sql_budget` or pytest_plugins = ['pytest_sql_budget'].
+#
+# While a test runs every request the app handles is profiled. The test fails when a request
+# runs more statements than its view's @query_budget, or repeats one statement shape
+# SQL_PROFILER_REPEAT_THRESHOLD times or more (the N+1 signature).
+#
+#   @pytest.mark.sql_budget(5)       overrides the budget for every request in the test
+#   @pytest.mark.allow_n_plus_one    lets repeated statements through
+#
+# The `sql_profiles` fixture hands a test the profiles of the requests it made.
+import pytest
+
+PROFILES_KEY = pytest.StashKey()
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'sql_budget(max_queries): statement budget for every request in the test')
+    config.addinivalue_line('markers', 'allow_n_plus_one: do not fail on repeated statement shapes')
+
+
+def budget_failures(profile, override=None, allow_n_plus_one=False):
+    failures = []
+    budget = override if override is not None else profile['budget']
+    queries = profile['queries'] - profile['cache_queries']
+    if budget is not None and queries > budget:
+        failures.append(f"{profile['method']} {profile['path']} ran {queries} statements, budget is {budget}")
+    if profile['n_plus_one'] and not allow_n_plus_one:
+        for group in profile['n_plus_one']:
+            failures.append(f"{profile['method']} {profile['path']} repeated {group['count']}x: {group['sql']}")
+    return failures
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    from profiler import profiler
+
+    marker = item.get_closest_marker('sql_budget')
+    override = marker.args[0] if marker else None
+    allow_n_plus_one = item.get_closest_marker('allow_n_plus_one') is not None
+    profiles = item.stash.setdefault(PROFILES_KEY, [])
+    failures = []
+
+    def check(profile):
+        profiles.append(profile)
+        failures.extend(budget_failures(profile, override, allow_n_plus_one))
+
+    profiler.listeners.append(check)
+    try:
+        result = yield
+    finally:
+        profiler.listeners.remove(check)
+    if failures:
+        pytest.fail('SQL budget exceeded:\n  ' + '\n  '.join(failures), pytrace=False)
+    return result
+
+
+@pytest.fixture
+def sql_profiles(request):
+    return request.node.stash.setdefault(PROFILES_KEY, [])
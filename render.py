@@ -0,0 +1,686 @@
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+from collections import Counter
+from datetime import datetime
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup, escape
+from models import db, Findings, Image, lookups
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+# bump when the block renderers below change their output, template edits are picked up by the hash
+RENDERER_VERSION = 1
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+# format: (report template, finding template, mimetype)
+FORMATS = {
+    'html': ('report.html', 'finding.html', 'text/html; charset=utf-8'),
+    'md': ('report.md', 'finding.md', 'text/markdown; charset=utf-8'),
+    'docx': ('document.xml', 'finding.xml', DOCX_MIMETYPE),
+}
+LOOKUP_TABLES = ('categories', 'statuses', 'severities')
+IMAGE_URL_RE = re.compile(r'/api/image/(\d+)')
+DOCX_IMAGE_TYPES = {'image/png': 'png', 'image/jpeg': 'jpeg', 'image/gif': 'gif'}
+EMU_PER_PIXEL = 9525
+MAX_IMAGE_EMU = 6 * 914400
+DEFAULT_IMAGE_PX = (640, 360)
+XML_INVALID_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+MD_SPECIAL_RE = re.compile(r'([\\`*_\[\]<>|#~&])')
+
+INLINE_STYLES = {'b': 'b', 'strong': 'b', 'i': 'i', 'em': 'i', 'u': 'u', 's': 's', 'strike': 's',
+                 'del': 's', 'code': 'code', 'mark': 'mark'}
+
+
+def safe_href(href):
+    href = ''.join(ch for ch in (href or '') if ch > ' ')
+    if not href or href.startswith('//'):
+        return None
+    return href if urlparse(href).scheme in ('', 'http', 'https', 'mailto') else None
+
+
+def md_escape(value):
+    return MD_SPECIAL_RE.sub(r'\\\1', str(value))
+
+
+def xml_text(value):
+    return escape(XML_INVALID_RE.sub('', value))
+
+
+# Editor.js stores inline markup as HTML. Only the tags it produces survive, everything else is
+# reduced to its text, so the output is the same whatever a client managed to save
+class InlineParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.segments = []
+        self._styles = []
+        self._links = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip += 1
+        elif tag == 'br':
+            self.handle_data('\n')
+        elif tag in INLINE_STYLES:
+            self._styles.append(INLINE_STYLES[tag])
+        elif tag == 'a':
+            self._links.append(safe_href(dict(attrs).get('href')))
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self._skip = max(0, self._skip - 1)
+        elif tag in INLINE_STYLES and INLINE_STYLES[tag] in self._styles:
+            # removes the innermost match, unbalanced markup just loses the style early
+            del self._styles[len(self._styles) - 1 - self._styles[::-1].index(INLINE_STYLES[tag])]
+        elif tag == 'a' and self._links:
+            self._links.pop()
+
+    def handle_data(self, data):
+        if self._skip or not data:
+            return
+        styles = frozenset(self._styles)
+        href = next((link for link in reversed(self._links) if link), None)
+        if self.segments and self.segments[-1][1:] == (styles, href):
+            self.segments[-1] = (self.segments[-1][0] + data, styles, href)
+        else:
+            self.segments.append((data, styles, href))
+
+
+def parse_inline(value):
+    parser = InlineParser()
+    parser.feed(value if isinstance(value, str) else str(value or ''))
+    parser.close()
+    return parser.segments
+
+
+def plain_text(value):
+    return ''.join(text for text, _, _ in parse_inline(value))
+
+
+def list_items(items):
+    # list blocks hold plain strings, nested lists (list v2) hold {"content": ..., "items": [...]}
+    for item in items or []:
+        if isinstance(item, dict):
+            yield item.get('content', ''), item.get('items') or []
+        else:
+            yield item, []
+
+
+def image_id(url):
+    match = IMAGE_URL_RE.search(url or '')
+    return int(match.group(1)) if match else None
+
+
+# one method per Editor.js block type, unknown types are left out of the report
+class BlockRenderer:
+    def __init__(self, images=None, heading_offset=1):
+        self.images = images or {}
+        self.heading_offset = heading_offset
+
+    def render(self, document):
+        blocks = document.get('blocks') if isinstance(document, dict) else None
+        parts = []
+        for block in blocks or []:
+            if not isinstance(block, dict):
+                continue
+            method = getattr(self, 'block_' + str(block.get('type')), None)
+            data = block.get('data')
+            if method and isinstance(data, dict):
+                parts.append(method(data))
+        return Markup(self.join(part for part in parts if part))
+
+    def join(self, parts):
+        return ''.join(parts)
+
+    def heading_level(self, data):
+        try:
+            level = int(data.get('level') or 2)
+        except (TypeError, ValueError):
+            level = 2
+        return max(1, min(level + self.heading_offset, 6))
+
+
+class HtmlBlocks(BlockRenderer):
+    def join(self, parts):
+        return '\n'.join(parts)
+
+    def inline(self, value):
+        out = []
+        for text, styles, href in parse_inline(value):
+            html = str(escape(text)).replace('\n', '<br>')
+            for style in sorted(styles):
+                html = f'<{style}>{html}</{style}>'
+            if href:
+                html = f'<a href="{escape(href)}" rel="noopener noreferrer">{html}</a>'
+            out.append(html)
+        return ''.join(out)
+
+    def block_header(self, data):
+        level = self.heading_level(data)
+        return f'<h{level}>{self.inline(data.get("text"))}</h{level}>'
+
+    def block_paragraph(self, data):
+        return f'<p>{self.inline(data.get("text"))}</p>'
+
+    def block_list(self, data):
+        return self._list(data.get('items'), 'ol' if data.get('style') == 'ordered' else 'ul')
+
+    def _list(self, items, tag):
+        entries = []
+        for content, children in list_items(items):
+            nested = self._list(children, tag) if children else ''
+            entries.append(f'<li>{self.inline(content)}{nested}</li>')
+        return f'<{tag}>{"".join(entries)}</{tag}>'
+
+    def block_checklist(self, data):
+        entries = [
+            f'<li>{"&#9745;" if item.get("checked") else "&#9744;"} {self.inline(item.get("text"))}</li>'
+            for item in data.get('items') or [] if isinstance(item, dict)
+        ]
+        return f'<ul class="checklist">{"".join(entries)}</ul>'
+
+    def block_code(self, data):
+        return f'<pre><code>{escape(data.get("code") or "")}</code></pre>'
+
+    def block_raw(self, data):
+        # raw HTML blocks are shown as source, never injected into the report
+        return f'<pre><code>{escape(data.get("html") or "")}</code></pre>'
+
+    def block_quote(self, data):
+        caption = f'<footer>{self.inline(data["caption"])}</footer>' if data.get('caption') else ''
+        return f'<blockquote><p>{self.inline(data.get("text"))}</p>{caption}</blockquote>'
+
+    def block_warning(self, data):
+        return f'<div class="warning"><p><b>{self.inline(data.get("title"))}</b></p><p>{self.inline(data.get("message"))}</p></div>'
+
+    def block_delimiter(self, data):
+        return '<hr>'
+
+    def block_table(self, data):
+        rows = [row for row in data.get('content') or [] if isinstance(row, list)]
+        html = []
+        for number, row in enumerate(rows):
+            cell = 'th' if number == 0 and data.get('withHeadings') else 'td'
+            html.append('<tr>' + ''.join(f'<{cell}>{self.inline(value)}</{cell}>' for value in row) + '</tr>')
+        return f'<table>{"".join(html)}</table>'
+
+    def block_image(self, data):
+        url = safe_href((data.get('file') or {}).get('url') or data.get('url'))
+        if not url:
+            return ''
+        caption = data.get('caption') or ''
+        figcaption = f'<figcaption>{self.inline(caption)}</figcaption>' if caption else ''
+        return f'<figure><img src="{escape(url)}" alt="{escape(plain_text(caption))}">{figcaption}</figure>'
+
+    def block_embed(self, data):
+        source = safe_href(data.get('source'))
+        if not source:
+            return ''
+        caption = f' {self.inline(data["caption"])}' if data.get('caption') else ''
+        return f'<p><a href="{escape(source)}" rel="noopener noreferrer">{escape(source)}</a>{caption}</p>'
+
+
+class MarkdownBlocks(BlockRenderer):
+    def join(self, parts):
+        return '\n\n'.join(parts) + '\n'
+
+    def inline(self, value, line_break='\\\n'):
+        out = []
+        for text, styles, href in parse_inline(value):
+            if 'code' in styles:
+                fence = '`' * (max((len(run) for run in re.findall('`+', text)), default=0) + 1)
+                md = f'{fence} {text.replace(chr(10), " ")} {fence}'
+            else:
+                # emphasis markers must touch the text, whitespace moves outside them
+                stripped = text.strip()
+                if not stripped:
+                    out.append(text.replace('\n', line_break))
+                    continue
+                md = md_escape(stripped).replace('\n', line_break)
+                for style, marker in (('s', '~~'), ('i', '*'), ('b', '**')):
+                    if style in styles:
+                        md = f'{marker}{md}{marker}'
+                md = text[:len(text) - len(text.lstrip())] + md + text[len(text.rstrip()):]
+            if href:
+                md = f'[{md}](<{href.replace(">", "%3E")}>)'
+            out.append(md)
+        return ''.join(out)
+
+    def block_header(self, data):
+        return '#' * self.heading_level(data) + ' ' + self.inline(data.get('text'), ' ')
+
+    def block_paragraph(self, data):
+        return self.inline(data.get('text'))
+
+    def block_list(self, data):
+        return self._list(data.get('items'), data.get('style') == 'ordered', 0)
+
+    def _list(self, items, ordered, depth):
+        lines = []
+        for number, (content, children) in enumerate(list_items(items), 1):
+            marker = f'{number}.' if ordered else '-'
+            indent = '    ' * depth
+            lines.append(f'{indent}{marker} {self.inline(content, " ")}')
+            if children:
+                lines.append(self._list(children, ordered, depth + 1))
+        return '\n'.join(lines)
+
+    def block_checklist(self, data):
+        return '\n'.join(
+            f'- [{"x" if item.get("checked") else " "}] {self.inline(item.get("text"), " ")}'
+            for item in data.get('items') or [] if isinstance(item, dict)
+        )
+
+    def _fenced(self, code, info=''):
+        fence = '`' * max(3, max((len(run) for run in re.findall('`+', code)), default=0) + 1)
+        return f'{fence}{info}\n{code}\n{fence}'
+
+    def block_code(self, data):
+        return self._fenced(data.get('code') or '')
+
+    def block_raw(self, data):
+        return self._fenced(data.get('html') or '', 'html')
+
+    def block_quote(self, data):
+        lines = self.inline(data.get('text')).split('\n')
+        if data.get('caption'):
+            lines += ['', '— ' + self.inline(data['caption'], ' ')]
+        return '\n'.join(('> ' + line).rstrip() for line in lines)
+
+    def block_warning(self, data):
+        return f'> **{self.inline(data.get("title"), " ")}**\n>\n> {self.inline(data.get("message"), " ")}'
+
+    def block_delimiter(self, data):
+        return '---'
+
+    def block_table(self, data):
+        rows = [row for row in data.get('content') or [] if isinstance(row, list) and row]
+        if not rows:
+            return ''
+        width = max(len(row) for row in rows)
+        cells = [[self.inline(value, ' ') for value in row] + [''] * (width - len(row)) for row in rows]
+        header = cells.pop(0) if data.get('withHeadings') else [''] * width
+        lines = ['| ' + ' | '.join(header) + ' |', '|' + ' --- |' * width]
+        lines += ['| ' + ' | '.join(row) + ' |' for row in cells]
+        return '\n'.join(lines)
+
+    def block_image(self, data):
+        url = safe_href((data.get('file') or {}).get('url') or data.get('url'))
+        if not url:
+            return ''
+        caption = data.get('caption') or ''
+        image = f'![{md_escape(plain_text(caption))}](<{url.replace(">", "%3E")}>)'
+        return f'{image}\n\n*{self.inline(caption, " ")}*' if caption.strip() else image
+
+    def block_embed(self, data):
+        source = safe_href(data.get('source'))
+        if not source:
+            return ''
+        caption = f' {self.inline(data["caption"], " ")}' if data.get('caption') else ''
+        return f'<{source}>{caption}'
+
+
+# WordprocessingML paragraphs. Images are referenced as r:embed="img<id>", the relationships and
+# media parts are added when the document is assembled, so a cached fragment fits any report
+class DocxBlocks(BlockRenderer):
+    def runs(self, value, base=()):
+        out = []
+        for text, styles, href in parse_inline(value):
+            props = list(base)
+            props += [f'<w:{style}/>' for style in ('b', 'i') if style in styles]
+            if 'u' in styles or href:
+                props.append('<w:u w:val="single"/>')
+            if 's' in styles:
+                props.append('<w:strike/>')
+            if 'mark' in styles:
+                props.append('<w:highlight w:val="yellow"/>')
+            if href:
+                props.append('<w:color w:val="0563C1"/>')
+            if 'code' in styles:
+                props.insert(0, '<w:rStyle w:val="CodeChar"/>')
+            rpr = f'<w:rPr>{"".join(props)}</w:rPr>' if props else ''
+            pieces = [f'<w:t xml:space="preserve">{xml_text(piece)}</w:t>' if piece else '' for piece in text.split('\n')]
+            run = f'<w:r>{rpr}{"<w:br/>".join(pieces)}</w:r>'
+            if href:
+                instr = escape(f' HYPERLINK "{href.replace(chr(34), "%22")}" ')
+                run = f'<w:fldSimple w:instr="{instr}">{run}</w:fldSimple>'
+            out.append(run)
+        return ''.join(out)
+
+    def paragraph(self, content, style=None, props=''):
+        ppr = f'<w:pStyle w:val="{style}"/>' if style else ''
+        if ppr or props:
+            ppr = f'<w:pPr>{ppr}{props}</w:pPr>'
+        return f'<w:p>{ppr}{content}</w:p>'
+
+    def block_header(self, data):
+        return self.paragraph(self.runs(data.get('text')), f'Heading{min(self.heading_level(data), 3)}')
+
+    def block_paragraph(self, data):
+        return self.paragraph(self.runs(data.get('text')))
+
+    def block_list(self, data):
+        return self._list(data.get('items'), data.get('style') == 'ordered', 0)
+
+    def _list(self, items, ordered, depth):
+        paragraphs = []
+        indent = f'<w:ind w:left="{360 * (depth + 2)}" w:hanging="360"/>'
+        for number, (content, children) in enumerate(list_items(items), 1):
+            marker = f'{number}.' if ordered else '•'
+            marker_run = f'<w:r><w:t xml:space="preserve">{marker}\t</w:t></w:r>'
+            paragraphs.append(self.paragraph(marker_run + self.runs(content), 'ListParagraph', indent))
+            if children:
+                paragraphs.append(self._list(children, ordered, depth + 1))
+        return ''.join(paragraphs)
+
+    def block_checklist(self, data):
+        return ''.join(
+            self.paragraph(f'<w:r><w:t xml:space="preserve">{"☑" if item.get("checked") else "☐"} </w:t></w:r>'
+                           + self.runs(item.get('text')), 'ListParagraph')
+            for item in data.get('items') or [] if isinstance(item, dict)
+        )
+
+    def _code(self, code):
+        return ''.join(
+            self.paragraph(f'<w:r><w:t xml:space="preserve">{xml_text(line)}</w:t></w:r>', 'Code')
+            for line in code.split('\n')
+        )
+
+    def block_code(self, data):
+        return self._code(data.get('code') or '')
+
+    def block_raw(self, data):
+        return self._code(data.get('html') or '')
+
+    def block_quote(self, data):
+        quote = self.paragraph(self.runs(data.get('text')), 'Quote')
+        if data.get('caption'):
+            quote += self.paragraph(self.runs('— ' + str(data['caption'])), 'Quote')
+        return quote
+
+    def block_warning(self, data):
+        return (self.paragraph(self.runs(data.get('title'), ('<w:b/>',)), 'Quote')
+                + self.paragraph(self.runs(data.get('message')), 'Quote'))
+
+    def block_delimiter(self, data):
+        return self.paragraph('<w:r><w:t>* * *</w:t></w:r>', None, '<w:jc w:val="center"/>')
+
+    def block_table(self, data):
+        rows = [row for row in data.get('content') or [] if isinstance(row, list) and row]
+        if not rows:
+            return ''
+        xml = ['<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:w="0" w:type="auto"/></w:tblPr>']
+        for number, row in enumerate(rows):
+            base = ('<w:b/>',) if number == 0 and data.get('withHeadings') else ()
+            xml.append('<w:tr>' + ''.join(f'<w:tc>{self.paragraph(self.runs(value, base))}</w:tc>' for value in row) + '</w:tr>')
+        xml.append('</w:tbl>')
+        return ''.join(xml)
+
+    def block_image(self, data):
+        caption = data.get('caption') or ''
+        caption = self.paragraph(self.runs(caption), 'Caption') if caption.strip() else ''
+        id = image_id((data.get('file') or {}).get('url') or data.get('url'))
+        extent = self.images.get(id)
+        if not extent:
+            # not an image this server stores (or not one Word can show), keep the caption
+            return caption
+        cx, cy = extent
+        drawing = (
+            f'<w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0"><wp:extent cx="{cx}" cy="{cy}"/>'
+            f'<wp:docPr id="0" name="Image {id}"/><a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+            f'<pic:pic><pic:nvPicPr><pic:cNvPr id="0" name="image{id}"/><pic:cNvPicPr/></pic:nvPicPr>'
+            f'<pic:blipFill><a:blip r:embed="img{id}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+            f'<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+            f'<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr></pic:pic></a:graphicData></a:graphic>'
+            f'</wp:inline></w:drawing></w:r>'
+        )
+        return self.paragraph(drawing) + caption
+
+    def block_embed(self, data):
+        source = safe_href(data.get('source'))
+        if not source:
+            return ''
+        return self.paragraph(self.runs(f'<a href="{escape(source)}">{escape(source)}</a>'))
+
+
+BLOCK_RENDERERS = {'html': HtmlBlocks, 'md': MarkdownBlocks, 'docx': DocxBlocks}
+
+
+# rendered findings on disk at <root>/<fmt>/<id // 1000>/<id>/<updated_at>-<version>.<ext>. A new
+# updated_at or template version is simply a different file, writing it removes the stale siblings
+class FragmentCache:
+    def __init__(self):
+        self.root = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.root = app.config['REPORT_CACHE_PATH']
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir(self, fmt, finding_id):
+        return os.path.join(self.root, fmt, str(finding_id // 1000), str(finding_id))
+
+    def _name(self, fmt, updated_at, version):
+        stamp = updated_at.strftime('%Y%m%dT%H%M%S%f') if updated_at else 'none'
+        return f'{stamp}-{version}.{fmt}'
+
+    def get(self, fmt, finding_id, updated_at, version):
+        try:
+            with open(os.path.join(self._dir(fmt, finding_id), self._name(fmt, updated_at, version)), encoding='utf-8') as f:
+                fragment = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return fragment
+
+    def put(self, fmt, finding_id, updated_at, version, fragment):
+        directory = self._dir(fmt, finding_id)
+        name = self._name(fmt, updated_at, version)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(fragment)
+            os.replace(tmp_path, os.path.join(directory, name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        for other in os.listdir(directory):
+            if other != name and not other.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(directory, other))
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        if self.root and os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class ReportRenderer:
+    def __init__(self, app=None):
+        self.env = None
+        self.templates = {}
+        self.version = None
+        self.cache = FragmentCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        path = app.config['REPORT_TEMPLATE_PATH']
+        self.batch_size = app.config['REPORT_BATCH_SIZE']
+        self.image_store = app.extensions['image_store']
+        self.env = Environment(
+            loader=FileSystemLoader(path),
+            autoescape=select_autoescape(['html', 'xml']),
+            auto_reload=False,
+            keep_trailing_newline=True,
+        )
+        self.env.filters['md'] = md_escape
+        # every template is compiled here, requests never touch the loader
+        names = sorted(self.env.list_templates())
+        self.templates = {name: self.env.get_template(name) for name in names}
+        digest = hashlib.sha256(str(RENDERER_VERSION).encode())
+        for name in names:
+            with open(os.path.join(path, name), 'rb') as f:
+                digest.update(name.encode() + b'\0' + f.read())
+        self.version = digest.hexdigest()[:12]
+        self.cache.init_app(app)
+        app.extensions['report_renderer'] = self
+
+    def fragment_version(self):
+        # category, status and severity names are part of each fragment, renaming one re-renders them all
+        versions = '.'.join(str(lookups.version(table)) for table in LOOKUP_TABLES)
+        return hashlib.sha256(f'{self.version}:{versions}'.encode()).hexdigest()[:12]
+
+    def render(self, project, fmt, progress=None):
+        report_template = FORMATS[fmt][0]
+        version = self.fragment_version()
+        rows = (db.session.query(Findings.id, Findings.updated_at, Findings.severity_id)
+                .filter(Findings.project_id == project.id)
+                .order_by(Findings.created_at, Findings.id)
+                .all())
+        fragments = {id: self.cache.get(fmt, id, updated_at, version) for id, updated_at, _ in rows}
+        missing = [id for id, fragment in fragments.items() if fragment is None]
+        for start in range(0, len(missing), self.batch_size):
+            batch = Findings.query.filter(Findings.id.in_(missing[start:start + self.batch_size])).all()
+            images = self.image_extents(batch) if fmt == 'docx' else {}
+            blocks = BLOCK_RENDERERS[fmt](images)
+            for finding in batch:
+                fragments[finding.id] = self._render_fragment(finding, fmt, version, blocks)
+            if progress:
+                progress(len(rows) - len(missing) + min(start + self.batch_size, len(missing)), len(rows))
+
+        severities = Counter(severity_id for _, _, severity_id in rows)
+        summary = [(self._name('severities', id) or 'Unrated', severities[id])
+                   for id in sorted(severities, key=lambda id: (id is None, id or 0))]
+        body = self.templates[report_template].render(
+            project=project,
+            description=BLOCK_RENDERERS[fmt](self.image_extents([project]) if fmt == 'docx' else {}, 0).render(project.description),
+            summary=summary,
+            fragments=[Markup(fragments[id]) for id, _, _ in rows if fragments.get(id) is not None],
+            findings_count=len(rows),
+            generated_at=datetime.now().strftime('%Y-%m-%d %H:%M'),
+        )
+        if fmt == 'docx':
+            body = self.assemble_docx(body)
+        return body, {'fragments': len(rows), 'cached': len(rows) - len(missing), 'rendered': len(missing)}
+
+    def fragment(self, finding, fmt, version=None):
+        # one finding's cached fragment, for callers that already hold the row. DOCX fragments
+        # need the image extents of a whole batch, render() is the way to get those
+        version = version or self.fragment_version()
+        fragment = self.cache.get(fmt, finding.id, finding.updated_at, version)
+        if fragment is None:
+            fragment = self._render_fragment(finding, fmt, version, BLOCK_RENDERERS[fmt]())
+        return fragment
+
+    def _render_fragment(self, finding, fmt, version, blocks):
+        fragment = self.templates[FORMATS[fmt][1]].render(
+            finding=finding,
+            body=blocks.render(finding.description),
+            severity=self._name('severities', finding.severity_id),
+            category=self._name('categories', finding.category_id),
+            status=self._name('statuses', finding.status_id),
+        )
+        # the row may have changed since the id query, key on the updated_at that was rendered
+        self.cache.put(fmt, finding.id, finding.updated_at, version, fragment)
+        return fragment
+
+    def _name(self, table, id):
+        entry = lookups.get(table, id)
+        return entry['name'] if entry else None
+
+    def referenced_images(self, ids):
+        ids = sorted(ids)
+        images = {}
+        for start in range(0, len(ids), self.batch_size):
+            for image in Image.query.filter(Image.id.in_(ids[start:start + self.batch_size])):
+                if image.sha256 and image.content_type in DOCX_IMAGE_TYPES and self.image_store.exists(image.sha256):
+                    images[image.id] = image
+        return images
+
+    def image_extents(self, items):
+        ids = set()
+        for item in items:
+            blocks = item.description.get('blocks') if isinstance(item.description, dict) else None
+            for block in blocks or []:
+                if isinstance(block, dict) and block.get('type') == 'image' and isinstance(block.get('data'), dict):
+                    data = block['data']
+                    id = image_id((data.get('file') or {}).get('url') or data.get('url'))
+                    if id is not None:
+                        ids.add(id)
+        extents = {}
+        for id, image in self.referenced_images(ids).items():
+            width, height = DEFAULT_IMAGE_PX
+            if PILImage is not None:
+                try:
+                    with PILImage.open(self.image_store.path_for(image.sha256)) as img:
+                        width, height = img.size
+                except (OSError, ValueError):
+                    pass
+            cx, cy = width * EMU_PER_PIXEL, height * EMU_PER_PIXEL
+            if cx > MAX_IMAGE_EMU:
+                cx, cy = MAX_IMAGE_EMU, cy * MAX_IMAGE_EMU // cx
+            extents[id] = (cx, cy)
+        return extents
+
+    def assemble_docx(self, document):
+        counter = iter(range(1, 1 << 31))
+        document = re.sub(r'<wp:docPr id="0"', lambda _: f'<wp:docPr id="{next(counter)}"', document)
+        images = self.referenced_images({int(id) for id in re.findall(r'r:embed="img(\d+)"', document)})
+        rels = [f'<Relationship Id="img{id}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" '
+                f'Target="media/image{id}.{DOCX_IMAGE_TYPES[image.content_type]}"/>' for id, image in images.items()]
+        rels.insert(0, '<Relationship Id="styles" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>')
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as docx:
+            docx.writestr('[Content_Types].xml', CONTENT_TYPES)
+            docx.writestr('_rels/.rels', PACKAGE_RELS)
+            docx.writestr('word/document.xml', document)
+            docx.writestr('word/styles.xml', self.templates['styles.xml'].render())
+            docx.writestr('word/_rels/document.xml.rels', RELS_HEADER + ''.join(rels) + '</Relationships>')
+            for id, image in images.items():
+                # images are already compressed, deflating them again only costs time
+                docx.write(self.image_store.path_for(image.sha256),
+                           f'word/media/image{id}.{DOCX_IMAGE_TYPES[image.content_type]}', zipfile.ZIP_STORED)
+        return buffer.getvalue()
+
+
+RELS_HEADER = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+               '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">')
+PACKAGE_RELS = (RELS_HEADER + '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                'relationships/officeDocument" Target="word/document.xml"/></Relationships>')
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Default Extension="png" ContentType="image/png"/>'
+    '<Default Extension="jpeg" ContentType="image/jpeg"/>'
+    '<Default Extension="gif" ContentType="image/gif"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>'
+)
+
+renderer = ReportRenderer()
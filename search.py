@@ -0,0 +1,205 @@
+import re
+from html import unescape
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+from models import db, Findings
+
+TAG_RE = re.compile(r'<[^>]+>')
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+SNIPPET_START, SNIPPET_STOP = '<mark>', '</mark>'
+
+SCHEMA = {
+    'postgresql': [
+        """CREATE TABLE IF NOT EXISTS finding_search (
+            finding_id INTEGER PRIMARY KEY REFERENCES findings (id) ON DELETE CASCADE,
+            title TEXT NOT NULL DEFAULT '',
+            body TEXT NOT NULL DEFAULT '',
+            tsv TSVECTOR GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', body), 'B')
+            ) STORED
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_finding_search_tsv ON finding_search USING GIN (tsv)",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS finding_search_fts USING fts5(title, body, tokenize='porter unicode61')",
+    ],
+}
+DROP_SCHEMA = {
+    'postgresql': ["DROP TABLE IF EXISTS finding_search"],
+    'sqlite': ["DROP TABLE IF EXISTS finding_search_fts"],
+}
+
+
+class SearchUnavailable(Exception):
+    pass
+
+
+def strip_html(value):
+    return unescape(TAG_RE.sub(' ', value))
+
+
+def extract_text(description):
+    # flattens Editor.js style {"blocks": [{"type": ..., "data": {...}}]} into plain text
+    parts = []
+
+    def walk(value):
+        if isinstance(value, str):
+            parts.append(strip_html(value))
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                if key not in ('type', 'id', 'url', 'file', 'style', 'level', 'withHeadings'):
+                    walk(item)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+
+    walk(description)
+    return ' '.join(' '.join(parts).split())
+
+
+class PostgresSearch:
+    def upsert(self, connection, rows):
+        connection.execute(text(
+            "INSERT INTO finding_search (finding_id, title, body) VALUES (:id, :title, :body) "
+            "ON CONFLICT (finding_id) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body"
+        ), rows)
+
+    def remove(self, connection, ids):
+        connection.execute(text("DELETE FROM finding_search WHERE finding_id = ANY(:ids)"), {'ids': list(ids)})
+
+    def clear(self, connection):
+        connection.execute(text("TRUNCATE finding_search"))
+
+    def search(self, connection, query, limit, offset, project_id=None):
+        # the headline is only computed for the rows of the requested page
+        return connection.execute(text(
+            "SELECT hits.finding_id, hits.score, ts_headline('english', s.title || ' ' || s.body, hits.q, "
+            "  'MaxFragments=2, MaxWords=18, MinWords=6, StartSel=" + SNIPPET_START + ", StopSel=" + SNIPPET_STOP + "') "
+            "FROM ("
+            "  SELECT s.finding_id, ts_rank_cd(s.tsv, q) AS score, q"
+            "  FROM finding_search s JOIN findings f ON f.id = s.finding_id, websearch_to_tsquery('english', :query) q"
+            "  WHERE s.tsv @@ q AND (CAST(:project_id AS INTEGER) IS NULL OR f.project_id = :project_id)"
+            "  ORDER BY score DESC, s.finding_id"
+            "  LIMIT :limit OFFSET :offset"
+            ") hits JOIN finding_search s ON s.finding_id = hits.finding_id "
+            "ORDER BY hits.score DESC, hits.finding_id"
+        ), {'query': query, 'limit': limit, 'offset': offset, 'project_id': project_id}).all()
+
+
+class SqliteSearch:
+    def upsert(self, connection, rows):
+        self.remove(connection, [row['id'] for row in rows])
+        connection.execute(text("INSERT INTO finding_search_fts (rowid, title, body) VALUES (:id, :title, :body)"), rows)
+
+    def remove(self, connection, ids):
+        connection.execute(text("DELETE FROM finding_search_fts WHERE rowid = :id"), [{'id': id} for id in ids])
+
+    def clear(self, connection):
+        connection.execute(text("DELETE FROM finding_search_fts"))
+
+    def search(self, connection, query, limit, offset, project_id=None):
+        # every word is quoted so user input can't break the MATCH syntax, the last one matches as a prefix
+        tokens = TOKEN_RE.findall(query)
+        if not tokens:
+            return []
+        match = ' '.join(f'"{token}"' for token in tokens) + '*'
+        return connection.execute(text(
+            "SELECT fts.rowid, -bm25(finding_search_fts, 4.0, 1.0) AS score, "
+            "  snippet(finding_search_fts, -1, '" + SNIPPET_START + "', '" + SNIPPET_STOP + "', '…', 16) "
+            "FROM finding_search_fts fts JOIN findings f ON f.id = fts.rowid "
+            "WHERE finding_search_fts MATCH :match AND (:project_id IS NULL OR f.project_id = :project_id) "
+            "ORDER BY bm25(finding_search_fts, 4.0, 1.0), fts.rowid "
+            "LIMIT :limit OFFSET :offset"
+        ), {'match': match, 'limit': limit, 'offset': offset, 'project_id': project_id}).all()
+
+
+BACKENDS = {'postgresql': PostgresSearch(), 'sqlite': SqliteSearch()}
+
+
+def document(id, title, description):
+    return {'id': id, 'title': title or '', 'body': extract_text(description)}
+
+
+def index_rows(connection, rows):
+    backend = BACKENDS.get(connection.dialect.name)
+    if backend and rows:
+        backend.upsert(connection, [document(row['id'], row['title'], row['description']) for row in rows])
+
+
+def remove_ids(connection, ids):
+    backend = BACKENDS.get(connection.dialect.name)
+    if backend and ids:
+        backend.remove(connection, ids)
+
+
+def clear_index(connection):
+    backend = BACKENDS.get(connection.dialect.name)
+    if backend:
+        backend.clear(connection)
+
+
+def search_findings(query, limit, offset, project_id=None):
+    connection = db.session.connection()
+    backend = BACKENDS.get(connection.dialect.name)
+    if backend is None:
+        raise SearchUnavailable(f'Full-text search is not available on {connection.dialect.name}')
+    return backend.search(connection, query, limit, offset, project_id)
+
+
+def create_schema(connection):
+    for statement in SCHEMA.get(connection.dialect.name, []):
+        connection.execute(text(statement))
+
+
+# db.create_all()/drop_all() take the index along with the findings table, so every write to
+# findings has somewhere to go. Deployments get it from the migration instead.
+@event.listens_for(Findings.__table__, 'after_create')
+def _create_schema(target, connection, **kw):
+    create_schema(connection)
+
+
+@event.listens_for(Findings.__table__, 'before_drop')
+def _drop_schema(target, connection, **kw):
+    for statement in DROP_SCHEMA.get(connection.dialect.name, []):
+        connection.execute(text(statement))
+
+
+def rebuild_index(batch_size=1000):
+    connection = db.session.connection()
+    clear_index(connection)
+    indexed = 0
+    query = db.session.query(Findings.id, Findings.title, Findings.description).order_by(Findings.id)
+    batch = []
+    for id, title, description in query.yield_per(batch_size):
+        batch.append({'id': id, 'title': title, 'description': description})
+        if len(batch) >= batch_size:
+            index_rows(connection, batch)
+            indexed += len(batch)
+            batch = []
+    index_rows(connection, batch)
+    return indexed + len(batch)
+
+
+# ORM writes keep the index current inside the same flush, including findings removed
+# through the Project.findings cascade. Deletes are collected per flush, so a project's
+# findings leave the index in one statement. Core statements (bulk import, Query.delete)
+# call index_rows/remove_ids/clear_index themselves.
+@event.listens_for(Findings, 'after_insert')
+def _index_new_finding(mapper, connection, target):
+    index_rows(connection, [{'id': target.id, 'title': target.title, 'description': target.description}])
+
+
+@event.listens_for(Findings, 'after_update')
+def _index_finding(mapper, connection, target):
+    state = inspect(target)
+    if not (state.attrs.title.history.has_changes() or state.attrs.description.history.has_changes()):
+        return
+    index_rows(connection, [{'id': target.id, 'title': target.title, 'description': target.description}])
+
+
+@event.listens_for(Session, 'after_flush')
+def _remove_deleted_findings(session, flush_context):
+    # session.deleted still holds what this flush deleted
+    ids = [target.id for target in session.deleted if isinstance(target, Findings)]
+    if ids:
+        remove_ids(session.connection(), ids)
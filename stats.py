@@ -0,0 +1,177 @@
+from collections import Counter
+from sqlalchemy import delete, event, func, inspect, literal, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import db, Findings, Project, ProjectStat, lookups
+
+DIMENSIONS = {
+    'severity': ('severity_id', 'severities'),
+    'category': ('category_id', 'categories'),
+    'status': ('status_id', 'statuses'),
+}
+# dialects with INSERT .. ON CONFLICT. On anything else the counters aren't kept and
+# project_stats counts the findings table instead
+INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def counters_kept(connection):
+    return connection.dialect.name in INSERTS
+
+
+def keys_for(values):
+    # values is a mapping with project_id and the dimension columns of one finding
+    if values.get('project_id') is None:
+        return []
+    return [
+        (values['project_id'], dimension, values.get(column) or 0)
+        for dimension, (column, _) in DIMENSIONS.items()
+    ]
+
+
+def apply_deltas(connection, deltas):
+    rows = [
+        {'project_id': project_id, 'dimension': dimension, 'value_id': value_id, 'count': delta}
+        for (project_id, dimension, value_id), delta in deltas.items() if delta
+    ]
+    insert = INSERTS.get(connection.dialect.name)
+    if not rows or insert is None:
+        return
+    statement = insert(ProjectStat.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['project_id', 'dimension', 'value_id'],
+        set_={'count': ProjectStat.__table__.c.count + statement.excluded['count']}
+    )
+    connection.execute(statement, rows)
+
+
+def track_inserted(connection, rows):
+    apply_deltas(connection, Counter(key for row in rows for key in keys_for(row)))
+
+
+def track_bulk_update(connection, query, patch):
+    # called before the UPDATE runs, with the same query it will run against
+    if not counters_kept(connection):
+        return
+    columns = [Findings.project_id] + [getattr(Findings, column) for column, _ in DIMENSIONS.values()]
+    groups = query.with_entities(*columns, func.count()).group_by(*columns).all()
+    deltas = Counter()
+    for *values, count in groups:
+        before = dict(zip(['project_id'] + [column for column, _ in DIMENSIONS.values()], values))
+        after = dict(before, **patch)
+        for key in keys_for(before):
+            deltas[key] -= count
+        for key in keys_for(after):
+            deltas[key] += count
+    apply_deltas(connection, deltas)
+
+
+def clear_stats(connection):
+    connection.execute(delete(ProjectStat))
+
+
+def rebuild_stats(connection):
+    clear_stats(connection)
+    for dimension, (column, _) in DIMENSIONS.items():
+        value = func.coalesce(getattr(Findings, column), 0)
+        connection.execute(ProjectStat.__table__.insert().from_select(
+            ['project_id', 'dimension', 'value_id', 'count'],
+            select(Findings.project_id, literal(dimension), value, func.count())
+            .where(Findings.project_id.isnot(None))
+            .group_by(Findings.project_id, value)
+        ))
+
+
+def stored_counts(project_ids):
+    query = db.session.query(
+        ProjectStat.project_id, ProjectStat.dimension, ProjectStat.value_id, ProjectStat.count
+    ).filter(ProjectStat.count > 0)
+    if project_ids is not None:
+        query = query.filter(ProjectStat.project_id.in_(project_ids))
+    return query.order_by(ProjectStat.project_id, ProjectStat.dimension, ProjectStat.value_id).all()
+
+
+def live_counts(project_ids):
+    # what rebuild_stats would have stored, one GROUP BY per dimension in a single statement
+    selects = []
+    for dimension, (column, _) in DIMENSIONS.items():
+        value = func.coalesce(getattr(Findings, column), 0)
+        query = select(Findings.project_id, literal(dimension).label('dimension'), value.label('value_id'), func.count()) \
+            .where(Findings.project_id.isnot(None))
+        if project_ids is not None:
+            query = query.where(Findings.project_id.in_(project_ids))
+        selects.append(query.group_by(Findings.project_id, value))
+    counts = union_all(*selects).subquery()
+    return db.session.execute(select(counts).order_by(*counts.c[:3])).all()
+
+
+def project_stats(project_ids=None):
+    counts = stored_counts if counters_kept(db.session.get_bind()) else live_counts
+    stats = {}
+    for project_id, dimension, value_id, count in counts(project_ids):
+        project = stats.setdefault(project_id, {
+            'project_id': project_id, 'total': 0, **{name: [] for name in DIMENSIONS}
+        })
+        table = DIMENSIONS[dimension][1]
+        entry = lookups.get(table, value_id) if value_id else None
+        project[dimension].append({
+            'id': value_id or None,
+            'name': entry['name'] if entry else None,
+            'count': count,
+        })
+        if dimension == 'severity':
+            project['total'] += count
+    return stats
+
+
+def finding_values(target):
+    return {
+        'project_id': target.project_id,
+        **{column: getattr(target, column) for column, _ in DIMENSIONS.values()}
+    }
+
+
+# ORM writes adjust the counters inside the same flush, deletes once per flush rather than
+# per row. Core statements (bulk import, bulk update, Query.delete) call
+# track_inserted/track_bulk_update/clear_stats themselves
+@event.listens_for(Findings, 'after_insert')
+def _count_new_finding(mapper, connection, target):
+    track_inserted(connection, [finding_values(target)])
+
+
+@event.listens_for(Findings, 'after_update')
+def _recount_finding(mapper, connection, target):
+    state = inspect(target)
+    before, changed = {}, False
+    for name in ['project_id'] + [column for column, _ in DIMENSIONS.values()]:
+        history = state.attrs[name].history
+        if history.has_changes():
+            changed = True
+            before[name] = history.deleted[0] if history.deleted else None
+        else:
+            before[name] = getattr(target, name)
+    if not changed:
+        return
+    deltas = Counter()
+    for key in keys_for(before):
+        deltas[key] -= 1
+    for key in keys_for(finding_values(target)):
+        deltas[key] += 1
+    apply_deltas(connection, deltas)
+
+
+@event.listens_for(Session, 'after_flush')
+def _uncount_deleted(session, flush_context):
+    # session.deleted still holds what this flush deleted. A deleted project's counters go in
+    # one statement, its findings don't need decrementing first
+    projects = {target.id for target in session.deleted if isinstance(target, Project)}
+    deltas = Counter()
+    for target in session.deleted:
+        if isinstance(target, Findings) and target.project_id not in projects:
+            for key in keys_for(finding_values(target)):
+                deltas[key] -= 1
+    if not projects and not deltas:
+        return
+    connection = session.connection()
+    if projects:
+        connection.execute(delete(ProjectStat).where(ProjectStat.project_id.in_(projects)))
+    apply_deltas(connection, deltas)
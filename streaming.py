@@ -0,0 +1,34 @@
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_stream():
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_response(query, serialize):
+    # yield_per makes the dialect use a server-side cursor, so only one batch
+    # of rows is ever held in the worker at a time
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+
+    def generate():
+        lines = []
+        try:
+            for item in query.yield_per(batch_size):
+                lines.append(current_app.json.dumps(serialize(item)))
+                if len(lines) >= batch_size:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+            if lines:
+                yield '\n'.join(lines) + '\n'
+        finally:
+            # stream_with_context re-pushes the app context while the body is read and its teardown
+            # removes whatever session db.session holds then. The query is bound to the Session the
+            # view created, which was already closed and unregistered when the view returned;
+            # iterating opens a connection on it again that no teardown sees, so close it here
+            query.session.close()
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+
+# app.py reads its config at import time, point everything it writes at a throwaway directory
+ROOT = tempfile.mkdtemp(prefix='findings-tests-')
+os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(ROOT, 'test.db')
+os.environ['IMAGE_STORE_PATH'] = os.path.join(ROOT, 'images')
+os.environ['REPORT_CACHE_PATH'] = os.path.join(ROOT, 'report-cache')
+os.environ['JOB_RESULT_PATH'] = os.path.join(ROOT, 'job-results')
+os.environ['JWT_SECRET_KEY'] = 'test-secret-key-test-secret-key-test'
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+os.environ['AUTH_REQUIRED'] = 'false'
+os.environ['SQL_PROFILER'] = 'off'
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+pytest_plugins = ['pytest_sql_budget', 'pytester']
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    app.config['TESTING'] = True
+    yield app
+    shutil.rmtree(ROOT, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def database(app):
+    from models import db
+    with app.app_context():
+        db.create_all()
+    yield db
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+    app.config['AUTH_REQUIRED'] = False
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# the lookups, an admin role holding every permission and a viewer role holding the :read ones
+@pytest.fixture
+def seed(app, database):
+    from authz import registered_permissions
+    from models import Category, Permissions, Roles, Severity, Status, Users, lookups
+    from passwords import passwords
+    db = database
+    with app.app_context():
+        permissions = [Permissions(name=name) for name in sorted(registered_permissions)]
+        admin = Roles(name='admin', permissions=permissions)
+        viewer = Roles(name='viewer', permissions=[p for p in permissions if p.name.endswith(':read')])
+        password = passwords.hash('password')
+        users = [Users(name='Admin', email='admin@example.com', password=password, role=admin),
+                 Users(name='Viewer', email='viewer@example.com', password=password, role=viewer)]
+        lookups_rows = [Category(name='Injection'), Status(name='Open'), Severity(name='High')]
+        db.session.add_all(permissions + [admin, viewer] + users + lookups_rows)
+        lookups.invalidate('categories', 'statuses', 'severities', 'roles', 'permissions')
+        db.session.commit()
+        return {
+            'admin': users[0].id, 'viewer': users[1].id, 'category': lookups_rows[0].id,
+            'status': lookups_rows[1].id, 'severity': lookups_rows[2].id,
+        }
+
+
+@pytest.fixture
+def auth(app, seed):
+    # headers carrying a token for the seeded admin, auth('viewer') for the read-only one
+    from authz import token_claims
+    from models import Users
+    app.config['AUTH_REQUIRED'] = True
+
+    def headers(name='admin'):
+        with app.app_context():
+            user = Users.query.get(seed[name])
+            token = create_access_token(identity=user.email, additional_claims=token_claims(user))
+        return {'Authorization': f'Bearer {token}'}
+    return headers
+
+
+@pytest.fixture
+def make_project(app, database, seed):
+    # make_project(findings=3) creates a project with that many findings and returns its id
+    from models import Findings, Project
+    db = database
+
+    def make(findings=0, name='Assessment'):
+        with app.app_context():
+            project = Project(name=name, description={'blocks': []})
+            project.findings = [
+                Findings(title=f'Finding {n}', description={'blocks': [{'type': 'paragraph', 'data': {'text': f'text {n}'}}]},
+                         category_id=seed['category'], status_id=seed['status'], severity_id=seed['severity'])
+                for n in range(findings)
+            ]
+            db.session.add(project)
+            db.session.commit()
+            return project.id
+    return make
@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+
+import pytest
+
+from models import Findings, db
+
+
+@pytest.fixture
+def findings(app, seed, make_project):
+    project = make_project(findings=4)
+    other = make_project(findings=2, name='Other')
+    with app.app_context():
+        ids = [id for (id,) in db.session.query(Findings.id).filter_by(project_id=project).order_by(Findings.id)]
+    return {'project': project, 'other': other, 'ids': ids}
+
+
+def statuses(app):
+    with app.app_context():
+        return dict(db.session.query(Findings.id, Findings.status_id))
+
+
+def new_status(app):
+    from models import Status
+    with app.app_context():
+        status = Status(name='Fixed')
+        db.session.add(status)
+        db.session.commit()
+        return status.id
+
+
+def test_update_by_filter(app, client, findings):
+    fixed = new_status(app)
+    response = client.patch('/findings/bulk', json={'filter': {'project_id': findings['project']}, 'patch': {'status_id': fixed}})
+    assert response.status_code == 200
+    assert response.get_json()['updated'] == 4
+    assert sorted(id for id, status in statuses(app).items() if status == fixed) == findings['ids']
+
+
+def test_update_by_ids(app, client, findings):
+    fixed = new_status(app)
+    response = client.patch('/findings/bulk', json={'ids': findings['ids'][:2], 'patch': {'status_id': fixed}})
+    assert response.get_json()['updated'] == 2
+
+
+@pytest.mark.parametrize('body', [
+    {'filter': {'projectId': 1}},
+    {'filters': {'project_id': 1}},
+    {'filter': {'project_id': 'one'}},
+    {'filter': {'project_id': '1'}},
+    {'filter': {'project_id': True}},
+    {'filter': {'project_id': None}},
+    {'filter': {}},
+    {'filter': [1]},
+    {'filter': {'updated_since': 'yesterday'}},
+    {'ids': 1},
+    {'ids': []},
+    {'ids': ['1']},
+    {},
+    {'all': 'yes'},
+])
+def test_bad_selector_updates_nothing(app, client, findings, body):
+    before = statuses(app)
+    response = client.patch('/findings/bulk', json=dict(body, patch={'status_id': new_status(app)}))
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+    assert statuses(app) == before
+
+
+def test_update_everything_has_to_be_asked_for(app, client, findings):
+    fixed = new_status(app)
+    response = client.patch('/findings/bulk', json={'all': True, 'patch': {'status_id': fixed}})
+    assert response.get_json()['updated'] == 6
+
+
+def import_body(seed, project, count, bad=()):
+    return [{'title': f'Imported {n}', 'description': {'blocks': []}, 'project_id': 0 if n in bad else project,
+             'severity_id': seed['severity']} for n in range(count)]
+
+
+# a few statements per batch, repeated on purpose with the batch size this small
+@pytest.mark.allow_n_plus_one
+def test_import_counts_rows_across_batches(app, client, seed, make_project, monkeypatch):
+    monkeypatch.setitem(app.config, 'BULK_BATCH_SIZE', 7)
+    project = make_project()
+    response = client.post('/findings/bulk', json=import_body(seed, project, 30))
+    assert response.status_code == 201
+    assert response.get_json() == {'inserted': 30, 'errors': []}
+    with app.app_context():
+        assert db.session.query(Findings.id).filter_by(project_id=project).count() == 30
+
+
+# a few statements per batch, repeated on purpose with the batch size this small
+@pytest.mark.allow_n_plus_one
+def test_partial_import(app, client, seed, make_project, monkeypatch):
+    monkeypatch.setitem(app.config, 'BULK_BATCH_SIZE', 7)
+    project = make_project()
+    body = import_body(seed, project, 20, bad={3, 15})
+    assert client.post('/findings/bulk', json=body).status_code == 422
+    response = client.post('/findings/bulk?partial=1', json=body)
+    assert response.get_json()['inserted'] == 18
+    assert [error['row'] for error in response.get_json()['errors']] == [4, 16]
+
+
+def csv_body(seed, project, descriptions):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['title', 'description', 'project_id', 'severity_id'])
+    for n, description in enumerate(descriptions):
+        writer.writerow([f'Imported {n}', json.dumps(description), project, seed['severity']])
+    return out.getvalue()
+
+
+def test_csv_import(app, client, seed, make_project):
+    project = make_project()
+    big = {'blocks': [{'type': 'paragraph', 'data': {'text': 'x' * 200 * 1024}}]}
+    response = client.post('/findings/bulk', data=csv_body(seed, project, [{'blocks': []}, big]), content_type='text/csv')
+    assert response.status_code == 201, response.get_data(as_text=True)
+    assert response.get_json() == {'inserted': 2, 'errors': []}
+    with app.app_context():
+        stored = Findings.query.filter_by(project_id=project, title='Imported 1').one()
+        assert stored.description == big
+
+
+def test_csv_field_over_the_limit_is_a_400(app, client, seed, make_project, monkeypatch):
+    monkeypatch.setitem(app.config, 'BULK_MAX_FIELD_BYTES', 1024)
+    project = make_project()
+    body = csv_body(seed, project, [{'blocks': []}, {'text': 'x' * 4096}])
+    response = client.post('/findings/bulk', data=body, content_type='text/csv')
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('Invalid CSV at row 2')
+    with app.app_context():
+        assert Findings.query.filter_by(project_id=project).count() == 0
@@ -0,0 +1,41 @@
+import io
+import json
+import zipfile
+
+from sqlalchemy import event
+
+from export import export_project
+from models import db
+
+
+def test_export_archive(client, make_project):
+    project = make_project(findings=3)
+    response = client.get(f'/project/{project}/export.zip')
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.testzip() is None
+    project_doc = json.loads(archive.read('project.json'))
+    assert project_doc['id'] == project and 'findings' not in project_doc
+    names = archive.namelist()
+    assert len([name for name in names if name.startswith('findings/') and name.endswith('.json')]) == 3
+    assert json.loads(archive.read('manifest.json'))['findings'] == 3
+
+
+def test_project_entry_does_not_load_findings(app, make_project):
+    project = make_project(findings=25)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            chunks = export_project(project, batch_size=10)
+            next(chunks)
+            chunks.close()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+    # project.json is out, the findings so far were only counted
+    on_findings = [statement for statement in statements if 'FROM findings' in statement]
+    assert on_findings and all('count(' in statement for statement in on_findings)
@@ -0,0 +1,124 @@
+import io
+import os
+
+import pytest
+from PIL import Image as PILImage
+from werkzeug.datastructures import MultiDict
+
+from derivatives import derivatives
+from image_store import image_store
+from models import Image, db
+from tests.conftest import ROOT
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (400, 200), (200, 30, 30)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def image(app):
+    with app.app_context():
+        digest, size = image_store.save_bytes(png_bytes())
+        row = Image(filename='shot.png', content_type='image/png', sha256=digest, size=size)
+        db.session.add(row)
+        db.session.commit()
+        return row.id
+
+
+def test_original(client, image):
+    response = client.get(f'/api/image/{image}')
+    assert response.status_code == 200
+    assert response.data.startswith(b'\x89PNG')
+
+
+@pytest.mark.parametrize('query', [
+    'size=thumbnail&fmt=/../../../escaped/dir',
+    'size=thumbnail&fmt=bogus',
+    'w=320&fmt=bogus',
+    'fmt=bogus',
+    'size=huge',
+    'w=wide',
+])
+def test_invalid_variant_is_rejected(client, image, query):
+    response = client.get(f'/api/image/{image}?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+    assert not any('escaped' in dirs for _, dirs, _ in os.walk(ROOT))
+
+
+def test_resolve(app):
+    with app.app_context():
+        assert derivatives.resolve(MultiDict()) is None
+        assert derivatives.resolve(MultiDict({'size': 'thumbnail'})) == (160, 'webp')
+        assert derivatives.resolve(MultiDict({'size': 'thumbnail', 'fmt': 'png'})) == (160, 'png')
+        assert derivatives.resolve(MultiDict({'w': '300', 'fmt': 'jpeg'})) == (320, 'jpeg')
+        with pytest.raises(ValueError):
+            derivatives.resolve(MultiDict({'size': 'thumbnail', 'fmt': '../x'}))
+
+
+def test_path_for_refuses_unknown_formats(app):
+    with pytest.raises(ValueError):
+        derivatives.path_for('ab' * 32, 160, '/../x')
+
+
+def age(digest, seconds=2 * 60 * 60):
+    path = image_store.path_for(digest)
+    then = os.path.getmtime(path) - seconds
+    os.utime(path, (then, then))
+
+
+def digest_of(app, image):
+    with app.app_context():
+        return db.session.get(Image, image).sha256
+
+
+def test_missing_file_is_a_404(app, client, image):
+    os.remove(image_store.path_for(digest_of(app, image)))
+    assert client.get(f'/api/image/{image}').status_code == 404
+
+
+def test_delete_removes_an_unreferenced_file(app, client, image):
+    digest = digest_of(app, image)
+    age(digest)
+    assert client.delete(f'/api/deleteImage/{image}').status_code == 200
+    assert not image_store.exists(digest)
+
+
+def test_delete_keeps_a_file_another_row_references(app, client, image):
+    digest = digest_of(app, image)
+    age(digest)
+    with app.app_context():
+        db.session.add(Image(filename='copy.png', content_type='image/png', sha256=digest, size=1))
+        db.session.commit()
+    client.delete(f'/api/deleteImage/{image}')
+    assert image_store.exists(digest)
+
+
+def test_delete_keeps_a_file_an_upload_just_adopted(app, client, image):
+    digest = digest_of(app, image)
+    age(digest)
+    # an upload of the same bytes adopts the blob but has not committed its row yet
+    with app.app_context():
+        assert image_store.save_bytes(png_bytes())[0] == digest
+    client.delete(f'/api/deleteImage/{image}')
+    assert image_store.exists(digest)
+    with app.app_context():
+        copy = Image(filename='again.png', content_type='image/png', sha256=digest, size=1)
+        db.session.add(copy)
+        db.session.commit()
+        copy = copy.id
+    assert client.get(f'/api/image/{copy}').status_code == 200
+
+
+def test_gc_collects_orphans_past_the_grace_period(app, client, image):
+    digest = digest_of(app, image)
+    client.delete(f'/api/deleteImage/{image}')
+    runner = app.test_cli_runner()
+    assert 'kept until' in runner.invoke(args=['images-gc']).output
+    assert image_store.exists(digest)
+    age(digest)
+    result = runner.invoke(args=['images-gc'])
+    assert result.output.startswith('removed 1 ')
+    assert not image_store.exists(digest)
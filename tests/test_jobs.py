@@ -0,0 +1,47 @@
+import uuid
+
+import pytest
+
+from models import Job, db
+
+
+@pytest.fixture
+def owned(app, seed):
+    # one queued job per seeded user
+    with app.app_context():
+        jobs = {name: Job(id=uuid.uuid4().hex, kind='findings-import', status='queued', created_by=seed[name],
+                          params={'rows': [{'title': f'secret {name} row'}]})
+                for name in ('admin', 'viewer')}
+        db.session.add_all(jobs.values())
+        db.session.commit()
+        return {name: job.id for name, job in jobs.items()}
+
+
+def test_list_shows_only_own_jobs_without_params(client, auth, owned):
+    response = client.get('/jobs', headers=auth('viewer'))
+    assert response.status_code == 200
+    listed = response.get_json()
+    assert [job['id'] for job in listed] == [owned['viewer']]
+    assert 'params' not in listed[0]
+
+
+def test_detail_has_params(client, auth, owned):
+    response = client.get(f"/jobs/{owned['viewer']}", headers=auth('viewer'))
+    assert response.get_json()['params'] == {'rows': [{'title': 'secret viewer row'}]}
+
+
+@pytest.mark.parametrize('method, path', [
+    ('get', '/jobs/{id}'),
+    ('get', '/jobs/{id}/result'),
+    ('post', '/jobs/{id}/cancel'),
+])
+def test_other_users_jobs_are_not_found(client, auth, owned, method, path):
+    response = getattr(client, method)(path.format(id=owned['viewer']), headers=auth('admin'))
+    assert response.status_code == 404
+
+
+def test_cancel_own_job(app, client, auth, owned):
+    response = client.post(f"/jobs/{owned['admin']}/cancel", headers=auth('admin'))
+    assert response.status_code == 200
+    with app.app_context():
+        assert db.session.get(Job, owned['admin']).status == 'cancelled'
@@ -0,0 +1,49 @@
+import json
+from datetime import datetime
+
+import pytest
+from flask.json.provider import DefaultJSONProvider
+
+from json_provider import OrjsonProvider
+
+
+@pytest.fixture
+def providers(app):
+    return OrjsonProvider(app), DefaultJSONProvider(app)
+
+
+def test_same_values(providers):
+    fast, stdlib = providers
+    value = {'id': 1, 'title': 'Ünïcode “quotes” 🔒', 'created_at': datetime(2024, 5, 1, 12, 30, 5),
+             'tags': ['a', None, True], 'score': 1.5}
+    assert json.loads(fast.dumps(value)) == json.loads(stdlib.dumps(value))
+
+
+
+def test_ascii_responses_are_byte_identical(app, providers):
+    fast, stdlib = providers
+    value = {'id': 1, 'title': 'plain', 'at': datetime(2024, 5, 1, 12, 30, 5), 'tags': ['a', None]}
+    with app.test_request_context():
+        assert fast.response(value).get_data() == stdlib.response(value).get_data()
+
+
+def test_non_ascii_is_utf8_not_escaped(providers):
+    fast, stdlib = providers
+    assert fast.dumps('é') == '"é"'
+    assert stdlib.dumps('é') == '"\\u00e9"'
+
+
+def test_non_finite_floats_become_null(providers):
+    fast, stdlib = providers
+    assert fast.dumps([float('nan'), float('inf')]) == '[null,null]'
+    assert stdlib.dumps([float('nan'), float('inf')]) == '[NaN, Infinity]'
+
+
+def test_nan_in_a_request_body_is_a_400(client):
+    response = client.patch('/findings/bulk', data='{"patch": NaN}', content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_big_ints_fall_back_to_the_stdlib(providers):
+    fast, _ = providers
+    assert fast.dumps({'n': 2 ** 70}) == '{"n": 1180591620717411303424}'
@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+from passwords import passwords
+
+
+@pytest.fixture
+def saturated(monkeypatch):
+    monkeypatch.setattr(passwords, '_slots', threading.Semaphore(0))
+
+
+@pytest.fixture
+def slow(monkeypatch):
+    monkeypatch.setattr(passwords, 'method', 'pbkdf2:sha256:2000000')
+    monkeypatch.setattr(passwords, 'timeout', 0.01)
+
+
+def login(client):
+    return client.post('/login', json={'email': 'admin@example.com', 'password': 'password'})
+
+
+def register(client):
+    return client.post('/users', json={'name': 'New', 'email': 'new@example.com', 'password': 'secret', 'role_id': None})
+
+
+def test_login(client, seed):
+    response = login(client)
+    assert response.status_code == 200
+    assert 'access_token' in response.get_json()
+
+
+@pytest.mark.parametrize('kdf', ['saturated', 'slow'])
+@pytest.mark.parametrize('call', [login, register])
+def test_busy_kdf_is_a_503(request, client, seed, kdf, call):
+    request.getfixturevalue(kdf)
+    response = call(client)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert 'retry' in response.get_json()['error']
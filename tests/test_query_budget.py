@@ -0,0 +1,70 @@
+import uuid
+
+import pytest
+
+from models import Job, db
+
+# every GET that declares a @query_budget, {name} is filled from the ids the fixture created
+PATHS = {
+    'projects': '/projects',
+    'project': '/project/{project}',
+    'projects_stats': '/projects/stats',
+    'project_stats_detail': '/project/{project}/stats',
+    'categories': '/categories',
+    'category': '/category/{category}',
+    'severities': '/severities',
+    'severity': '/severity/{severity}',
+    'findings': '/findings',
+    'finding': '/finding/{finding}',
+    'users': '/users',
+    'user': '/user/{admin}',
+    'roles': '/roles',
+    'role': '/role/{role}',
+    'permissions': '/permissions',
+    'permission': '/permission/{permission}',
+    'role_permissions': '/roles/{role}/permissions',
+    'search': '/search?q=finding',
+    'job_list': '/jobs',
+    'job_detail': '/jobs/{job}',
+    'job_result': '/jobs/{job}/result',
+}
+
+
+@pytest.fixture
+def ids(app, seed, make_project):
+    from models import Findings, Roles
+    projects = [make_project(findings=count, name=f'Project {count}') for count in (1, 12)]
+    with app.app_context():
+        job = Job(id=uuid.uuid4().hex, kind='report', status='succeeded', result={'ok': True}, created_by=seed['admin'])
+        db.session.add(job)
+        db.session.commit()
+        role = Roles.query.filter_by(name='admin').one()
+        return dict(seed, project=projects[1], finding=Findings.query.filter_by(project_id=projects[1]).first().id,
+                    role=role.id, permission=role.permissions[0].id, job=job.id)
+
+
+def test_every_budgeted_read_is_covered(app):
+    budgeted = {
+        rule.endpoint for rule in app.url_map.iter_rules()
+        if 'GET' in rule.methods and getattr(app.view_functions[rule.endpoint], 'query_budget', (None,))[0] is not None
+    }
+    assert budgeted == set(PATHS)
+
+
+@pytest.mark.parametrize('endpoint', sorted(PATHS))
+def test_read_stays_within_budget(client, auth, ids, sql_profiles, endpoint):
+    # pytest_sql_budget fails the test once a request passes its view's budget or repeats a statement
+    response = client.get(PATHS[endpoint].format(**ids), headers=auth())
+    assert response.status_code == 200, response.get_data(as_text=True)
+    profile, = sql_profiles
+    assert profile['endpoint'] == endpoint
+    assert profile['budget'] is not None
+
+
+@pytest.mark.parametrize('path', ['/projects', '/findings', '/project/{project}'])
+def test_statement_count_does_not_grow_with_rows(app, client, auth, ids, make_project, sql_profiles, path):
+    client.get(path.format(**ids), headers=auth())
+    make_project(findings=30, name='Larger')
+    client.get(path.format(**ids), headers=auth())
+    before, after = sql_profiles
+    assert after['queries'] - after['cache_queries'] == before['queries'] - before['cache_queries']
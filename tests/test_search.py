@@ -0,0 +1,49 @@
+from models import Findings, db
+
+
+def hits(client, query):
+    response = client.get('/search', query_string={'q': query})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return {hit['finding']['id'] for hit in response.get_json()}
+
+
+def finding_ids(app, project):
+    with app.app_context():
+        return {id for (id,) in db.session.query(Findings.id).filter_by(project_id=project)}
+
+
+def test_new_findings_are_searchable(app, client, make_project):
+    project = make_project(findings=3)
+    assert hits(client, 'finding') == finding_ids(app, project)
+
+
+def test_deleted_finding_leaves_the_index(app, client, make_project):
+    project = make_project(findings=3)
+    gone, *kept = sorted(finding_ids(app, project))
+    assert client.delete(f'/finding/{gone}').status_code == 200
+    assert hits(client, 'finding') == set(kept)
+
+
+def test_deleted_project_takes_its_findings_out_of_the_index(app, client, make_project):
+    project = make_project(findings=25)
+    other = make_project(findings=2, name='Other')
+    assert client.delete(f'/project/{project}').status_code == 200
+    assert hits(client, 'finding') == finding_ids(app, other)
+
+
+def test_create_all_builds_the_index(app, client, seed, make_project):
+    project = make_project()
+    response = client.post('/findings', json={
+        'title': 'Stored XSS', 'description': {'blocks': []}, 'project_id': project,
+        'category_id': seed['category'], 'severity_id': seed['severity'],
+    })
+    assert response.status_code == 201
+    assert len(hits(client, 'xss')) == 1
+
+
+def test_unsupported_backend(client, monkeypatch):
+    import search
+    monkeypatch.delitem(search.BACKENDS, 'sqlite')
+    response = client.get('/search', query_string={'q': 'finding'})
+    assert response.status_code == 501
+    assert 'not available' in response.get_json()['error']
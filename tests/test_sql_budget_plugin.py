@@ -0,0 +1,75 @@
+import pytest
+
+from profiler import profiler
+from pytest_sql_budget import budget_failures
+
+
+def profile(queries, budget, cache_queries=0, n_plus_one=()):
+    return {'method': 'GET', 'path': '/findings', 'queries': queries, 'cache_queries': cache_queries,
+            'budget': budget, 'n_plus_one': list(n_plus_one)}
+
+
+def test_within_budget():
+    assert budget_failures(profile(2, 2)) == []
+
+
+def test_over_budget():
+    assert budget_failures(profile(3, 2)) == ['GET /findings ran 3 statements, budget is 2']
+
+
+def test_lookup_cache_refreshes_are_not_counted():
+    assert budget_failures(profile(3, 2, cache_queries=1)) == []
+
+
+def test_override_replaces_the_view_budget():
+    assert budget_failures(profile(3, 2), override=5) == []
+    assert budget_failures(profile(3, None), override=1) == ['GET /findings ran 3 statements, budget is 1']
+
+
+def test_no_budget_is_unchecked():
+    assert budget_failures(profile(50, None)) == []
+
+
+def test_n_plus_one():
+    repeated = [{'sql': 'SELECT * FROM images WHERE finding_id = ?', 'count': 4, 'ms': 0.1}]
+    assert budget_failures(profile(5, None, n_plus_one=repeated)) == [
+        'GET /findings repeated 4x: SELECT * FROM images WHERE finding_id = ?'
+    ]
+    assert budget_failures(profile(5, None, n_plus_one=repeated), allow_n_plus_one=True) == []
+
+
+INNER_TESTS = """
+import pytest
+from app import app
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_within_budget(client):
+    assert client.get('/projects').status_code == 200
+
+
+@pytest.mark.sql_budget(0)
+def test_over_budget(client):
+    assert client.get('/projects').status_code == 200
+
+
+def test_profiles(client, sql_profiles):
+    client.get('/projects')
+    client.get('/projects/stats')
+    assert [profile['endpoint'] for profile in sql_profiles] == ['projects', 'projects_stats']
+"""
+
+
+# the requests of the inner run also reach this test's own listener, hence the loose budget
+@pytest.mark.sql_budget(100)
+def test_plugin_fails_requests_over_budget(pytester, seed):
+    pytester.makepyfile(test_inner=INNER_TESTS)
+    result = pytester.runpytest_inprocess('-p', 'pytest_sql_budget')
+    result.assert_outcomes(passed=2, failed=1)
+    result.stdout.fnmatch_lines(['*_ test_over_budget _*', 'SQL budget exceeded:', '*GET /projects ran 1 statements, budget is 0'])
+    # only this test's own listener is left
+    assert len(profiler.listeners) == 1
@@ -0,0 +1,52 @@
+import stats as stats_module
+from models import Findings, ProjectStat, db
+
+
+def stats(client, project):
+    response = client.get(f'/project/{project}/stats')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_counts_follow_deletes(app, client, make_project):
+    project = make_project(findings=3)
+    assert stats(client, project)['total'] == 3
+    with app.app_context():
+        finding = db.session.query(Findings.id).filter_by(project_id=project).first().id
+    client.delete(f'/finding/{finding}')
+    assert stats(client, project)['total'] == 2
+
+
+def test_deleting_a_project_drops_its_counters(app, client, make_project):
+    project = make_project(findings=3)
+    other = make_project(findings=2, name='Other')
+    client.delete(f'/project/{project}')
+    with app.app_context():
+        assert {project_id for (project_id,) in db.session.query(ProjectStat.project_id)} == {other}
+    assert stats(client, other)['total'] == 2
+
+
+def test_project_delete_statements_do_not_grow_with_findings(client, make_project, sql_profiles):
+    for count in (2, 25):
+        assert client.delete(f'/project/{make_project(findings=count)}').status_code == 200
+    small, large = sql_profiles
+    assert large['queries'] == small['queries']
+    assert not large['repeated']
+
+
+def test_unsupported_dialect_counts_live(app, client, seed, make_project, monkeypatch):
+    monkeypatch.delitem(stats_module.INSERTS, 'sqlite')
+    project = make_project(findings=2)
+    finding = {'title': 'New', 'description': {'blocks': []}, 'project_id': project,
+               'category_id': seed['category'], 'severity_id': seed['severity']}
+    assert client.post('/findings', json=finding).status_code == 201
+    with app.app_context():
+        ids = [finding_id for (finding_id,) in db.session.query(Findings.id).filter_by(project_id=project)]
+    assert client.put(f'/finding/{ids[0]}', json=dict(finding, category_id=None)).status_code == 200
+    assert client.delete(f'/finding/{ids[1]}').status_code == 200
+    with app.app_context():
+        assert db.session.query(ProjectStat).count() == 0
+    counts = stats(client, project)
+    assert counts['total'] == 2
+    assert [(entry['id'], entry['count']) for entry in counts['severity']] == [(seed['severity'], 2)]
+    assert sorted(entry['count'] for entry in counts['category']) == [1, 1]
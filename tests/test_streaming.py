@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from models import db
+
+
+def checked_out(app):
+    with app.app_context():
+        return db.engine.pool.checkedout()
+
+
+def test_ndjson_stream(app, client, make_project):
+    make_project(findings=5)
+    response = client.get('/findings?stream=1')
+    lines = response.get_data(as_text=True).splitlines()
+    response.close()
+    assert response.mimetype == 'application/x-ndjson'
+    assert len([json.loads(line) for line in lines]) == 5
+
+
+@pytest.mark.parametrize('path', ['/findings?stream=1', '/projects?stream=1', '/project/{project}/export.zip'])
+def test_streamed_body_returns_its_connection(app, client, make_project, path):
+    project = make_project(findings=3)
+    before = checked_out(app)
+    response = client.get(path.format(project=project))
+    assert response.status_code == 200
+    response.get_data()
+    response.close()
+    assert checked_out(app) == before
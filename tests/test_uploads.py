@@ -0,0 +1,33 @@
+import io
+
+import pytest
+
+
+def upload(client, data, content_type):
+    return client.post('/api/uploadFile', content_type='multipart/form-data',
+                       data={'image': (io.BytesIO(data), 'shot.png', content_type)})
+
+
+def test_upload(client):
+    response = upload(client, b'\x89PNG\r\n\x1a\n', 'image/png')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['success'] == 1 and '/api/image/' in body['file']['url']
+
+
+@pytest.mark.parametrize('data, content_type, status', [
+    (b'<svg/>', 'image/svg+xml', 415),
+    (b'\x89PNG' + b'\0' * 64, 'image/png', 413),
+])
+def test_rejected_upload_uses_the_editor_shape(app, client, monkeypatch, data, content_type, status):
+    monkeypatch.setitem(app.config, 'UPLOAD_MAX_BYTES', 32)
+    response = upload(client, data, content_type)
+    assert response.status_code == status
+    body = response.get_json()
+    assert body['success'] == 0 and body['message']
+
+
+def test_no_file(client):
+    response = client.post('/api/uploadFile', data={})
+    assert response.status_code == 400
+    assert response.get_json()['success'] == 0
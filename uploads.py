@@ -0,0 +1,152 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from image_store import CHUNK_SIZE, UploadTooLarge, copy_stream
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+# resumable uploads: each session is a directory under <image store>/uploads holding
+# meta.json and data.part, chunks are appended in order and hashed as they are written
+class UploadSessions:
+    def __init__(self, app=None):
+        self.store = None
+        self._hashers = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.store = app.extensions['image_store']
+        self.root = os.path.join(self.store.root, 'uploads')
+        self.max_bytes = app.config['UPLOAD_MAX_BYTES']
+        self.allowed_types = app.config['UPLOAD_ALLOWED_TYPES']
+        self.ttl = app.config['UPLOAD_SESSION_TTL']
+        os.makedirs(self.root, exist_ok=True)
+        app.extensions['upload_sessions'] = self
+
+    def check(self, content_type, size=None):
+        if content_type not in self.allowed_types:
+            raise UploadError(f'Content type {content_type} is not allowed', 415)
+        if size is not None and size > self.max_bytes:
+            raise UploadError(f'File exceeds the {self.max_bytes} byte limit', 413)
+
+    def create(self, filename, content_type, size):
+        self.check(content_type, size)
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._dir(upload_id))
+        meta = {'filename': filename, 'content_type': content_type, 'size': size, 'created_at': time.time()}
+        with open(self._meta_path(upload_id), 'w') as f:
+            json.dump(meta, f)
+        open(self._part_path(upload_id), 'wb').close()
+        return upload_id
+
+    def status(self, upload_id):
+        meta = self._meta(upload_id)
+        return dict(meta, upload_id=upload_id, offset=os.path.getsize(self._part_path(upload_id)))
+
+    def append(self, upload_id, offset, stream):
+        meta = self._meta(upload_id)
+        limit = meta['size'] if meta['size'] is not None else self.max_bytes
+        with open(self._part_path(upload_id), 'ab') as out:
+            try:
+                fcntl.flock(out, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError('Another chunk is being written to this upload', 409)
+            current = out.tell()
+            if offset != current:
+                raise UploadError('Chunk offset does not match the uploaded size', 409, offset=current)
+            hasher = self._hasher(upload_id, current)
+            try:
+                size = copy_stream(stream, out, hasher, limit, current)
+            except UploadTooLarge as error:
+                out.truncate(current)
+                self._remember(upload_id, current, None)
+                raise UploadError(str(error), 413)
+            except BaseException:
+                # a dropped connection leaves a partial chunk, the hash is rebuilt on the next append
+                self._remember(upload_id, None, None)
+                raise
+            self._remember(upload_id, size, hasher)
+        return size
+
+    def finalize(self, upload_id):
+        meta = self._meta(upload_id)
+        part_path = self._part_path(upload_id)
+        size = os.path.getsize(part_path)
+        if meta['size'] is not None and size != meta['size']:
+            raise UploadError('Upload is incomplete', 409, offset=size)
+        digest = self._hasher(upload_id, size).hexdigest()
+        self.store.adopt(part_path, digest)
+        self.discard(upload_id)
+        return meta, digest, size
+
+    def discard(self, upload_id):
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        for upload_id in os.listdir(self.root):
+            try:
+                expired = os.path.getmtime(self._part_path(upload_id)) < cutoff
+            except (OSError, UploadError):
+                continue
+            if expired:
+                self.discard(upload_id)
+
+    def _hasher(self, upload_id, size):
+        with self._lock:
+            cached = self._hashers.get(upload_id)
+        if cached and cached[0] == size:
+            return cached[1]
+        # another worker wrote the earlier chunks, rebuild the hash from disk once
+        hasher = hashlib.sha256()
+        with open(self._part_path(upload_id), 'rb') as f:
+            while f.tell() < size:
+                chunk = f.read(min(CHUNK_SIZE, size - f.tell()))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+        return hasher
+
+    def _remember(self, upload_id, size, hasher):
+        with self._lock:
+            if hasher is None:
+                self._hashers.pop(upload_id, None)
+            else:
+                self._hashers[upload_id] = (size, hasher)
+
+    def _meta(self, upload_id):
+        try:
+            with open(self._meta_path(upload_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError('Upload not found', 404)
+
+    def _dir(self, upload_id):
+        if not upload_id.isalnum():
+            raise UploadError('Upload not found', 404)
+        return os.path.join(self.root, upload_id)
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self._dir(upload_id), 'meta.json')
+
+    def _part_path(self, upload_id):
+        return os.path.join(self._dir(upload_id), 'data.part')
+
+
+upload_sessions = UploadSessions()